@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,6 +50,13 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.querycount.QueryCountMiddleware',
+]
+
+AUTHENTICATION_BACKENDS = [
+    'core.backends.ClinicBackend',
+    # keeps sessions created before ClinicBackend was added logged in
+    'django.contrib.auth.backends.ModelBackend',
 ]
 
 ROOT_URLCONF = 'clinic_project.urls'
@@ -77,9 +86,31 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # wait for the write lock instead of failing with "database is locked"; bookings
+            # take it when their transaction starts (core.sqlite.write_transaction)
+            'timeout': 20,
+        },
+        # a file rather than in-memory, so threaded tests see real SQLite locking
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        # keep each thread's connection (and its pragmas) between requests
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Applied to every new SQLite connection; see core/sqlite.py. {} keeps SQLite's defaults.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -16000,
+    'temp_store': 'MEMORY',
+}
+# Databases whose journal mode (stored in the file) is left as is; they run with synchronous=FULL
+SQLITE_KEEP_JOURNAL_MODE = []
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -127,7 +158,56 @@ LOGIN_REDIRECT_URL = '/appointment/'  # Where to go after login
 
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / "core" / "static"]
+# `manage.py collectstatic` writes hashed, precompressed files here (see core/storage.py)
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'core.storage.StaticAssetStorage'},
+}
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Rendered prescription PDFs are cached on disk, keyed by a hash of their inputs
+PRESCRIPTION_PDF_CACHE_DIR = BASE_DIR / '.cache' / 'prescription_pdfs'
+PRESCRIPTION_PDF_CACHE_MAX_BYTES = 50 * 1024 * 1024
+# Worker processes used by the "Export prescriptions as PDF archive" admin action (None = one per CPU)
+PRESCRIPTION_PDF_EXPORT_WORKERS = None
+# Optional JSON file ([{"name", "strengths", "type"}, ...]) used instead of the built-in drug list for medication search
+MEDICATION_FORMULARY = None
+
+# Outgoing email is queued in the database and sent by `manage.py send_outbox`
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_BASE_SECONDS = 30
+
+# How long picking a time on the booking form holds that slot for the user
+SLOT_HOLD_SECONDS = 300
+# How many days past the preferred date the auto-assignment may move an appointment
+ASSIGNMENT_SEARCH_DAYS = 7
+# Upper bound on how long a vet's cached dashboard schedule lives (changes invalidate it sooner)
+DOCTOR_SCHEDULE_CACHE_SECONDS = 600
+# Live dashboard updates (/doctor-dashboard/events/) need the ASGI app, e.g. `uvicorn clinic_project.asgi:application`
+DASHBOARD_EVENTS_KEEPALIVE_SECONDS = 15
+# Appointments per page in the profile history
+PROFILE_HISTORY_PAGE_SIZE = 20
+# The appointment admin switches to estimated counts and cached date links from this many rows
+ADMIN_LARGE_TABLE_ROWS = 50000
+ADMIN_COUNT_LIMIT = 10000
+ADMIN_DATE_FACETS_CACHE_SECONDS = 300
+# Log repeated query shapes (likely N+1) per request to the "core.queries" logger and add X-Query-Count
+QUERY_INSPECTOR_ENABLED = DEBUG
+# Each worker process writes its metrics here so /metrics can add them up; clear it when restarting the server
+METRICS_DIR = BASE_DIR / '.cache' / 'metrics'
+METRICS_FLUSH_SECONDS = 5
+# The public marketing pages are served from a full-page cache for this long (0 turns it off)
+PAGE_CACHE_SECONDS = 3600
+# Widths of the WebP copies collectstatic makes of each image under static/images/
+STATIC_IMAGE_WIDTHS = [150, 300, 450]
+# Funnel the busiest writes through one writer thread per process that group-commits them (see core/writes.py)
+WRITE_QUEUE_ENABLED = False
+WRITE_QUEUE_MAX_BATCH = 64
+# How long a request waits for its queued write before giving up
+WRITE_QUEUE_TIMEOUT = 30
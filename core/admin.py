@@ -1,14 +1,25 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from .models import Vet
-from .models import Appointment
+from .models import Appointment, PrescriptionMedication, OutboxEmail, VetDaySchedule, SlotHold
+from . import availability, outbox, rollups
+from .assignment import assign_pending
+from .changelist import EstimatedCountPaginator, is_large_table, with_cached_date_facets
+from .writes import run_write
 from .views import send_confirmation_email,send_cancellation_email,send_completed_email
-from .utils import generate_daily_slots
+from .utils import generate_daily_slots, PRESCRIPTION_SECTIONS
+from .pdf import pdf_cache, stream_prescription_zip
+from .exports import (
+    APPOINTMENT_CSV_HEADER, PRESCRIPTION_CSV_HEADER, appointment_csv_rows, appointment_jsonl_rows,
+    prescription_csv_rows, stream_csv, stream_jsonl,
+)
 from django import forms
-import csv
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.utils.html import format_html
 from django.urls import reverse
 from django.contrib.admin import SimpleListFilter
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import BooleanField, Count, ExpressionWrapper, Q
+from django.db.models.functions import Trim
 
 from django.utils import timezone
 from datetime import timedelta, datetime
@@ -71,7 +82,18 @@ class AppointmentAdminForm(forms.ModelForm):
             self.fields['assigned_doctor'].queryset = Vet.objects.filter(specialty=self.instance.service)
 
 
-        slot_choices = [(t, t.strftime('%I:%M %p')) for t in generate_daily_slots()]
+        booked = 0
+        if self.instance.assigned_doctor_id and self.instance.assigned_date:
+            booked = VetDaySchedule.objects.filter(
+                vet_id=self.instance.assigned_doctor_id, date=self.instance.assigned_date
+            ).values_list('booked_mask', flat=True).first() or 0
+            if self.instance.assigned_time in availability.SLOT_BITS:
+                booked &= ~availability.SLOT_BITS[self.instance.assigned_time]
+
+        slot_choices = [
+            (t, t.strftime('%I:%M %p') + (' (booked)' if booked & availability.SLOT_BITS[t] else ''))
+            for t in generate_daily_slots()
+        ]
         self.fields['assigned_time'].widget = forms.Select(choices=slot_choices)
         
 
@@ -96,9 +118,45 @@ class AppointmentAdminForm(forms.ModelForm):
                 raise forms.ValidationError(
                     f"Dr. {assigned_doctor.name} is already assigned to an appointment at this time."
                 )
-                             
+
+class PrescriptionMedicationInline(admin.TabularInline):
+    model = PrescriptionMedication
+    fields = ('position', 'drug_name', 'strength', 'sig')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class AppointmentChangeList(ChangeList):
+    # text columns the list never shows
+    HEAVY_FIELDS = ('prescription', 'reason', 'chief_complaint', 'medications', 'instructions', 'follow_up')
+
+    def __init__(self, request, *args, **kwargs):
+        self.large_table = is_large_table(Appointment)
+        super().__init__(request, *args, **kwargs)
+
+    def get_queryset(self, request, exclude_parameters=None):
+        queryset = super().get_queryset(request, exclude_parameters)
+        return with_cached_date_facets(queryset) if self.large_table else queryset
+
+    def get_results(self, request):
+        self.queryset = self.queryset.defer(*self.HEAVY_FIELDS).alias(
+            prescription_text=Trim('prescription')
+        ).annotate(
+            has_prescription=ExpressionWrapper(~Q(prescription_text=''), output_field=BooleanField())
+        )
+        super().get_results(request)
+
+
 class AppointmentAdmin(admin.ModelAdmin):
     form = AppointmentAdminForm
+    inlines = [PrescriptionMedicationInline]
+    list_select_related = ('assigned_doctor',)
+    # the "N total" link costs a second COUNT(*) of the whole table
+    show_full_result_count = False
     list_display = (
         'appointment_id',
         'assigned_date',
@@ -113,7 +171,7 @@ class AppointmentAdmin(admin.ModelAdmin):
         'email_link',     
     )
 
-    readonly_fields = ('appointment_id',)
+    readonly_fields = ('appointment_id', 'prescription')
     list_filter = (
         UpcomingAppointmentFilter,
         'status',
@@ -122,7 +180,7 @@ class AppointmentAdmin(admin.ModelAdmin):
         'completion_status',
         'assigned_doctor'
     )
-    search_fields = ('appointment_id', 'owner_name', 'pet_name', 'phone', 'email')
+    search_fields = ('appointment_id', 'owner_name', 'pet_name', 'phone', 'email', 'diagnosis', '=medication_lines__drug_name')
 
     def status_colored(self, obj):
         colors = {
@@ -150,11 +208,14 @@ class AppointmentAdmin(admin.ModelAdmin):
     email_link.short_description = 'Email'
 
     def has_prescription(self, obj):
+        # annotated by AppointmentChangeList so the list doesn't load the text
+        if hasattr(obj, 'has_prescription'):
+            return obj.has_prescription
         return bool(obj.prescription.strip())
     has_prescription.boolean = True
     has_prescription.short_description = 'Prescription'
     def view_prescription_link(self, obj):
-        if obj.prescription.strip():
+        if self.has_prescription(obj):
             url = reverse('prescription_pdf', args=[obj.appointment_id])
             return format_html('<a class="button" href="{}" target="_blank">Prescription</a>', url)
         return "No prescription"
@@ -169,78 +230,96 @@ class AppointmentAdmin(admin.ModelAdmin):
                 send_cancellation_email(obj)
             if original.status != 'completed' and obj.status == 'completed':
                 send_completed_email(obj)
+        prescription_changed = any(field in form.changed_data for field in PRESCRIPTION_SECTIONS)
+        if prescription_changed:
+            obj.prescription = obj.compose_prescription()
         super().save_model(request, obj, form, change)
+        if prescription_changed:
+            obj.sync_medication_lines()
+            pdf_cache.invalidate(obj.appointment_id)
         
     
-    actions = ['confirm_selected', 'cancel_selected', 'complete_selected', 'export_as_csv', 'export_prescriptions_csv']
+    actions = ['auto_assign_selected', 'confirm_selected', 'cancel_selected', 'complete_selected', 'export_as_csv', 'export_as_jsonl', 'export_prescriptions_csv', 'export_prescriptions_pdf_zip']
    
+    def _set_status(self, queryset, status, send_email):
+        def apply():
+            # loaded before the update: re-reading a queryset filtered on status afterwards
+            # would miss the rows that just changed
+            with outbox.batched():
+                appointments = list(queryset.select_related('assigned_doctor'))
+                queryset.update(status=status)
+                availability.rebuild((a.assigned_doctor_id, a.assigned_date) for a in appointments)
+                rollups.rebuild(a.assigned_date or a.preferred_date for a in appointments)
+                for appointment in appointments:
+                    appointment.status = status
+                    send_email(appointment)
+            return appointments
+
+        return run_write(apply)
+
+    @admin.action(description='Auto-assign vets and times to selected pending appointments')
+    def auto_assign_selected(self, request, queryset):
+        assigned, unassigned = assign_pending(queryset)
+        self.message_user(request, f'{len(assigned)} appointments assigned.')
+        if unassigned:
+            self.message_user(
+                request, f'{len(unassigned)} appointments have no free vet nearby and were left unassigned.',
+                level=messages.WARNING,
+            )
+
     @admin.action(description='Mark selected appointments as completed')
     def complete_selected(self, request, queryset):
-        updated = queryset.update(status='completed')
-        for appointment in queryset:
-            send_completed_email(appointment)
-        self.message_user(request, f'{updated} appointments completed.')
+        appointments = self._set_status(queryset, 'completed', send_completed_email)
+        self.message_user(request, f'{len(appointments)} appointments completed.')
     
     @admin.action(description='Mark selected appointments as confirmed')
     def confirm_selected(self, request, queryset):
-        updated = queryset.update(status='confirmed')
-        for appointment in queryset:
-            send_confirmation_email(appointment)
-        self.message_user(request, f'{updated} appointments confirmed.')
+        appointments = self._set_status(queryset, 'confirmed', send_confirmation_email)
+        self.message_user(request, f'{len(appointments)} appointments confirmed.')
     
     @admin.action(description='Mark selected appointments as cancelled')
     def cancel_selected(self, request, queryset):
-        updated = queryset.update(status='cancelled')
-        for appointment in queryset:
-            send_cancellation_email(appointment)
-        self.message_user(request, f'{updated} appointments cancelled.')
+        appointments = self._set_status(queryset, 'cancelled', send_cancellation_email)
+        self.message_user(request, f'{len(appointments)} appointments cancelled.')
     
     @admin.action(description='Export selected appointments to CSV')
     def export_as_csv(self, request, queryset):
-        response = HttpResponse(content_type='text/csv')
+        response = StreamingHttpResponse(
+            stream_csv(APPOINTMENT_CSV_HEADER, appointment_csv_rows(queryset)),
+            content_type='text/csv'
+        )
         response['Content-Disposition'] = 'attachment; filename="appointments.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow(['ID', 'Owner', 'Pet', 'Date', 'Time', 'Service', 'Doctor', 'Status'])
-        
-        for obj in queryset:
-            writer.writerow([
-                obj.appointment_id,
-                obj.owner_name,
-                obj.pet_name,
-                obj.assigned_date.strftime('%Y-%m-%d') if obj.assigned_date else '',
-                obj.assigned_time.strftime('%H:%M') if obj.assigned_time else '',
-                obj.get_service_display(),
-                obj.assigned_doctor.name if obj.assigned_doctor else '',
-                obj.get_status_display()
-            ])
-        
+        return response
+    
+    @admin.action(description='Export selected appointments to JSON Lines')
+    def export_as_jsonl(self, request, queryset):
+        response = StreamingHttpResponse(
+            stream_jsonl(appointment_jsonl_rows(queryset)),
+            content_type='application/x-ndjson'
+        )
+        response['Content-Disposition'] = 'attachment; filename="appointments.jsonl"'
         return response
     
     @admin.action(description='Export prescriptions to CSV')
     def export_prescriptions_csv(self, request, queryset):
-
-        queryset_with_prescriptions = queryset.exclude(prescription='')
-        
-        response = HttpResponse(content_type='text/csv')
+        response = StreamingHttpResponse(
+            stream_csv(PRESCRIPTION_CSV_HEADER, prescription_csv_rows(queryset)),
+            content_type='text/csv'
+        )
         response['Content-Disposition'] = 'attachment; filename="prescriptions.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow(['Appointment ID', 'Date', 'Owner', 'Pet', 'Doctor', 'Prescription'])
-        
-        for obj in queryset_with_prescriptions:
-            writer.writerow([
-                obj.appointment_id,
-                obj.assigned_date.strftime('%Y-%m-%d') if obj.assigned_date else obj.preferred_date.strftime('%Y-%m-%d'),
-                obj.owner_name,
-                obj.pet_name,
-                obj.assigned_doctor.name if obj.assigned_doctor else '',
-                obj.prescription.replace('\n', ' | ')  
-            ])
-        
-        self.message_user(request, f'Exported {queryset_with_prescriptions.count()} prescriptions.')
         return response
     
+    @admin.action(description='Export prescriptions as PDF archive')
+    def export_prescriptions_pdf_zip(self, request, queryset):
+        appointments = queryset.exclude(prescription='').select_related('assigned_doctor')
+
+        response = StreamingHttpResponse(
+            stream_prescription_zip(appointments.iterator(chunk_size=200)),
+            content_type='application/zip'
+        )
+        response['Content-Disposition'] = 'attachment; filename="prescriptions.zip"'
+        return response
+
     def view_receipt_link(self, obj):
         url = reverse('receipt', args=[obj.appointment_id])
         return format_html('<a class="button" href="{}" target="_blank">Receipt</a>', url)
@@ -263,12 +342,21 @@ class AppointmentAdmin(admin.ModelAdmin):
         request._obj_ = obj
         return super().get_form(request, obj, **kwargs)
 
+    def get_changelist(self, request, **kwargs):
+        return AppointmentChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if is_large_table(Appointment):
+            return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
 admin.site.register(Appointment, AppointmentAdmin)
 
 
 @admin.register(Vet)
 class VetAdmin(admin.ModelAdmin):
     list_display = ('name', 'specialty', 'email', 'phone', 'linked_user', 'appointment_count')
+    list_select_related = ('user',)
     list_filter = ('specialty',)
     search_fields = ('name', 'email')
 
@@ -280,6 +368,33 @@ class VetAdmin(admin.ModelAdmin):
         return "No user account"
     linked_user.short_description = 'User Account'
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(appointment_total=Count('appointment'))
+
     def appointment_count(self, obj):
-        return obj.appointment_set.count()
-    appointment_count.short_description = 'Appointments'
\ No newline at end of file
+        return obj.appointment_total
+    appointment_count.short_description = 'Appointments'
+    appointment_count.admin_order_field = 'appointment_total'
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to', 'subject')
+    readonly_fields = ('created_at', 'sent_at', 'last_error')
+    actions = ['retry_selected']
+
+    @admin.action(description='Retry selected emails now')
+    def retry_selected(self, request, queryset):
+        updated = queryset.exclude(status='sent').update(
+            status='pending', attempts=0, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f'{updated} emails queued for retry.')
+
+
+@admin.register(SlotHold)
+class SlotHoldAdmin(admin.ModelAdmin):
+    list_display = ('preferred_date', 'preferred_time', 'user', 'expires_at')
+    list_select_related = ('user',)
+    ordering = ('preferred_date', 'preferred_time')
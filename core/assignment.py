@@ -0,0 +1,118 @@
+"""
+Batch assignment of pending appointments to vets.
+
+Each unassigned pending appointment gets a vet whose specialty matches its
+service and a free slot as close as possible to the requested date and
+time, trying up to ASSIGNMENT_SEARCH_DAYS later days and never a slot that
+has already started. Among the vets free at that slot, the one with the
+fewest bookings that day (then the fewest assignments in this run) is
+picked, so work is spread evenly.
+
+Free slots come from the VetDaySchedule bitmasks, read in one query and
+updated in memory as appointments are placed. The results are written with
+one bulk_update inside the same transaction, and the masks are then
+rebuilt for the touched (vet, date) pairs, and the daily rollups for the
+touched days.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import availability, rollups
+from .models import Appointment, Vet, VetDaySchedule
+from .utils import DAILY_SLOTS
+
+ASSIGNED_FIELDS = ['assigned_doctor', 'assigned_date', 'assigned_time']
+
+
+def _minutes(at):
+    return at.hour * 60 + at.minute
+
+
+def _slots_nearest(at):
+    """DAILY_SLOTS ordered by distance from `at`, earlier first on ties."""
+    return sorted(DAILY_SLOTS, key=lambda slot: (abs(_minutes(slot) - _minutes(at)), slot))
+
+
+def assign_pending(queryset=None, search_days=None, now=None):
+    """
+    Assign every unassigned pending appointment in `queryset` (default: all),
+    to slots after `now` (default: the current local time).
+
+    Returns (assigned, unassigned) lists of Appointment objects.
+    """
+    if queryset is None:
+        queryset = Appointment.objects.all()
+    if search_days is None:
+        search_days = getattr(settings, 'ASSIGNMENT_SEARCH_DAYS', 7)
+    now = timezone.localtime(now)
+    today = now.date()
+
+    with transaction.atomic():
+        pending = list(
+            queryset.filter(status='pending', assigned_doctor__isnull=True)
+            .order_by('preferred_date', 'preferred_time', 'pk')
+            .only('pk', 'service', 'preferred_date', 'preferred_time', *ASSIGNED_FIELDS)
+        )
+        if not pending:
+            return [], []
+
+        vets_by_service = defaultdict(list)
+        for vet_id, specialty in Vet.objects.order_by('pk').values_list('id', 'specialty'):
+            vets_by_service[specialty].append(vet_id)
+
+        first_day = max(today, pending[0].preferred_date)
+        last_day = max(today, pending[-1].preferred_date) + timedelta(days=search_days)
+        masks = defaultdict(int)
+        masks.update(
+            ((vet_id, day), mask)
+            for vet_id, day, mask in VetDaySchedule.objects.filter(
+                date__range=(first_day, last_day)
+            ).values_list('vet_id', 'date', 'booked_mask')
+        )
+
+        run_load = Counter()
+        nearest = {}
+        assigned, unassigned = [], []
+        for appointment in pending:
+            vets = vets_by_service.get(appointment.service)
+            start = max(today, appointment.preferred_date)
+            if appointment.preferred_time not in nearest:
+                nearest[appointment.preferred_time] = _slots_nearest(appointment.preferred_time)
+            choice = vets and _find_slot(
+                vets, start, search_days, nearest[appointment.preferred_time], masks, run_load, now
+            )
+            if not choice:
+                unassigned.append(appointment)
+                continue
+
+            vet_id, day, slot = choice
+            masks[vet_id, day] |= availability.SLOT_BITS[slot]
+            run_load[vet_id] += 1
+            appointment.assigned_doctor_id = vet_id
+            appointment.assigned_date = day
+            appointment.assigned_time = slot
+            assigned.append(appointment)
+
+        Appointment.objects.bulk_update(assigned, ASSIGNED_FIELDS, batch_size=500)
+        availability.rebuild((a.assigned_doctor_id, a.assigned_date) for a in assigned)
+        # each moves from its preferred date, unassigned, to its assigned date and vet
+        rollups.rebuild([a.preferred_date for a in assigned] + [a.assigned_date for a in assigned])
+    return assigned, unassigned
+
+
+def _find_slot(vets, start, search_days, slots, masks, run_load, now):
+    for offset in range(search_days + 1):
+        day = start + timedelta(days=offset)
+        for slot in slots:
+            if day == now.date() and slot <= now.time():
+                continue
+            bit = availability.SLOT_BITS[slot]
+            free = [vet_id for vet_id in vets if not masks[vet_id, day] & bit]
+            if free:
+                vet_id = min(free, key=lambda v: (masks[v, day].bit_count(), run_load[v], v))
+                return vet_id, day, slot
+    return None
@@ -0,0 +1,146 @@
+"""
+Per-vet, per-day slot availability.
+
+Each VetDaySchedule row keeps a bitmask over DAILY_SLOTS (bit i set = slot i
+taken). Saves and deletes of an Appointment update it through signals. Bulk
+queryset.update() calls bypass signals, so they must call rebuild() for the
+(vet, date) pairs they touched; rebuild() also drops those vets' cached
+dashboard schedules.
+
+availability() also takes out the slots no one can book, whatever the vets'
+masks say: preferred (date, time) pairs are unique across every
+appointment, including pending ones without a vet, and a live SlotHold
+reserves its slot for the user holding it.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Appointment, SlotHold, Vet, VetDaySchedule
+from .schedule import invalidate_schedules
+from .utils import DAILY_SLOTS
+
+SLOT_BITS = {slot: 1 << i for i, slot in enumerate(DAILY_SLOTS)}
+FULL_DAY = (1 << len(DAILY_SLOTS)) - 1
+
+
+def booked_slot(doctor_id, day, at, status):
+    """The (vet, date, bit) an appointment occupies, or None."""
+    if doctor_id and day and at in SLOT_BITS and status != 'cancelled':
+        return doctor_id, day, SLOT_BITS[at]
+    return None
+
+
+def apply_change(old, new):
+    """Move an appointment's slot from `old` to `new` (either may be None)."""
+    if old == new:
+        return
+    if old:
+        vet_id, day, bit = old
+        VetDaySchedule.objects.filter(vet_id=vet_id, date=day).update(
+            booked_mask=F('booked_mask').bitand(~bit & FULL_DAY)
+        )
+    if new:
+        vet_id, day, bit = new
+        updated = VetDaySchedule.objects.filter(vet_id=vet_id, date=day).update(
+            booked_mask=F('booked_mask').bitor(bit)
+        )
+        if not updated:
+            _, created = VetDaySchedule.objects.get_or_create(
+                vet_id=vet_id, date=day, defaults={'booked_mask': bit}
+            )
+            if not created:
+                VetDaySchedule.objects.filter(vet_id=vet_id, date=day).update(
+                    booked_mask=F('booked_mask').bitor(bit)
+                )
+
+
+def rebuild(pairs):
+    """Recompute the masks for the given (vet_id, date) pairs from the appointments."""
+    pairs = {(vet_id, day) for vet_id, day in pairs if vet_id and day}
+    if not pairs:
+        return
+    masks = dict.fromkeys(pairs, 0)
+    rows = Appointment.objects.filter(
+        assigned_doctor_id__in={vet_id for vet_id, day in pairs},
+        assigned_date__in={day for vet_id, day in pairs},
+    ).exclude(status='cancelled').values_list('assigned_doctor_id', 'assigned_date', 'assigned_time')
+    for vet_id, day, at in rows:
+        if (vet_id, day) in masks and at in SLOT_BITS:
+            masks[vet_id, day] |= SLOT_BITS[at]
+
+    with transaction.atomic():
+        existing = {
+            (row.vet_id, row.date): row
+            for row in VetDaySchedule.objects.filter(
+                vet_id__in={vet_id for vet_id, day in pairs},
+                date__in={day for vet_id, day in pairs},
+            )
+        }
+        changed, created = [], []
+        for key, mask in masks.items():
+            row = existing.get(key)
+            if row is None:
+                created.append(VetDaySchedule(vet_id=key[0], date=key[1], booked_mask=mask))
+            elif row.booked_mask != mask:
+                row.booked_mask = mask
+                changed.append(row)
+        VetDaySchedule.objects.bulk_create(created)
+        VetDaySchedule.objects.bulk_update(changed, ['booked_mask'])
+        invalidate_schedules(vet_id for vet_id, day in pairs)
+
+
+def free_slots(mask):
+    return [slot for slot, bit in SLOT_BITS.items() if not mask & bit]
+
+
+def taken_masks(start, end, user=None):
+    """
+    {date: mask} of the preferred slots from start to end that cannot be
+    booked: already requested by any appointment, or held by someone other
+    than `user`.
+    """
+    masks = defaultdict(int)
+    taken = Appointment.objects.filter(preferred_date__range=(start, end)).values_list(
+        'preferred_date', 'preferred_time'
+    )
+    holds = SlotHold.objects.filter(preferred_date__range=(start, end), expires_at__gt=timezone.now())
+    if user is not None and user.is_authenticated:
+        holds = holds.exclude(user=user)
+    for day, at in [*taken, *holds.values_list('preferred_date', 'preferred_time')]:
+        masks[day] |= SLOT_BITS.get(at, 0)
+    return masks
+
+
+def availability(service, start, end, user=None):
+    """
+    Bookable slots for every vet of `service`, for each day from start to end.
+
+    A slot is free for a vet when their mask has it clear and taken_masks()
+    does too; `user`'s own hold stays free for them. Returns
+    [{'date', 'vets': [{'id', 'name', 'free'}], 'free'}] using four queries.
+    """
+    vets = list(Vet.objects.filter(specialty=service).order_by('name').values_list('id', 'name'))
+    masks = dict(
+        ((vet_id, day), mask)
+        for vet_id, day, mask in VetDaySchedule.objects.filter(
+            vet_id__in=[vet_id for vet_id, name in vets], date__range=(start, end)
+        ).values_list('vet_id', 'date', 'booked_mask')
+    )
+    taken = taken_masks(start, end, user)
+
+    days = []
+    day = start
+    while day <= end:
+        open_any = 0
+        per_vet = []
+        for vet_id, name in vets:
+            mask = masks.get((vet_id, day), 0) | taken[day]
+            open_any |= ~mask & FULL_DAY
+            per_vet.append({'id': vet_id, 'name': name, 'free': free_slots(mask)})
+        days.append({'date': day, 'vets': per_vet, 'free': free_slots(~open_any & FULL_DAY)})
+        day += timedelta(days=1)
+    return days
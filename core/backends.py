@@ -0,0 +1,14 @@
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+
+
+class ClinicBackend(ModelBackend):
+    """ModelBackend that loads the user's Vet record with the user, so doctor views can
+    check hasattr(request.user, 'vet') without another query."""
+
+    def get_user(self, user_id):
+        try:
+            user = User._default_manager.select_related('vet').get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,173 @@
+"""
+Prescription templates and the drug list used by the doctor dashboard.
+
+The catalogue is serialised once at import. CATALOGUE_VERSION is a hash of
+that JSON, so any edit to this file gives browsers a new version to fetch.
+"""
+import hashlib
+import json
+
+
+PRESCRIPTION_TEMPLATES = {
+    'antibiotics': {
+        'name': 'Bacterial Infection',
+        'diagnosis': 'Bacterial infection',
+        'medications': '''1. Amoxicillin 250mg
+   Sig: Give 1 capsule by mouth twice daily for 10 days
+
+2. Probiotics
+   Sig: Give 1 capsule by mouth once daily during antibiotic treatment''',
+        'instructions': 'Give with food to reduce stomach upset. Complete full course even if symptoms improve.',
+        'follow_up': 'Return in 10-14 days for recheck if symptoms persist'
+    },
+    'pain_inflammation': {
+        'name': 'Pain & Inflammation',
+        'diagnosis': 'Pain and inflammation',
+        'medications': '''1. Carprofen 75mg
+   Sig: Give 1 tablet by mouth once daily with food for 5-7 days
+
+2. Gabapentin 100mg (if severe pain)
+   Sig: Give 1 capsule by mouth twice daily as needed''',
+        'instructions': 'Monitor for appetite changes or vomiting. Discontinue if side effects occur.',
+        'follow_up': 'Return if no improvement in 3-5 days or if condition worsens'
+    },
+    'skin_condition': {
+        'name': 'Skin Condition',
+        'diagnosis': 'Dermatitis/skin irritation',
+        'medications': '''1. Medicated shampoo
+   Sig: Bathe twice weekly, leave on for 10 minutes before rinsing
+
+2. Topical cream
+   Sig: Apply thin layer to affected areas twice daily''',
+        'instructions': 'Keep area clean and dry. Prevent licking with cone if necessary.',
+        'follow_up': 'Return in 7-10 days for progress evaluation'
+    },
+    'dental': {
+        'name': 'Dental Care',
+        'diagnosis': 'Dental disease/tartar buildup',
+        'medications': '''1. Dental chews (prescription)
+   Sig: Give 1 chew daily
+
+2. Oral rinse
+   Sig: Add to water bowl as directed''',
+        'instructions': 'Begin regular tooth brushing routine. Avoid hard bones or toys.',
+        'follow_up': 'Schedule dental cleaning in 6 months'
+    },
+    'parasite': {
+        'name': 'Parasite Treatment',
+        'diagnosis': 'Intestinal parasites',
+        'medications': '''1. Deworming medication
+   Sig: Give as directed based on body weight
+
+2. Fecal exam in 2-3 weeks''',
+        'instructions': 'Pick up stool immediately. Wash hands after handling pet.',
+        'follow_up': 'Bring fresh stool sample in 2-3 weeks for recheck'
+    },
+    'allergy': {
+        'name': 'Allergy Management',
+        'diagnosis': 'Environmental allergies',
+        'medications': '''1. Apoquel 5.4mg
+   Sig: Give 1 tablet by mouth twice daily for 7 days, then once daily
+
+2. Antihistamine
+   Sig: Give 1 tablet by mouth once daily as needed for itching''',
+        'instructions': 'Reduce exposure to allergens. Bathe weekly with hypoallergenic shampoo.',
+        'follow_up': 'Return in 3-4 weeks for progress evaluation'
+    },
+    'ear_infection': {
+        'name': 'Ear Infection',
+        'diagnosis': 'Otitis externa',
+        'medications': '''1. Ear cleaner
+   Sig: Clean ears twice weekly
+
+2. Antibiotic/steroid ear drops
+   Sig: Apply 5 drops in affected ear twice daily for 7 days''',
+        'instructions': 'Keep ears dry. Do not use cotton swabs in ear canal.',
+        'follow_up': 'Return in 7-10 days for recheck'
+    },
+    'anxiety': {
+        'name': 'Anxiety Treatment',
+        'diagnosis': 'Generalized anxiety',
+        'medications': '''1. Trazodone 100mg
+   Sig: Give 1/2 to 1 tablet by mouth as needed for anxiety
+
+2. Adaptil diffuser
+   Sig: Use continuously in main living area''',
+        'instructions': 'Provide safe space. Use calming music during stressful events.',
+        'follow_up': 'Return in 4 weeks for behavior assessment'
+    }
+}
+
+# Expanded medications database
+MEDICATIONS = [
+    {'name': 'Acepromazine', 'strengths': ['10mg', '25mg'], 'type': 'Sedative'},
+    {'name': 'Amoxicillin', 'strengths': ['250mg', '500mg'], 'type': 'Antibiotic'},
+    {'name': 'Amitriptyline', 'strengths': ['10mg', '25mg'], 'type': 'Behavioral'},
+    {'name': 'Apoquel', 'strengths': ['3.6mg', '5.4mg', '16mg'], 'type': 'Anti-itch'},
+    {'name': 'Benazepril', 'strengths': ['2.5mg', '5mg', '10mg', '20mg'], 'type': 'Cardiac'},
+    {'name': 'Bravecto', 'strengths': ['112.5mg', '250mg', '500mg'], 'type': 'Flea/Tick Prevention'},
+    {'name': 'Buprenorphine', 'strengths': ['0.3mg/ml'], 'type': 'Pain Management'},
+    {'name': 'Butorphanol', 'strengths': ['5mg/ml', '10mg/ml'], 'type': 'Pain Management'},
+    {'name': 'Carprofen', 'strengths': ['25mg', '75mg', '100mg'], 'type': 'Anti-inflammatory'},
+    {'name': 'Cefpodoxime', 'strengths': ['100mg', '200mg'], 'type': 'Antibiotic'},
+    {'name': 'Cephalexin', 'strengths': ['250mg', '500mg'], 'type': 'Antibiotic'},
+    {'name': 'Cerenia', 'strengths': ['16mg', '24mg', '60mg'], 'type': 'Anti-nausea'},
+    {'name': 'Chloramphenicol', 'strengths': ['100mg', '250mg', '500mg'], 'type': 'Antibiotic'},
+    {'name': 'Clavamox', 'strengths': ['62.5mg', '125mg', '250mg'], 'type': 'Antibiotic'},
+    {'name': 'Clindamycin', 'strengths': ['25mg', '75mg', '150mg'], 'type': 'Antibiotic'},
+    {'name': 'Cyclosporine', 'strengths': ['10mg', '25mg', '50mg', '100mg'], 'type': 'Immunosuppressant'},
+    {'name': 'Denamarin', 'strengths': ['100mg', '225mg'], 'type': 'Liver Support'},
+    {'name': 'Diazepam', 'strengths': ['2mg', '5mg', '10mg'], 'type': 'Behavioral'},
+    {'name': 'Diphenhydramine', 'strengths': ['25mg'], 'type': 'Antihistamine'},
+    {'name': 'Doxycycline', 'strengths': ['50mg', '100mg'], 'type': 'Antibiotic'},
+    {'name': 'Enalapril', 'strengths': ['2.5mg', '5mg', '10mg', '20mg'], 'type': 'Cardiac'},
+    {'name': 'Enrofloxacin', 'strengths': ['22.7mg', '68mg'], 'type': 'Antibiotic'},
+    {'name': 'Famotidine', 'strengths': ['10mg'], 'type': 'Stomach Protection'},
+    {'name': 'Fluoxetine', 'strengths': ['10mg', '20mg'], 'type': 'Behavioral'},
+    {'name': 'Furosemide', 'strengths': ['12.5mg', '25mg', '50mg'], 'type': 'Diuretic'},
+    {'name': 'Gabapentin', 'strengths': ['100mg', '300mg'], 'type': 'Pain Management'},
+    {'name': 'Glipizide', 'strengths': ['5mg'], 'type': 'Diabetes'},
+    {'name': 'Hydrochlorothiazide', 'strengths': ['12.5mg', '25mg'], 'type': 'Diuretic'},
+    {'name': 'Hydroxyzine', 'strengths': ['10mg', '25mg'], 'type': 'Antihistamine'},
+    {'name': 'Insulin (Vetsulin)', 'strengths': ['40U/ml'], 'type': 'Diabetes'},
+    {'name': 'Itraconazole', 'strengths': ['100mg'], 'type': 'Antifungal'},
+    {'name': 'Ivermectin', 'strengths': ['68mcg', '136mcg'], 'type': 'Heartworm Prevention'},
+    {'name': 'Ketoconazole', 'strengths': ['200mg'], 'type': 'Antifungal'},
+    {'name': 'Levetiracetam', 'strengths': ['250mg', '500mg'], 'type': 'Seizure'},
+    {'name': 'Marbofloxacin', 'strengths': ['25mg', '50mg', '100mg'], 'type': 'Antibiotic'},
+    {'name': 'Maropitant', 'strengths': ['16mg', '24mg', '60mg'], 'type': 'Anti-nausea'},
+    {'name': 'Meloxicam', 'strengths': ['1.5mg/ml'], 'type': 'Anti-inflammatory'},
+    {'name': 'Metronidazole', 'strengths': ['250mg', '500mg'], 'type': 'Antibiotic/Anti-diarrheal'},
+    {'name': 'Methimazole', 'strengths': ['2.5mg', '5mg'], 'type': 'Thyroid'},
+    {'name': 'Milbemycin', 'strengths': ['2.3mg', '5.75mg', '11.5mg'], 'type': 'Heartworm Prevention'},
+    {'name': 'Mirtazapine', 'strengths': ['7.5mg', '15mg'], 'type': 'Appetite Stimulant'},
+    {'name': 'Omeprazole', 'strengths': ['10mg', '20mg'], 'type': 'Stomach Protection'},
+    {'name': 'Ondansetron', 'strengths': ['4mg', '8mg'], 'type': 'Anti-nausea'},
+    {'name': 'Orbifloxacin', 'strengths': ['5.7mg', '22.7mg', '68mg'], 'type': 'Antibiotic'},
+    {'name': 'Phenobarbital', 'strengths': ['16.2mg', '32.4mg', '64.8mg'], 'type': 'Seizure'},
+    {'name': 'Pimobendan', 'strengths': ['1.25mg', '2.5mg', '5mg'], 'type': 'Cardiac'},
+    {'name': 'Praziquantel', 'strengths': ['34mg', '136mg'], 'type': 'Dewormer'},
+    {'name': 'Prednisone', 'strengths': ['5mg', '10mg', '20mg'], 'type': 'Steroid'},
+    {'name': 'Pyrantel', 'strengths': ['50mg/ml'], 'type': 'Dewormer'},
+    {'name': 'Revolution', 'strengths': ['15mg', '30mg', '45mg'], 'type': 'Parasite Prevention'},
+    {'name': 'Rimadyl', 'strengths': ['25mg', '75mg', '100mg'], 'type': 'Anti-inflammatory'},
+    {'name': 'Samylin', 'strengths': ['100mg', '200mg'], 'type': 'Liver Support'},
+    {'name': 'Sildenafil', 'strengths': ['20mg', '25mg', '50mg', '100mg'], 'type': 'Cardiac'},
+    {'name': 'Simparica', 'strengths': ['5mg', '10mg', '20mg'], 'type': 'Flea/Tick Prevention'},
+    {'name': 'Spironolactone', 'strengths': ['25mg', '50mg', '100mg'], 'type': 'Diuretic'},
+    {'name': 'Sucralfate', 'strengths': ['1g'], 'type': 'Stomach Protection'},
+    {'name': 'Terbinafine', 'strengths': ['250mg'], 'type': 'Antifungal'},
+    {'name': 'Tramadol', 'strengths': ['50mg'], 'type': 'Pain Management'},
+    {'name': 'Trazodone', 'strengths': ['50mg', '100mg'], 'type': 'Behavioral'},
+    {'name': 'Thyroxine', 'strengths': ['0.1mg', '0.2mg', '0.3mg', '0.4mg', '0.5mg', '0.6mg', '0.7mg', '0.8mg'], 'type': 'Thyroid'},
+    {'name': 'Yunnan Baiyao', 'strengths': ['250mg'], 'type': 'Hemostatic'},
+]
+
+
+
+CATALOGUE_JSON = json.dumps(
+    {'templates': PRESCRIPTION_TEMPLATES, 'medications': MEDICATIONS, 'success': True},
+    sort_keys=True, separators=(',', ':'),
+).encode('utf-8')
+
+CATALOGUE_VERSION = hashlib.sha256(CATALOGUE_JSON).hexdigest()[:16]
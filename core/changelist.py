@@ -0,0 +1,121 @@
+"""
+Large-table support for the Appointment admin changelist.
+
+Once the table holds ADMIN_LARGE_TABLE_ROWS rows (estimated from table
+statistics, not counted), AppointmentAdmin switches to:
+
+- EstimatedCountPaginator: the unfiltered list is counted from statistics,
+  and filtered lists are counted only up to ADMIN_COUNT_LIMIT rows.
+- DateFacetQuerySet: the date hierarchy's year/month/day links and its
+  Min/Max range are cached for ADMIN_DATE_FACETS_CACHE_SECONDS, instead of
+  running DISTINCT date scans on every page load.
+
+Smaller tables keep Django's exact counts and live date links.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Min, QuerySet
+from django.utils.functional import cached_property
+
+from . import metrics
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def estimate_row_count(model, using='default'):
+    """
+    Approximate row count from the database's statistics, or None.
+
+    SQLite reads sqlite_stat1 (filled in by ANALYZE), falling back to the
+    highest primary key. PostgreSQL reads pg_class.reltuples.
+    """
+    key = f'admin-row-estimate:{using}:{model._meta.db_table}'
+    estimate = cache.get(key)
+    metrics.cache_lookup('admin_row_estimate', estimate is not None)
+    if estimate is not None:
+        return estimate
+
+    connection = connections[using]
+    table = model._meta.db_table
+    estimate = None
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            if cursor.fetchone():
+                # one row per index (idx is NULL only for tables without one), each
+                # starting with the rows it covers; partial indexes cover fewer
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [table])
+                counts = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+                if counts:
+                    estimate = max(counts)
+            if estimate is None:
+                cursor.execute('SELECT MAX(%s) FROM %s' % (
+                    connection.ops.quote_name(model._meta.pk.column), connection.ops.quote_name(table)
+                ))
+                estimate = cursor.fetchone()[0] or 0
+        elif connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+            row = cursor.fetchone()
+            # -1 until the table has been vacuumed or analyzed
+            if row and row[0] >= 0:
+                estimate = row[0]
+
+    if estimate is not None:
+        cache.set(key, estimate, 60)
+    return estimate
+
+
+def is_large_table(model):
+    estimate = estimate_row_count(model)
+    return estimate is not None and estimate >= _setting('ADMIN_LARGE_TABLE_ROWS', 50000)
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate is not None:
+                return estimate
+        # pages past the limit are not reachable; narrowing the filter brings them back
+        return queryset.order_by().values('pk')[:_setting('ADMIN_COUNT_LIMIT', 10000)].count()
+
+
+class DateFacetQuerySet(QuerySet):
+    """QuerySet whose dates() and Min/Max aggregates are cached by their SQL."""
+
+    def _facet_key(self, *parts):
+        sql, params = self.query.sql_with_params()
+        digest = hashlib.sha256(repr((sql, params, parts)).encode()).hexdigest()
+        return f'admin-date-facets:{digest}'
+
+    def dates(self, field_name, kind, order='ASC'):
+        key = self._facet_key('dates', field_name, kind, order)
+        result = cache.get(key)
+        metrics.cache_lookup('admin_date_facets', result is not None)
+        if result is None:
+            result = list(super().dates(field_name, kind, order))
+            cache.set(key, result, _setting('ADMIN_DATE_FACETS_CACHE_SECONDS', 300))
+        return result
+
+    def aggregate(self, *args, **kwargs):
+        if args or not all(isinstance(value, (Min, Max)) for value in kwargs.values()):
+            return super().aggregate(*args, **kwargs)
+        key = self._facet_key('aggregate', sorted((name, repr(value)) for name, value in kwargs.items()))
+        result = cache.get(key)
+        metrics.cache_lookup('admin_date_facets', result is not None)
+        if result is None:
+            result = super().aggregate(**kwargs)
+            cache.set(key, result, _setting('ADMIN_DATE_FACETS_CACHE_SECONDS', 300))
+        return result
+
+
+def with_cached_date_facets(queryset):
+    return DateFacetQuerySet(model=queryset.model, query=queryset.query, using=queryset._db, hints=queryset._hints)
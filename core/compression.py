@@ -0,0 +1,94 @@
+"""
+gzip/brotli compression of HTML and JSON responses.
+
+CompressionMiddleware compresses non-streaming text/html and
+application/json responses for clients that accept it. Brotli is used when
+the optional `brotli` package is installed and the client accepts br;
+otherwise gzip is used. Streaming responses are left alone: the dashboard's
+server-sent events must reach the browser as they happen, and the
+prescription exports stream binary data. Responses that already carry a
+Content-Encoding, such as those from core.pagecache, are also left alone.
+
+Django masks the CSRF token differently on every response. gzip bodies
+also get Django's random-length filename padding. Together these keep
+compressed pages from leaking secrets to BREACH-style length probes.
+"""
+import gzip
+
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {'text/html', 'application/json'}
+
+# below this, the headers cost more than compression saves
+MIN_LENGTH = 200
+
+# preferred first
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def accepted_encodings(request):
+    """The content codings the client accepts (q=0 excluded), lowercased."""
+    accepted = set()
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = part.partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q=') and not params[2:].strip('0.'):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    Put it near the top of MIDDLEWARE, after MetricsMiddleware, so the
+    response it compresses is the final one.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if (
+            content_type not in COMPRESSIBLE_TYPES
+            or response.streaming
+            or response.has_header('Content-Encoding')
+            or len(response.content) < MIN_LENGTH
+        ):
+            return response
+
+        patch_vary_headers(response, ['Accept-Encoding'])
+        accepted = accepted_encodings(request)
+        encoding = next((e for e in ENCODINGS if e in accepted), None)
+        if encoding is None:
+            return response
+
+        if encoding == 'gzip':
+            compressed = compress_string(response.content, max_random_bytes=100)
+        else:
+            compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # the compressed body is not byte-identical to what a strong ETag promised
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,65 @@
+"""
+In-process publish/subscribe for live doctor dashboard updates.
+
+Each dashboard holds an SSE connection (views.doctor_events) that runs on
+the ASGI event loop and waits on an asyncio.Queue. publish() may be called
+from any thread, including the sync views Django runs in its thread pool,
+and hands the event to each subscriber's loop with call_soon_threadsafe().
+
+The broker lives in process memory, so it works for a single ASGI process
+(e.g. `uvicorn clinic_project.asgi:application`). Running several
+processes would need a shared broker instead.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+# events a slow subscriber may have waiting before newer ones are dropped;
+# they only tell the dashboard to refresh, so dropping loses nothing
+QUEUE_SIZE = 16
+
+
+class Broker:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, vet_id):
+        """Register a queue for `vet_id`; must be called on the event loop that reads it."""
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[vet_id].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, vet_id, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(vet_id, set())
+            subscribers.difference_update({sub for sub in subscribers if sub[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(vet_id, None)
+
+    def subscriber_count(self, vet_id=None):
+        with self._lock:
+            if vet_id is not None:
+                return len(self._subscribers.get(vet_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, vet_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(vet_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # the subscriber's loop has shut down
+                self.unsubscribe(vet_id, queue)
+
+
+def _offer(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        pass
+
+
+broker = Broker()
@@ -0,0 +1,110 @@
+"""
+Streaming exports for the Appointment admin.
+
+Rows are read with values_list() in chunks, with the vet's name joined in
+SQL, and written out one line at a time, so exporting a year of appointments
+needs neither one query per row nor the whole file in memory.
+"""
+import csv
+import json
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Appointment, PrescriptionMedication
+
+CHUNK_SIZE = 2000
+
+STATUS_LABELS = dict(Appointment.STATUS_CHOICES)
+SERVICE_LABELS = dict(Appointment.SERVICE_CHOICES)
+
+
+class Echo:
+    """File-like object whose write() just returns the line csv.writer produced."""
+
+    def write(self, value):
+        return value
+
+
+def _chunks(iterable, size=CHUNK_SIZE):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def stream_csv(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def _date(value):
+    return value.strftime('%Y-%m-%d') if value else ''
+
+
+def _time(value):
+    return value.strftime('%H:%M') if value else ''
+
+
+APPOINTMENT_CSV_HEADER = ['ID', 'Owner', 'Pet', 'Date', 'Time', 'Service', 'Doctor', 'Status']
+
+
+def appointment_csv_rows(queryset):
+    rows = queryset.order_by('pk').values_list(
+        'appointment_id', 'owner_name', 'pet_name', 'assigned_date', 'assigned_time',
+        'service', 'assigned_doctor__name', 'status',
+    ).iterator(chunk_size=CHUNK_SIZE)
+    for appointment_id, owner, pet, day, at, service, doctor, status in rows:
+        yield [
+            appointment_id, owner, pet, _date(day), _time(at),
+            SERVICE_LABELS.get(service, service), doctor or '', STATUS_LABELS.get(status, status),
+        ]
+
+
+PRESCRIPTION_CSV_HEADER = [
+    'Appointment ID', 'Date', 'Owner', 'Pet', 'Doctor',
+    'Chief Complaint', 'Diagnosis', 'Medications', 'Instructions', 'Follow-up',
+]
+
+
+def prescription_csv_rows(queryset):
+    rows = queryset.exclude(prescription='').order_by('pk').values_list(
+        'pk', 'appointment_id', 'assigned_date', 'preferred_date', 'owner_name', 'pet_name',
+        'assigned_doctor__name', 'chief_complaint', 'diagnosis', 'instructions', 'follow_up',
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+    for chunk in _chunks(rows):
+        # one query per chunk for the medication lines
+        medications = {}
+        lines = PrescriptionMedication.objects.filter(
+            appointment_id__in=[row[0] for row in chunk]
+        ).order_by('appointment_id', 'position').values_list('appointment_id', 'drug_name', 'strength')
+        for appointment_pk, drug_name, strength in lines:
+            medications.setdefault(appointment_pk, []).append(f"{drug_name} {strength}".strip())
+
+        for pk, appointment_id, assigned, preferred, owner, pet, doctor, complaint, diagnosis, instructions, follow_up in chunk:
+            yield [
+                appointment_id, _date(assigned or preferred), owner, pet, doctor or '',
+                complaint, diagnosis, '; '.join(medications.get(pk, [])), instructions, follow_up,
+            ]
+
+
+APPOINTMENT_JSONL_FIELDS = [
+    'appointment_id', 'owner_name', 'phone', 'email', 'pet_name', 'pet_species', 'pet_age',
+    'pet_weight', 'service', 'reason', 'preferred_date', 'preferred_time', 'assigned_date',
+    'assigned_time', 'assigned_doctor_id', 'assigned_doctor__name', 'status', 'completion_status',
+    'payment_amount', 'payment_status', 'diagnosis',
+]
+
+
+def appointment_jsonl_rows(queryset):
+    rows = queryset.order_by('pk').values(*APPOINTMENT_JSONL_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+    for row in rows:
+        row['assigned_doctor_name'] = row.pop('assigned_doctor__name')
+        yield row
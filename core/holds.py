@@ -0,0 +1,78 @@
+"""
+Short-lived holds on preferred booking slots.
+
+Preferred (date, time) pairs are unique across all appointments, so two
+people booking the same slot at once used to race to the INSERT and the
+loser got an IntegrityError. Now picking a time on the booking form takes a
+SlotHold for SLOT_HOLD_SECONDS, and submitting the form turns the hold into
+the Appointment inside one transaction. Conflicts come back as None rather
+than as exceptions, so the views can answer 409. reap_expired() removes
+stale holds in a single DELETE and runs from `manage.py reap_slot_holds`.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Appointment, SlotHold
+from .sqlite import write_transaction
+
+
+def hold_seconds():
+    return getattr(settings, 'SLOT_HOLD_SECONDS', 300)
+
+
+def hold_slot(user, day, at):
+    """
+    Hold (day, at) for `user`, or extend their existing hold on it.
+
+    Any other hold the user has is released. Returns the SlotHold, or None if
+    the slot is booked or someone else holds it.
+    """
+    if Appointment.objects.filter(preferred_date=day, preferred_time=at).exists():
+        return None
+
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=hold_seconds())
+    with write_transaction():
+        SlotHold.objects.filter(user=user).exclude(preferred_date=day, preferred_time=at).delete()
+        SlotHold.objects.filter(preferred_date=day, preferred_time=at, expires_at__lte=now).delete()
+        if SlotHold.objects.filter(user=user, preferred_date=day, preferred_time=at).update(expires_at=expires_at):
+            return SlotHold.objects.get(user=user, preferred_date=day, preferred_time=at)
+        try:
+            with transaction.atomic():
+                return SlotHold.objects.create(
+                    user=user, preferred_date=day, preferred_time=at, expires_at=expires_at
+                )
+        except IntegrityError:
+            return None
+
+
+def confirm_hold(user, day, at, **fields):
+    """
+    Book (day, at) for `user`, consuming their hold on it.
+
+    A user without a hold can still book a slot that nobody else holds.
+    Returns the new Appointment, or None if the slot was taken first.
+    """
+    now = timezone.now()
+    with write_transaction():
+        deleted, _ = SlotHold.objects.filter(
+            user=user, preferred_date=day, preferred_time=at, expires_at__gt=now
+        ).delete()
+        if not deleted and SlotHold.objects.filter(
+            preferred_date=day, preferred_time=at, expires_at__gt=now
+        ).exists():
+            return None
+        try:
+            with transaction.atomic():
+                return Appointment.objects.create(preferred_date=day, preferred_time=at, **fields)
+        except IntegrityError:
+            return None
+
+
+def reap_expired(now=None):
+    """Delete every expired hold; returns how many were removed."""
+    deleted, _ = SlotHold.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
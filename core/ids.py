@@ -0,0 +1,176 @@
+"""
+Appointment ID allocation.
+
+IDs are numbers from a database sequence (the AppointmentIdSequence row)
+scrambled into the existing 8-character A-Z0-9 format. The scramble is an
+affine permutation of 0..36**8-1, so distinct numbers always give distinct
+IDs and no existence check is needed. Reversing the digits between affine
+rounds keeps consecutive numbers from producing look-alike IDs.
+
+Numbers are reserved in blocks with a single UPDATE ... RETURNING, and the
+rest of the block is kept in memory for later saves, so most saves reserve
+nothing. A block reserved outside a transaction is shared by every thread.
+A block reserved inside one is only used by that transaction until it
+commits, and is then shared. If the transaction rolls back, the sequence
+goes back too and the block is dropped with it, so no number is issued
+twice. Numbers from a shared block that a rolled-back save used are simply
+skipped.
+"""
+import string
+import threading
+
+from django.db import connection, transaction
+
+ALPHABET = string.digits + string.ascii_uppercase
+ID_LENGTH = 8
+ID_SPACE = len(ALPHABET) ** ID_LENGTH
+
+# multipliers are coprime with 36**8, which makes each round a bijection
+ROUNDS = [
+    (1_594_323_889, 918_273_645_546),
+    (2_718_281_831, 1_414_213_562_373),
+    (1_732_050_811, 2_236_067_977_499),
+]
+
+BLOCK_SIZE = 100
+
+
+def _digits(value):
+    chars = []
+    for _ in range(ID_LENGTH):
+        value, digit = divmod(value, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def _value(digits):
+    value = 0
+    for char in digits:
+        value = value * len(ALPHABET) + ALPHABET.index(char)
+    return value
+
+
+def encode(number):
+    value = number
+    for position, (multiplier, offset) in enumerate(ROUNDS):
+        if position:
+            value = _value(_digits(value)[::-1])
+        value = (value * multiplier + offset) % ID_SPACE
+    return _digits(value)
+
+
+def decode(appointment_id):
+    value = _value(appointment_id)
+    for position, (multiplier, offset) in reversed(list(enumerate(ROUNDS))):
+        value = (value - offset) * pow(multiplier, -1, ID_SPACE) % ID_SPACE
+        if position:
+            value = _value(_digits(value)[::-1])
+    return value
+
+
+class AppointmentIdAllocator:
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self._next = self._end = 0
+        self._legacy_ids = None
+        self._lock = threading.Lock()
+        # per thread: {'next', 'end', 'publish'} for a block reserved inside the current transaction
+        self._local = threading.local()
+
+    def allocate(self, count=1):
+        """Return `count` new, unique appointment IDs."""
+        if self._legacy_ids is None:
+            self._legacy_ids = self._load_legacy_ids()
+
+        ids = []
+        while len(ids) < count:
+            number = self._take()
+            if number is None and connection.in_atomic_block:
+                number = self._take_pending()
+            if number is not None:
+                self._add(ids, number)
+            elif connection.in_atomic_block:
+                self._reserve_pending(max(self.block_size, count - len(ids)))
+            else:
+                # reserved without holding the lock: the database may be locked by
+                # a transaction that is itself waiting in _take()
+                start, end = self._reserve(max(self.block_size, count - len(ids)))
+                with self._lock:
+                    if self._next >= self._end:
+                        self._next, self._end = start, end
+                        continue
+                # another thread refilled the cache meanwhile; the rest of this block is dropped
+                for number in range(start, end):
+                    if len(ids) == count:
+                        break
+                    self._add(ids, number)
+        return ids
+
+    def _take(self):
+        with self._lock:
+            if self._next < self._end:
+                self._next += 1
+                return self._next - 1
+        return None
+
+    def _take_pending(self):
+        pending = getattr(self._local, 'pending', None)
+        if pending is None or pending['next'] >= pending['end']:
+            return None
+        # Django drops on_commit callbacks registered inside a transaction or
+        # savepoint that rolls back, along with the UPDATE that reserved the block
+        if not any(func is pending['publish'] for _, func, *rest in connection.run_on_commit):
+            self._local.pending = None
+            return None
+        pending['next'] += 1
+        return pending['next'] - 1
+
+    def _reserve_pending(self, size):
+        start, end = self._reserve(size)
+        pending = {'next': start, 'end': end}
+
+        def publish():
+            # committed, so the rest of the block is safe for every thread
+            if self._local.pending is pending:
+                self._local.pending = None
+            with self._lock:
+                if self._next >= self._end and pending['next'] < pending['end']:
+                    self._next, self._end = pending['next'], pending['end']
+
+        pending['publish'] = publish
+        self._local.pending = pending
+        transaction.on_commit(publish)
+
+    def _add(self, ids, number):
+        candidate = encode(number)
+        # skip random IDs issued before the allocator existed
+        if candidate not in self._legacy_ids:
+            ids.append(candidate)
+
+    def _reserve(self, size):
+        from .models import AppointmentIdSequence
+
+        table = connection.ops.quote_name(AppointmentIdSequence._meta.db_table)
+        # no savepoint inside a transaction: a failure here fails the save anyway
+        with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET next_value = next_value + %s WHERE id = 1 RETURNING next_value",
+                [size],
+            )
+            row = cursor.fetchone()
+            if row is None:
+                # the row is created by migration 0024 but a flushed database loses it
+                AppointmentIdSequence.objects.create(pk=1, next_value=1 + size)
+                row = (1 + size,)
+        return row[0] - size, row[0]
+
+    def _load_legacy_ids(self):
+        from .models import Appointment, AppointmentIdSequence
+
+        legacy_max_pk = AppointmentIdSequence.objects.filter(pk=1).values_list('legacy_max_pk', flat=True).first() or 0
+        return frozenset(
+            Appointment.objects.filter(pk__lte=legacy_max_pk).values_list('appointment_id', flat=True)
+        )
+
+
+allocator = AppointmentIdAllocator()
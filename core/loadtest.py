@@ -0,0 +1,501 @@
+"""
+Load-test harness: scripted clinic traffic against the whole app.
+
+Virtual users run in threads, each as one persona, and repeat its visit
+until the run ends:
+
+- browser: an anonymous visitor reading the home, services and team pages
+- client: a signed-in client who opens the booking form, checks
+  availability, holds a slot, books it and looks at their profile
+- vet: a vet on the doctor dashboard who opens the prescription modal
+  (catalogue, existing prescription, medication search) and saves it
+- staff: a staff member on the appointment changelist who confirms a
+  batch, exports a CSV and opens the reports page
+
+Every request goes through the full middleware stack. The transport is the
+WSGI handler in-process (django.test.Client), the ASGI handler in-process
+(AsyncClient), or "http": a threaded server in a forked process on a free
+port, reached over real sockets with cookies and CSRF tokens like a
+browser.
+
+Each virtual user pauses for a random think time between visits. The
+numbers only mean something while the machine keeps up with the offered
+load: once it is saturated, which personas get through is down to the
+scheduler and results swing from run to run.
+
+seed() fills the database the command runs against with users, vets and an
+appointment history. The loadtest command uses the throwaway test
+database, so db.sqlite3 is never touched. Seeded accounts use a fast
+password hasher, so logging in the virtual users does not dominate start-up.
+
+summarise() reports throughput and latency percentiles per request;
+compare() checks them against a stored baseline. Baselines are only
+comparable on the same machine with the same options.
+"""
+import http.client
+import itertools
+import random
+import statistics
+import threading
+import time
+from datetime import date, time as clock, timedelta
+from decimal import Decimal
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import AsyncClient, Client
+
+from . import availability, rollups
+from .catalogue import CATALOGUE_VERSION
+from .models import Appointment, Profile, Vet
+from .utils import DAILY_SLOTS
+
+PASSWORD = 'loadtest'
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+SERVICES = [service for service, label in Appointment.SERVICE_CHOICES]
+SERVICE_PAGES = ['/prevcare/', '/surg/', '/dent/', '/diag/', '/emer/', '/nutri/']
+MEDICATION_QUERIES = ['amox', 'carprofen', 'meloxicam 1.5', 'predni', 'gaba', 'metro']
+
+# below this many requests, a p95 is one or two slow ones and too noisy to compare
+TAIL_SAMPLES = 100
+# latency changes smaller than this are thread scheduling (threads hand over the GIL every 5ms), not the code
+NOISE_MS = 5.0
+
+# browsers send these, and CompressionMiddleware acts on them
+HEADERS = {'host': 'localhost', 'accept-encoding': 'gzip, deflate, br'}
+
+
+class World:
+    """The seeded accounts and appointments the personas act on."""
+
+    def __init__(self, staff, vets, clients, pending, history):
+        self.staff = staff
+        # [(user, [appointment_id, ...]), ...], the ids being the vet's upcoming appointments
+        self.vets = vets
+        self.clients = clients
+        self.pending = pending
+        self.history = history
+
+
+def seed(clients=100, vets_per_service=2, history=3000, pending=500, upcoming=8, rng=None):
+    """Create the load-test accounts and appointments; returns a World."""
+    rng = rng or random.Random(1)
+    password = make_password(PASSWORD, hasher='md5')
+    today = date.today()
+
+    staff = User.objects.create(username='lt-staff', password=password, is_staff=True, is_superuser=True)
+    client_users = User.objects.bulk_create([
+        User(username=f'lt-client-{n}', email=f'client{n}@loadtest.example', password=password)
+        for n in range(clients)
+    ])
+    Profile.objects.bulk_create([
+        Profile(user=user, full_name=f'Client {n}', email=user.email) for n, user in enumerate(client_users)
+    ])
+    vet_users = User.objects.bulk_create([
+        User(username=f'lt-vet-{n}', password=password) for n in range(len(SERVICES) * vets_per_service)
+    ])
+    vets = Vet.objects.bulk_create([
+        Vet(name=f'Dr. Load {n}', specialty=SERVICES[n % len(SERVICES)], email=f'vet{n}@loadtest.example',
+            phone='0', user=user)
+        for n, user in enumerate(vet_users)
+    ])
+    vets_by_service = {service: [vet for vet in vets if vet.specialty == service] for service in SERVICES}
+
+    # preferred (date, time) pairs are unique; seeded ones are all in the past,
+    # so they never collide with the bookings made during the run
+    first_day = today - timedelta(days=(history + pending + len(vets) * upcoming) // 480 + 2)
+    minutes = (
+        (first_day + timedelta(days=n // 480), clock(8 + n % 480 // 60, n % 60)) for n in itertools.count()
+    )
+
+    def appointment(owner, service, **fields):
+        day, at = next(minutes)
+        return Appointment(
+            owner=owner, owner_name=owner.username, phone='0', email=owner.email, pet_name='Rex',
+            pet_species=rng.choice(['dog', 'cat', 'rabbit']), service=service, preferred_date=day,
+            preferred_time=at, reason='Check-up', **fields,
+        )
+
+    rows = []
+    for n in range(history):
+        service = rng.choice(SERVICES)
+        day = today - timedelta(days=rng.randrange(1, 730))
+        paid = rng.random() < 0.8
+        rows.append(appointment(
+            rng.choice(client_users), service, assigned_doctor=rng.choice(vets_by_service[service]),
+            assigned_date=day, assigned_time=rng.choice(DAILY_SLOTS),
+            status=rng.choice(['completed', 'completed', 'confirmed', 'cancelled']),
+            payment_status='paid' if paid else rng.choice(['pending', 'refunded']),
+            payment_amount=Decimal(rng.randrange(3000, 30000)) / 100,
+        ))
+    for n in range(pending):
+        rows.append(appointment(rng.choice(client_users), rng.choice(SERVICES)))
+    for vet in vets:
+        for n in range(upcoming):
+            rows.append(appointment(
+                rng.choice(client_users), vet.specialty, assigned_doctor=vet, status='confirmed',
+                assigned_date=today + timedelta(days=n // 4), assigned_time=DAILY_SLOTS[n % 4 * 3],
+            ))
+    rows = Appointment.objects.bulk_create(rows, batch_size=500)
+
+    # bulk_create skips the signals that keep these up to date
+    availability.rebuild((row.assigned_doctor_id, row.assigned_date) for row in rows)
+    first_rollup_day = min(row.assigned_date or row.preferred_date for row in rows)
+    rollups.rebuild_range(first_rollup_day, today + timedelta(days=upcoming))
+
+    upcoming_ids = {vet.pk: [] for vet in vets}
+    for row in rows[history + pending:]:
+        upcoming_ids[row.assigned_doctor_id].append(row.appointment_id)
+    return World(
+        staff=staff,
+        vets=[(vet.user, upcoming_ids[vet.pk]) for vet in vets],
+        clients=client_users,
+        pending=[row.pk for row in rows[history:history + pending]],
+        history=[row.pk for row in rows[:history]],
+    )
+
+
+class ClientSession:
+    """A virtual user's browser, driving the WSGI handler in-process."""
+
+    def __init__(self):
+        self.client = Client(headers=HEADERS)
+
+    def login(self, user):
+        self.client.force_login(user)
+
+    def request(self, method, path, data=None):
+        response = getattr(self.client, method)(path, data)
+        return response.status_code, len(self._body(response))
+
+    @staticmethod
+    def _body(response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+
+class AsyncClientSession(ClientSession):
+    """The same, through the ASGI handler."""
+
+    def __init__(self):
+        # AsyncClient always sends Host: testserver
+        self.client = AsyncClient(headers={'accept-encoding': HEADERS['accept-encoding']})
+
+    def request(self, method, path, data=None):
+        response = async_to_sync(getattr(self.client, method))(path, data)
+        return response.status_code, len(self._body(response))
+
+
+class HttpSession:
+    """A virtual user's browser talking HTTP to a local server, with cookies and CSRF tokens."""
+
+    def __init__(self, host, port):
+        self.connection = http.client.HTTPConnection(host, port, timeout=60)
+        self.cookies = SimpleCookie()
+
+    def login(self, user):
+        self.request('get', '/login/')
+        status, size = self.request('post', '/login/', {'username': user.username, 'password': PASSWORD})
+        if status != 302:
+            raise RuntimeError(f'Logging in {user.username} failed with {status}')
+
+    def request(self, method, path, data=None):
+        headers = {'Accept-Encoding': HEADERS['accept-encoding']}
+        cookies = '; '.join(f'{name}={morsel.value}' for name, morsel in self.cookies.items())
+        if cookies:
+            headers['Cookie'] = cookies
+        body = None
+        if method == 'get':
+            if data:
+                path = f'{path}?{urlencode(data, doseq=True)}'
+        else:
+            data = dict(data or {})
+            if 'csrftoken' in self.cookies:
+                data['csrfmiddlewaretoken'] = self.cookies['csrftoken'].value
+                headers['X-CSRFToken'] = self.cookies['csrftoken'].value
+            body = urlencode(data, doseq=True)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        for attempt in (1, 2):
+            try:
+                self.connection.request(method.upper(), path, body, headers)
+                response = self.connection.getresponse()
+                content = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # the server closed the kept-alive connection; retry once on a new one
+                self.connection.close()
+                if attempt == 2:
+                    raise
+        for header in response.headers.get_all('Set-Cookie') or []:
+            self.cookies.load(header)
+        return response.status, len(content)
+
+
+class Persona:
+    name = ''
+    weight = 1
+
+    def __init__(self, session, world, rng, recorder):
+        self.session = session
+        self.world = world
+        self.rng = rng
+        self.recorder = recorder
+
+    def start(self):
+        """Sign in, if the persona needs to; not measured."""
+
+    def visit(self):
+        raise NotImplementedError
+
+    def request(self, label, method, path, data=None, expect=(200,)):
+        started = time.perf_counter()
+        try:
+            status, size = self.session.request(method, path, data)
+        except Exception:
+            status, size = None, 0
+        self.recorder.record(f'{method.upper()} {label}', started, time.perf_counter() - started, status in expect)
+        return status
+
+
+class BrowserPersona(Persona):
+    name = 'browser'
+    weight = 50
+
+    def visit(self):
+        self.request('/', 'get', '/')
+        self.request('/services/', 'get', '/services/')
+        for page in self.rng.sample(SERVICE_PAGES, 2):
+            self.request('/<service page>/', 'get', page)
+        self.request('/ourteam/', 'get', '/ourteam/')
+
+
+class ClientPersona(Persona):
+    name = 'client'
+    weight = 25
+
+    def start(self):
+        self.user = self.rng.choice(self.world.clients)
+        self.session.login(self.user)
+
+    def visit(self):
+        service = self.rng.choice(SERVICES)
+        day = date.today() + timedelta(days=self.rng.randrange(1, 365))
+        slot = {'appointment_date': day.isoformat(), 'appointment_time': self.rng.choice(DAILY_SLOTS).strftime('%H:%M')}
+
+        self.request('/appt/', 'get', '/appt/')
+        self.request('/availability/', 'get', '/availability/', {
+            'service': service, 'start': day.isoformat(), 'end': (day + timedelta(days=6)).isoformat(),
+        })
+        # 409: someone else holds or booked the slot, as happens on the real site
+        if self.request('/appointment/hold/', 'post', '/appointment/hold/', slot, expect=(200, 409)) == 200:
+            self.request('/appt/', 'post', '/appt/', {
+                'owner_name': self.user.username, 'owner_phone': '0', 'pet_name': 'Rex', 'pet_species': 'dog',
+                'service': service, 'reason': 'Check-up', **slot,
+            }, expect=(302, 409))
+        self.request('/profile/', 'get', '/profile/')
+
+
+class VetPersona(Persona):
+    name = 'vet'
+    weight = 15
+
+    def start(self):
+        self.user, self.appointment_ids = self.world.vets[self.rng.randrange(len(self.world.vets))]
+        self.session.login(self.user)
+
+    def visit(self):
+        appointment_id = self.rng.choice(self.appointment_ids)
+        self.request('/doctor-dashboard/', 'get', '/doctor-dashboard/')
+        self.request('/doctor/prescription-catalogue/', 'get', '/doctor/prescription-catalogue/',
+                     {'v': CATALOGUE_VERSION})
+        self.request('/doctor/get-existing-prescription/<id>/', 'get',
+                     f'/doctor/get-existing-prescription/{appointment_id}/')
+        self.request('/doctor/medications/search/', 'get', '/doctor/medications/search/',
+                     {'q': self.rng.choice(MEDICATION_QUERIES)})
+        self.request('/doctor/save-prescription/<id>/', 'post', f'/doctor/save-prescription/{appointment_id}/', {
+            'chief_complaint': 'Limping on the left hind leg',
+            'diagnosis': 'Soft tissue strain',
+            'medications': 'Carprofen 25mg - 1 tablet twice daily for 5 days',
+            'instructions': 'Rest, short lead walks only',
+            'follow_up': 'Recheck in 2 weeks',
+            'mark_complete': 'false',
+        })
+
+
+class StaffPersona(Persona):
+    name = 'staff'
+    weight = 10
+
+    def start(self):
+        self.session.login(self.world.staff)
+
+    def visit(self):
+        changelist = '/admin/core/appointment/'
+        pending, history = self.world.pending, self.world.history
+        self.request(changelist, 'get', changelist)
+        self.request(f'{changelist} confirm_selected', 'post', changelist, {
+            'action': 'confirm_selected', '_selected_action': self.rng.sample(pending, min(20, len(pending))),
+        }, expect=(302,))
+        self.request(f'{changelist} export_as_csv', 'post', changelist, {
+            'action': 'export_as_csv', '_selected_action': self.rng.sample(history, min(200, len(history))),
+        })
+        self.request('/reports/', 'get', '/reports/')
+
+
+PERSONAS = {persona.name: persona for persona in (BrowserPersona, ClientPersona, VetPersona, StaffPersona)}
+
+
+class Recorder:
+    """Collects (request, latency, ok) samples once the warm-up is over."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        # (persona, exception) for virtual users that stopped early
+        self.failures = []
+        # measured visits completed per persona
+        self.visits = {}
+        self.measure_from = float('inf')
+
+    def record(self, name, started, seconds, ok):
+        if started < self.measure_from:
+            return
+        with self.lock:
+            timings, errors = self.samples.setdefault(name, ([], [0]))
+            timings.append(seconds)
+            if not ok:
+                errors[0] += 1
+
+    def visited(self, persona, started):
+        if started >= self.measure_from:
+            with self.lock:
+                self.visits[persona] = self.visits.get(persona, 0) + 1
+
+    def failed(self, persona, exc):
+        with self.lock:
+            self.failures.append((persona, exc))
+
+
+def personas_for(users, mix):
+    """Split `users` between the personas in `mix` ({name: weight}) by largest remainder."""
+    total = sum(mix.values())
+    shares = {name: users * weight / total for name, weight in mix.items()}
+    counts = {name: int(share) for name, share in shares.items()}
+    by_remainder = sorted(shares, key=lambda name: shares[name] - counts[name], reverse=True)
+    for name in by_remainder[:users - sum(counts.values())]:
+        counts[name] += 1
+    return [PERSONAS[name] for name, count in counts.items() for _ in range(count)]
+
+
+def run(world, new_session, personas, seconds, warmup=0.0, think=0.0, seed=1):
+    """
+    Run one thread per persona for warmup + seconds; returns the Recorder.
+    `new_session` makes each virtual user's session.
+    """
+    recorder = Recorder()
+    deadline = [0.0]
+
+    def start_clock():
+        # runs once everyone is ready, before any of them is released
+        now = time.perf_counter()
+        recorder.measure_from = now + warmup
+        deadline[0] = now + warmup + seconds
+
+    ready = threading.Barrier(len(personas) + 1, action=start_clock)
+
+    def user(persona_class, n):
+        rng = random.Random(seed * 1000 + n)
+        try:
+            persona = persona_class(new_session(), world, rng, recorder)
+            persona.start()
+        except Exception as exc:
+            recorder.failed(persona_class.name, exc)
+            persona = None
+        finally:
+            ready.wait()
+        try:
+            while persona and time.perf_counter() < deadline[0]:
+                started = time.perf_counter()
+                persona.visit()
+                recorder.visited(persona_class.name, started)
+                if think:
+                    time.sleep(rng.expovariate(1 / think))
+        except Exception as exc:
+            recorder.failed(persona_class.name, exc)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=user, args=(persona, n)) for n, persona in enumerate(personas)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    for thread in threads:
+        thread.join()
+    return recorder
+
+
+def _percentiles(timings):
+    if len(timings) < 2:
+        value = timings[0] * 1000 if timings else float('nan')
+        return value, value, value
+    cuts = statistics.quantiles(timings, n=100, method='inclusive')
+    return cuts[49] * 1000, cuts[94] * 1000, cuts[98] * 1000
+
+
+def summarise(recorder, seconds):
+    """{request: {'requests', 'rps', 'p50', 'p95', 'p99', 'max', 'errors'}} with latencies in ms, plus 'total'."""
+    results = {}
+    everything, failures = [], 0
+    for name, (timings, errors) in sorted(recorder.samples.items()):
+        p50, p95, p99 = _percentiles(timings)
+        results[name] = {
+            'requests': len(timings), 'rps': len(timings) / seconds, 'p50': p50, 'p95': p95, 'p99': p99,
+            'max': max(timings) * 1000, 'errors': errors[0],
+        }
+        everything.extend(timings)
+        failures += errors[0]
+    p50, p95, p99 = _percentiles(everything)
+    results['total'] = {
+        'requests': len(everything), 'rps': len(everything) / seconds, 'p50': p50, 'p95': p95, 'p99': p99,
+        'max': max(everything, default=0) * 1000, 'errors': failures,
+    }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Check `results` against `baseline` (both from summarise()). A request
+    regresses when its median latency grows by more than `tolerance` (0.25
+    = 25%) and NOISE_MS, when its p95 does and both runs have TAIL_SAMPLES
+    requests to take a p95 from, or when it fails where it used to pass.
+    Throughput is only checked on the total: how often each request is
+    made follows from the persona mix and think time.
+    Returns [(request, p50 change, p95 change, rps change, problems)].
+    """
+    rows = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            rows.append((name, None, None, None, ['not run']))
+            continue
+        p50_change, p95_change, rps_change = (
+            current[key] / base[key] - 1 if base[key] else 0.0 for key in ('p50', 'p95', 'rps')
+        )
+        problems = []
+        slower = {key: current[key] - base[key] > NOISE_MS for key in ('p50', 'p95')}
+        if p50_change > tolerance and slower['p50']:
+            problems.append(f'p50 +{p50_change:.0%}')
+        if (p95_change > tolerance and slower['p95']
+                and min(current['requests'], base['requests']) >= TAIL_SAMPLES):
+            problems.append(f'p95 +{p95_change:.0%}')
+        if name == 'total' and rps_change < -tolerance:
+            problems.append(f'throughput {rps_change:.0%}')
+        if current['errors'] and not base['errors']:
+            problems.append(f"{current['errors']} errors")
+        rows.append((name, p50_change, p95_change, rps_change, problems))
+    return rows
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.assignment import assign_pending
+
+
+class Command(BaseCommand):
+    help = 'Assign a vet and a time slot to every unassigned pending appointment'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='How many days after the preferred date to search (default ASSIGNMENT_SEARCH_DAYS)')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        assigned, unassigned = assign_pending(search_days=options['days'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"Assigned {len(assigned)} appointments, {len(unassigned)} left unassigned, in {elapsed:.2f}s"
+        )
@@ -0,0 +1,84 @@
+import gzip
+import re
+import statistics
+import time
+from datetime import date, time as clock
+
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+
+from core.catalogue import CATALOGUE_VERSION
+from core.models import Appointment, Vet
+
+ASSET_RE = re.compile(r'(?:href|src)="/static/([^"]+\.(?:css|js))"')
+
+
+class Command(BaseCommand):
+    help = (
+        'Bytes sent and server render time for the doctor dashboard, on a first visit and on a '
+        'refresh with static files cached. Works on throwaway rows that are rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=12, help="Today's confirmed appointments")
+        parser.add_argument('--requests', type=int, default=200)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.measure(options['appointments'], options['requests'])
+            transaction.set_rollback(True)
+
+    def measure(self, appointment_count, request_count):
+        user = User.objects.create_user('bench-dashboard-vet', 'bench-vet@example.com', 'pw')
+        vet = Vet.objects.create(name='Bench', specialty='Dental Care', email='bench-vet@example.com', phone='1',
+                                 user=user)
+        today = date.today()
+        for i in range(appointment_count):
+            at = clock(9 + i % 8, 30 * (i // 8 % 2))
+            Appointment.objects.create(
+                owner_name=f'Owner {i}', phone='1', email=f'owner{i}@example.com', pet_name=f'Pet {i}',
+                pet_species='dog', service='Dental Care', preferred_date=today, preferred_time=at,
+                assigned_doctor=vet, assigned_date=today, assigned_time=at, status='confirmed',
+            )
+
+        # localhost passes ALLOWED_HOSTS while DEBUG is on
+        client = Client(HTTP_HOST='localhost', HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        client.force_login(user)
+        response = client.get('/doctor-dashboard/')
+        if response.status_code != 200:
+            raise CommandError(f'dashboard returned {response.status_code}')
+
+        timings = []
+        for _ in range(request_count):
+            start = time.perf_counter()
+            response = client.get('/doctor-dashboard/')
+            timings.append((time.perf_counter() - start) * 1000)
+
+        body = response.content
+        html = gzip.decompress(body) if response.get('Content-Encoding') == 'gzip' else body
+        wire_html = len(body)
+
+        assets = ASSET_RE.findall(html.decode())
+        asset_raw = asset_gzip = 0
+        for name in assets:
+            path = finders.find(re.sub(r'\.[0-9a-f]{12}\.', '.', name))
+            with open(path, 'rb') as f:
+                data = f.read()
+            asset_raw += len(data)
+            asset_gzip += len(gzip.compress(data))
+
+        self.stdout.write(f"HTML: {len(html)} bytes, {wire_html} on the wire "
+                          f"(Content-Encoding: {response.get('Content-Encoding', 'none')})")
+        self.stdout.write(f"Local CSS/JS: {', '.join(assets) or 'none'} = {asset_raw} bytes, {asset_gzip} gzipped")
+        self.stdout.write(f"First visit: {wire_html + asset_gzip} bytes; refresh with cached assets: {wire_html} bytes")
+        catalogue = client.get(f'/doctor/prescription-catalogue/?v={CATALOGUE_VERSION}')
+        appointment = Appointment.objects.filter(assigned_doctor=vet).first()
+        existing = client.get(f'/doctor/get-existing-prescription/{appointment.appointment_id}/')
+        for label, json_response in [('Prescription catalogue', catalogue), ('Existing prescription', existing)]:
+            self.stdout.write(f"{label} JSON: {len(json_response.content)} bytes on the wire "
+                              f"(Content-Encoding: {json_response.get('Content-Encoding', 'none')})")
+        self.stdout.write(f"Server time per dashboard request: p50 {statistics.median(timings):.2f} ms, "
+                          f"p95 {statistics.quantiles(timings, n=20)[18]:.2f} ms")
@@ -0,0 +1,95 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.catalogue import MEDICATIONS
+from core.medsearch import MedicationIndex
+
+SYLLABLES = ['a', 'ben', 'car', 'ce', 'clo', 'da', 'dox', 'en', 'fa', 'flu', 'ga', 'hy', 'i', 'ke',
+             'la', 'lev', 'ma', 'me', 'mi', 'no', 'o', 'pra', 'pre', 'ri', 'sa', 'ser', 'ta', 'tra',
+             'ven', 'xy', 'zo']
+SUFFIXES = ['cillin', 'profen', 'azole', 'mycin', 'pril', 'olol', 'sone', 'tidine', 'zepam', 'dronate',
+            'floxacin', 'vir', 'statin', 'pine', 'mab', 'tinib']
+UNITS = ['mg', 'mg', 'mg', 'mcg', 'mg/ml', 'U/ml']
+
+
+def synthetic_formulary(size, rng):
+    types = sorted({med['type'] for med in MEDICATIONS})
+    formulary = list(MEDICATIONS)
+    seen = {med['name'] for med in formulary}
+    while len(formulary) < size:
+        name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3))) + rng.choice(SUFFIXES)
+        name = name.capitalize()
+        if rng.random() < 0.1:
+            name += f" ({rng.choice(SYLLABLES).capitalize()}{rng.choice(SUFFIXES)})"
+        if name in seen:
+            name += f" {rng.choice(['XR', 'SR', 'Forte', 'Plus', 'Vet'])}"
+            if name in seen:
+                continue
+        seen.add(name)
+        unit = rng.choice(UNITS)
+        strengths = sorted({f"{rng.choice([0.5, 1, 2.5, 5, 10, 20, 25, 50, 100, 250, 500])}{unit}"
+                            for _ in range(rng.randint(1, 4))})
+        formulary.append({'name': name, 'strengths': strengths, 'type': rng.choice(types)})
+    return formulary
+
+
+def make_queries(formulary, count, rng):
+    types = sorted({med['type'] for med in formulary})
+    queries = []
+    for _ in range(count):
+        med = rng.choice(formulary)
+        name = med['name'].lower()
+        kind = rng.choice(['prefix', 'prefix', 'full', 'typo', 'name+strength', 'type', 'strength'])
+        if kind == 'prefix':
+            queries.append((kind, {'query': name[:rng.randint(2, 6)]}))
+        elif kind == 'full':
+            queries.append((kind, {'query': name}))
+        elif kind == 'typo':
+            pos = rng.randrange(1, max(2, len(name) - 1))
+            queries.append((kind, {'query': name[:pos] + name[pos + 1:]}))
+        elif kind == 'name+strength':
+            queries.append((kind, {'query': f"{name[:4]} {med['strengths'][0]}"}))
+        elif kind == 'type':
+            queries.append((kind, {'query': name[:3], 'drug_type': rng.choice(types)}))
+        else:
+            queries.append((kind, {'strength': med['strengths'][0][:2]}))
+    return queries
+
+
+class Command(BaseCommand):
+    help = 'Benchmark medication search against a synthetic formulary'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=50000)
+        parser.add_argument('--queries', type=int, default=20000)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        formulary = synthetic_formulary(options['size'], rng)
+
+        start = time.perf_counter()
+        index = MedicationIndex(formulary)
+        build = time.perf_counter() - start
+        self.stdout.write(f"Indexed {len(index)} medications in {build * 1000:.0f} ms")
+
+        timings = {}
+        for kind, kwargs in make_queries(formulary, options['queries'], rng):
+            start = time.perf_counter()
+            index.search(limit=options['limit'], **kwargs)
+            timings.setdefault(kind, []).append((time.perf_counter() - start) * 1e6)
+
+        self.stdout.write(f"{'query':<15}{'n':>7}{'p50 us':>10}{'p95 us':>10}{'p99 us':>10}{'max us':>10}")
+        everything = []
+        for kind, values in sorted(timings.items()) + [('all', everything)]:
+            if kind != 'all':
+                everything.extend(values)
+            values = sorted(values)
+            pct = statistics.quantiles(values, n=100)
+            self.stdout.write(
+                f"{kind:<15}{len(values):>7}{pct[49]:>10.1f}{pct[94]:>10.1f}{pct[98]:>10.1f}{values[-1]:>10.1f}"
+            )
@@ -0,0 +1,68 @@
+import io
+import time
+
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.urls import reverse
+
+PAGES = ['home', 'services', 'prevcare', 'surg', 'dent', 'diag', 'emer', 'nutri', 'ourteam']
+
+
+class Command(BaseCommand):
+    help = (
+        'Requests per second for the public marketing pages with the page cache off and on, '
+        'as an anonymous browser accepting gzip and br, through the full WSGI middleware stack'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per page per run')
+
+    def request(self, handler, url, **headers):
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': url, 'QUERY_STRING': '',
+            # localhost passes ALLOWED_HOSTS while DEBUG is on
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+            'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http',
+            'HTTP_ACCEPT_ENCODING': 'gzip, deflate, br', **headers,
+        }
+        result = {}
+
+        def start_response(status, response_headers):
+            result['status'] = int(status.split()[0])
+            result['headers'] = dict(response_headers)
+
+        response = handler(environ, start_response)
+        result['body'] = b''.join(response)
+        response.close()
+        return result
+
+    def run(self, handler, url, count, **headers):
+        self.request(handler, url, **headers)
+        start = time.perf_counter()
+        for _ in range(count):
+            result = self.request(handler, url, **headers)
+        return count / (time.perf_counter() - start), result
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        handler = WSGIHandler()
+        cache.clear()
+
+        self.stdout.write(f"{'page':<10}{'off req/s':>11}{'on req/s':>11}{'speedup':>9}"
+                          f"{'bytes off':>11}{'bytes on':>10}{'304 req/s':>11}")
+        for name in PAGES:
+            url = reverse(name)
+            with override_settings(PAGE_CACHE_SECONDS=0):
+                before, plain = self.run(handler, url, count)
+            if plain['status'] != 200:
+                raise CommandError(f"{url} returned {plain['status']}")
+            after, cached = self.run(handler, url, count)
+            revalidate, not_modified = self.run(handler, url, count, HTTP_IF_NONE_MATCH=cached['headers']['ETag'])
+            if not_modified['status'] != 304:
+                raise CommandError(f"{url} returned {not_modified['status']} to a conditional GET")
+            self.stdout.write(
+                f"{name:<10}{before:>11.0f}{after:>11.0f}{after / before:>8.1f}x"
+                f"{len(plain['body']):>11}{len(cached['body']):>10}{revalidate:>11.0f}"
+            )
@@ -0,0 +1,163 @@
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from core.sqlite import apply_pragmas, pragmas
+
+SCHEMA = """
+CREATE TABLE appointment (
+    id INTEGER PRIMARY KEY,
+    vet_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    status TEXT NOT NULL,
+    notes TEXT NOT NULL
+);
+CREATE INDEX appointment_vet_day ON appointment (vet_id, status, day, slot);
+"""
+
+VETS = 20
+DAYS = 60
+SLOTS = [f'{hour:02}:{minute:02}' for hour in range(9, 17) for minute in (0, 30)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Concurrent read/write throughput and latency on a scratch SQLite file, with SQLite defaults '
+        'or SQLITE_PRAGMAS, and with a connection per request or persistent connections'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--rows', type=int, default=50000)
+
+    def handle(self, *args, **options):
+        runs = [
+            ('defaults, reconnect', {}, False),
+            ('defaults, persistent', {}, True),
+            ('tuned, reconnect', pragmas(), False),
+            ('tuned, persistent', pragmas(), True),
+        ]
+        self.stdout.write(f"{options['readers']} readers, {options['writers']} writers, {options['seconds']}s each")
+        self.stdout.write(f"{'profile':<21}{'reads/s':>9}{'writes/s':>10}{'read p50':>10}{'read p99':>10}"
+                          f"{'write p50':>11}{'write p99':>11}{'errors':>8}")
+        for label, profile, persistent in runs:
+            with tempfile.TemporaryDirectory() as directory:
+                path = Path(directory) / 'bench.sqlite3'
+                self.seed(path, profile, options['rows'])
+                reads, writes, errors = self.run(path, profile, persistent, options)
+            seconds = options['seconds']
+            self.stdout.write(
+                f"{label:<21}{len(reads) / seconds:>9.0f}{len(writes) / seconds:>10.0f}"
+                f"{self.pct(reads, 50):>10.2f}{self.pct(reads, 99):>10.2f}"
+                f"{self.pct(writes, 50):>11.2f}{self.pct(writes, 99):>11.2f}{errors:>8}"
+            )
+        self.stdout.write('Latencies in ms.')
+
+    @staticmethod
+    def pct(values, percentile):
+        if len(values) < 2:
+            return float('nan')
+        return statistics.quantiles(values, n=100)[percentile - 1]
+
+    def connect(self, path, profile):
+        # the same busy timeout Django's DATABASES 'timeout' gives every run
+        connection = sqlite3.connect(path, timeout=20, isolation_level=None, check_same_thread=False)
+        apply_pragmas(connection, profile)
+        return connection
+
+    def seed(self, path, profile, rows):
+        connection = self.connect(path, profile)
+        connection.executescript(SCHEMA)
+        rng = random.Random(1)
+        start = date.today()
+        connection.execute('BEGIN')
+        connection.executemany(
+            'INSERT INTO appointment (vet_id, day, slot, status, notes) VALUES (?, ?, ?, ?, ?)',
+            (
+                (rng.randrange(VETS), (start + timedelta(days=rng.randrange(DAYS))).isoformat(),
+                 rng.choice(SLOTS), rng.choice(['pending', 'confirmed', 'completed']), 'x' * rng.randrange(200))
+                for _ in range(rows)
+            ),
+        )
+        connection.execute('COMMIT')
+        connection.execute('ANALYZE')
+        connection.close()
+
+    def run(self, path, profile, persistent, options):
+        deadline = time.perf_counter() + options['seconds']
+        reads, writes = [], []
+        errors = [0]
+        lock = threading.Lock()
+        today = date.today()
+
+        def read(connection, rng):
+            # a vet's dashboard: confirmed appointments over the next week
+            day = today + timedelta(days=rng.randrange(DAYS - 7))
+            connection.execute(
+                'SELECT id, slot, notes FROM appointment WHERE vet_id = ? AND status = ? AND day BETWEEN ? AND ? '
+                'ORDER BY day, slot',
+                (rng.randrange(VETS), 'confirmed', day.isoformat(), (day + timedelta(days=7)).isoformat()),
+            ).fetchall()
+
+        def write(connection, rng):
+            # a booking: claim the write lock up front, as core.sqlite.write_transaction() does
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    'INSERT INTO appointment (vet_id, day, slot, status, notes) VALUES (?, ?, ?, ?, ?)',
+                    (rng.randrange(VETS), (today + timedelta(days=rng.randrange(DAYS))).isoformat(),
+                     rng.choice(SLOTS), 'pending', 'booked'),
+                )
+                connection.execute(
+                    "UPDATE appointment SET status = 'confirmed' WHERE id = ?", (rng.randrange(1, options['rows']),)
+                )
+                connection.execute('COMMIT')
+            except sqlite3.Error:
+                connection.execute('ROLLBACK')
+                raise
+
+        def worker(operation, timings, seed):
+            rng = random.Random(seed)
+            connection = self.connect(path, profile) if persistent else None
+            local = []
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    if persistent:
+                        operation(connection, rng)
+                    else:
+                        # no CONN_MAX_AGE: every request opens its own connection
+                        request_connection = self.connect(path, profile)
+                        try:
+                            operation(request_connection, rng)
+                        finally:
+                            request_connection.close()
+                except sqlite3.OperationalError:
+                    with lock:
+                        errors[0] += 1
+                    continue
+                local.append((time.perf_counter() - start) * 1000)
+            if connection is not None:
+                connection.close()
+            with lock:
+                timings.extend(local)
+
+        threads = [threading.Thread(target=worker, args=(read, reads, i)) for i in range(options['readers'])]
+        threads += [
+            threading.Thread(target=worker, args=(write, writes, 1000 + i)) for i in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return reads, writes, errors[0]
@@ -0,0 +1,94 @@
+import itertools
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import TimeoutError
+from datetime import date, time as clock, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test import override_settings
+from django.test.utils import setup_databases, teardown_databases
+
+from core.models import Appointment
+from core.writes import run_write, write_queue
+
+SERVICES = ['Preventive Care', 'Dental Care', 'Diagnostic Imaging']
+
+
+def book(rng, n):
+    # preferred date and time are unique together, so every booking gets its own minute
+    day = date.today() + timedelta(days=1 + n // 1440)
+    return Appointment.objects.create(
+        owner_name='Bench Owner', phone='1', email='bench@example.com', pet_name='Rex', pet_species='dog',
+        service=rng.choice(SERVICES), preferred_date=day, preferred_time=clock(n % 1440 // 60, n % 60),
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Sustained appointment inserts per second and latency from many concurrent writers, with the '
+        'write queue off and on. Runs against the throwaway test database, not db.sqlite3.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=300)
+        parser.add_argument('--seconds', type=float, default=10.0)
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        numbers = itertools.count()
+        try:
+            self.stdout.write(f"{options['writers']} writers, {options['seconds']}s each")
+            self.stdout.write(f"{'write queue':<13}{'inserts/s':>11}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+                              f"{'errors':>8}")
+            for enabled in (False, True):
+                with override_settings(WRITE_QUEUE_ENABLED=enabled):
+                    timings, errors = self.run(options['writers'], options['seconds'], numbers)
+                pct = statistics.quantiles(timings, n=100) if len(timings) > 1 else [float('nan')] * 99
+                self.stdout.write(
+                    f"{'on' if enabled else 'off':<13}{len(timings) / options['seconds']:>11.0f}"
+                    f"{pct[49]:>9.1f}{pct[98]:>9.1f}{max(timings, default=float('nan')):>9.1f}{errors:>8}"
+                )
+        finally:
+            write_queue.stop()
+            connection.close()
+            teardown_databases(old_config, verbosity=0)
+
+    def run(self, writers, seconds, numbers):
+        start_line = threading.Barrier(writers + 1)
+        deadline = [0.0]
+        timings = []
+        errors = [0]
+        lock = threading.Lock()
+
+        def writer(seed):
+            rng = random.Random(seed)
+            local, failed = [], 0
+            start_line.wait()
+            try:
+                while time.perf_counter() < deadline[0]:
+                    start = time.perf_counter()
+                    try:
+                        with lock:
+                            n = next(numbers)
+                        run_write(book, rng, n)
+                    except (OperationalError, TimeoutError):
+                        failed += 1
+                        continue
+                    local.append((time.perf_counter() - start) * 1000)
+            finally:
+                connection.close()
+            with lock:
+                timings.extend(local)
+                errors[0] += failed
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+        for thread in threads:
+            thread.start()
+        deadline[0] = time.perf_counter() + seconds
+        start_line.wait()
+        for thread in threads:
+            thread.join()
+        return timings, errors[0]
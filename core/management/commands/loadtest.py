@@ -0,0 +1,179 @@
+import json
+import multiprocessing
+import random
+from functools import partial
+from pathlib import Path
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connection, connections
+from django.test import override_settings
+from django.test.utils import setup_databases, teardown_databases
+
+from core import loadtest
+
+BASELINE_DIR = Path(__file__).resolve().parents[2] / 'loadtest_baselines'
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    # headers and body go out in separate writes; without this each response waits on a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the app with scripted browser, client, vet and staff traffic and report throughput and '
+        'latency per request, compared with the stored baseline. Runs against the throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transport', choices=['wsgi', 'asgi', 'http'], default='wsgi',
+                            help='In-process WSGI or ASGI handler, or a threaded HTTP server in a separate process')
+        parser.add_argument('--users', type=int, default=40, help='Concurrent virtual users')
+        parser.add_argument('--seconds', type=float, default=30.0, help='Measured duration')
+        parser.add_argument('--warmup', type=float, default=5.0, help='Unmeasured seconds before that')
+        parser.add_argument('--think', type=float, default=3.0,
+                            help='Mean pause between visits, in seconds. Lower it, or raise --users, to find '
+                                 'where the app saturates; baselines need a load the machine keeps up with')
+        parser.add_argument('--mix', default=','.join(f'{p.name}={p.weight}' for p in loadtest.PERSONAS.values()),
+                            help='Persona weights, e.g. browser=50,client=25,vet=15,staff=10')
+        parser.add_argument('--clients', type=int, default=100, help='Seeded client accounts')
+        parser.add_argument('--history', type=int, default=3000, help='Seeded past appointments')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for data and personas')
+        parser.add_argument('--baseline',
+                            help='Baseline JSON to compare with (default: core/loadtest_baselines/<transport>.json)')
+        parser.add_argument('--save-baseline', action='store_true', help='Write the results as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='Allowed latency growth (and total throughput drop) before a request counts as '
+                                 'regressed. Single runs on a shared or one-CPU machine vary by a third or more')
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options['mix'])
+        baseline_path = Path(options['baseline'] or BASELINE_DIR / f"{options['transport']}.json")
+        personas = loadtest.personas_for(options['users'], mix)
+
+        old_config = setup_databases(verbosity=0, interactive=False)
+        server = None
+        try:
+            # production-like: no query logging, no per-request query inspection
+            with override_settings(DEBUG=False, QUERY_INSPECTOR_ENABLED=False,
+                                   ALLOWED_HOSTS=['localhost', '127.0.0.1', 'testserver'],
+                                   PASSWORD_HASHERS=loadtest.FAST_HASHERS):
+                world = loadtest.seed(clients=options['clients'], history=options['history'],
+                                      rng=random.Random(options['seed']))
+                if options['transport'] == 'http':
+                    server, host, port = self.start_server()
+                    new_session = partial(loadtest.HttpSession, host, port)
+                elif options['transport'] == 'asgi':
+                    new_session = loadtest.AsyncClientSession
+                else:
+                    new_session = loadtest.ClientSession
+                self.stdout.write(
+                    f"{options['transport']}: {options['users']} users "
+                    f"({', '.join(f'{personas.count(p)} {p.name}' for p in loadtest.PERSONAS.values())}), "
+                    f"{options['warmup']:g}s warm-up + {options['seconds']:g}s"
+                )
+                recorder = loadtest.run(world, new_session, personas, options['seconds'],
+                                        warmup=options['warmup'], think=options['think'], seed=options['seed'])
+        finally:
+            if server is not None:
+                server.terminate()
+                server.join()
+            connection.close()
+            teardown_databases(old_config, verbosity=0)
+
+        results = loadtest.summarise(recorder, options['seconds'])
+        self.print_results(results)
+        self.stdout.write('visits: ' + ', '.join(
+            f"{recorder.visits.get(name, 0)} {name} ({recorder.visits.get(name, 0) / options['seconds']:.1f}/s)"
+            for name in mix
+        ))
+        if recorder.failures:
+            for persona, exc in recorder.failures:
+                self.stderr.write(f'A {persona} user stopped early: {exc!r}')
+            raise CommandError(f'{len(recorder.failures)} virtual users stopped early; results are not comparable')
+        starved = sorted({p.name for p in personas} - set(recorder.visits))
+        if starved:
+            raise CommandError(
+                f"No {', '.join(starved)} visit finished in the measured time; raise --think or lower --users"
+            )
+
+        run = {
+            'transport': options['transport'], 'users': options['users'], 'seconds': options['seconds'],
+            'think': options['think'], 'mix': mix, 'results': results,
+        }
+        if options['save_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(run, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(f'Saved baseline to {baseline_path}')
+        elif baseline_path.exists():
+            self.check_baseline(run, json.loads(baseline_path.read_text()), options['tolerance'], baseline_path)
+        else:
+            self.stdout.write(f'No baseline at {baseline_path}; run with --save-baseline to create one')
+
+    @staticmethod
+    def parse_mix(value):
+        mix = {}
+        for part in value.split(','):
+            name, _, weight = part.partition('=')
+            if name.strip() not in loadtest.PERSONAS:
+                raise CommandError(f"Unknown persona {name.strip()!r}; choose from {', '.join(loadtest.PERSONAS)}")
+            try:
+                mix[name.strip()] = float(weight)
+            except ValueError:
+                raise CommandError(f'Bad weight in {part!r}')
+        if sum(mix.values()) <= 0:
+            raise CommandError('The persona weights add up to nothing')
+        return mix
+
+    @staticmethod
+    def start_server():
+        """
+        Serve from a forked process, so the virtual users don't compete with
+        the server's threads for one GIL and skew what each persona gets through.
+        """
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=False)
+        server.set_app(WSGIHandler())
+        host, port = server.server_address[:2]
+        # the child must open its own database connections
+        connections.close_all()
+        process = multiprocessing.get_context('fork').Process(target=server.serve_forever, daemon=True)
+        process.start()
+        server.server_close()
+        return process, host, port
+
+    def print_results(self, results):
+        self.stdout.write(f"{'request':<52}{'count':>7}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+                          f"{'max ms':>9}{'errors':>8}")
+        for name, row in results.items():
+            self.stdout.write(
+                f"{name:<52}{row['requests']:>7}{row['rps']:>8.1f}{row['p50']:>9.1f}{row['p95']:>9.1f}"
+                f"{row['p99']:>9.1f}{row['max']:>9.1f}{row['errors']:>8}"
+            )
+
+    def check_baseline(self, run, baseline, tolerance, path):
+        same = ('transport', 'users', 'think', 'mix')
+        if any(run[key] != baseline.get(key) for key in same):
+            self.stdout.write(self.style.WARNING(
+                f"Baseline {path} was taken with different options "
+                f"({', '.join(f'{key}={baseline.get(key)}' for key in same)}); comparing anyway"
+            ))
+        rows = loadtest.compare(run['results'], baseline['results'], tolerance)
+        self.stdout.write(f"\nAgainst {path} (tolerance {tolerance:.0%}):")
+        self.stdout.write(f"{'request':<52}{'p50':>9}{'p95':>9}{'req/s':>9}  status")
+        regressed = []
+        for name, p50_change, p95_change, rps_change, problems in rows:
+            if p50_change is None:
+                changes = f"{'-':>9}{'-':>9}{'-':>9}"
+            else:
+                changes = f'{p50_change:>+9.0%}{p95_change:>+9.0%}{rps_change:>+9.0%}'
+            self.stdout.write(f"{name:<52}{changes}  {', '.join(problems) or 'ok'}")
+            if problems:
+                regressed.append(name)
+        if regressed:
+            raise CommandError(f'{len(regressed)} requests regressed against the baseline')
+        self.stdout.write(self.style.SUCCESS('No regressions'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from core.holds import reap_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete expired booking slot holds. Safe to run from cron every few minutes.'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Removed {reap_expired()} expired holds")
@@ -0,0 +1,67 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_date
+
+from core.models import Appointment, DailyRollup
+from core.rollups import rebuild_range
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the daily revenue and utilisation rollups for a date range from the appointments. '
+        'Without --start/--end, covers every day that has appointments or rollups.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day, YYYY-MM-DD')
+        parser.add_argument('--end', help='Last day, YYYY-MM-DD')
+        parser.add_argument('--chunk-days', type=int, default=31,
+                            help='Days recomputed per transaction, so live bookings only wait for one chunk')
+
+    def handle(self, *args, **options):
+        start, end = self.parse(options['start']), self.parse(options['end'])
+        if start is None or end is None:
+            first, last = self.extent()
+            start, end = start or first, end or last
+        if start is None or end is None:
+            self.stdout.write('No appointments, nothing to rebuild')
+            return
+        if end < start:
+            raise CommandError('--end is before --start')
+
+        began = time.perf_counter()
+        chunk = timedelta(days=max(options['chunk_days'], 1))
+        day = start
+        while day <= end:
+            rebuild_range(day, min(day + chunk - timedelta(days=1), end))
+            day += chunk
+        self.stdout.write(
+            f"Rebuilt rollups from {start} to {end} ({DailyRollup.objects.filter(date__range=(start, end)).count()} "
+            f"rows) in {time.perf_counter() - began:.2f}s"
+        )
+
+    @staticmethod
+    def parse(value):
+        if value is None:
+            return None
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise CommandError(f'Not a date: {value}')
+        return day
+
+    @staticmethod
+    def extent():
+        appointments = Appointment.objects.aggregate(
+            first=Min(Coalesce('assigned_date', 'preferred_date')), last=Max(Coalesce('assigned_date', 'preferred_date'))
+        )
+        rollups = DailyRollup.objects.aggregate(first=Min('date'), last=Max('date'))
+        firsts = [day for day in (appointments['first'], rollups['first']) if day]
+        lasts = [day for day in (appointments['last'], rollups['last']) if day]
+        return min(firsts, default=None), max(lasts, default=None)
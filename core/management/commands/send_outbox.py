@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.outbox import deliver_outbox
+
+
+class Command(BaseCommand):
+    help = (
+        'Send queued emails from the outbox. Runs one pass by default; use --loop to keep '
+        'polling. To try it locally, run `python -m aiosmtpd -n -l localhost:1025` and set '
+        'EMAIL_HOST=localhost, EMAIL_PORT=1025, EMAIL_USE_TLS=False.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new emails')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when the outbox is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            total_sent = total_failed = 0
+            while True:
+                sent, failed = deliver_outbox(batch_size=options['batch_size'])
+                total_sent += sent
+                total_failed += failed
+                if not sent and not failed:
+                    break
+            if total_sent or total_failed:
+                self.stdout.write(f"Sent {total_sent}, failed {total_failed}")
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
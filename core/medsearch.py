@@ -0,0 +1,224 @@
+"""
+In-memory medication search used by the prescription modal.
+
+The index is built once per process from the catalogue (or from the JSON
+formulary named by settings.MEDICATION_FORMULARY) and answers name, type and
+strength queries without touching the database.
+"""
+import heapq
+import json
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from functools import lru_cache
+from itertools import islice
+
+from django.conf import settings
+
+from .catalogue import MEDICATIONS
+
+WORD_RE = re.compile(r'[a-z0-9.]+')
+
+# sorts after every character, so [prefix, prefix + MAX_CHAR) holds every key starting with prefix
+MAX_CHAR = '\U0010ffff'
+
+# rank bands; higher is better. Trigram matches score below all of them.
+EXACT, NAME_PREFIX, WORD_PREFIX, WORD_TYPO = 4.0, 3.0, 2.0, 1.0
+
+# one- or two-letter queries can prefix-match a large part of the formulary;
+# each rank band stops after this many candidates that pass the type/strength
+# filter. Bands are filled best first, so the cap never hides a better match.
+MAX_CANDIDATES = 200
+
+# shorter queries are too vague for typo matching
+MIN_FUZZY_LENGTH = 4
+
+# the trigram fallback scores at most this many names, taken from the
+# postings of the query's rarest trigrams
+MAX_FUZZY_CANDIDATES = 300
+
+
+def _deletes(word):
+    """The word plus every variant with one character removed."""
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class MedicationIndex:
+    def __init__(self, medications):
+        # ids are positions in name order, so sorting ids sorts by name
+        self.medications = sorted(medications, key=lambda med: med['name'].lower())
+        self.names = [med['name'].lower() for med in self.medications]
+        self._name_words = [WORD_RE.findall(name) for name in self.names]
+        self._name_grams = [frozenset(_trigrams(name)) for name in self.names]
+
+        # (word, id) pairs for every word of every name, sorted for prefix bisection;
+        # also one list per type, so a type-filtered query only walks that type's words
+        self._words = sorted(
+            (word, i) for i, words in enumerate(self._name_words) for word in set(words)
+        )
+        self._word_keys = [word for word, i in self._words]
+        self._type_words = defaultdict(list)
+        for word, i in self._words:
+            self._type_words[self.medications[i]['type'].lower()].append((word, i))
+        self._type_word_keys = {
+            drug_type: [word for word, i in words] for drug_type, words in self._type_words.items()
+        }
+
+        # one-edit typo lookup: any two words within one insertion, deletion or
+        # substitution of each other share a deletion variant
+        self._word_ids = defaultdict(list)
+        for word, i in self._words:
+            self._word_ids[word].append(i)
+        self._typo_words = defaultdict(set)
+        for word in self._word_ids:
+            if len(word) >= MIN_FUZZY_LENGTH:
+                for variant in _deletes(word):
+                    self._typo_words[variant].add(word)
+
+        self._trigrams = defaultdict(list)
+        self._types = defaultdict(set)
+        self._strengths = defaultdict(set)
+        for i, med in enumerate(self.medications):
+            for gram in self._name_grams[i]:
+                self._trigrams[gram].append(i)
+            self._types[med['type'].lower()].add(i)
+            for strength in med['strengths']:
+                self._strengths[strength.lower()].add(i)
+        self._strength_keys = sorted(self._strengths)
+        self._filter = lru_cache(maxsize=1024)(self._build_filter)
+
+    def __len__(self):
+        return len(self.medications)
+
+    def search(self, query='', drug_type=None, strength=None, limit=10):
+        """Return up to `limit` medication dicts, best match first."""
+        name_terms = []
+        for term in query.lower().split():
+            # "amox 250mg" -> name "amox", strength "250mg"
+            if term[0].isdigit() and not strength:
+                strength = term
+            else:
+                name_terms.append(term)
+        name = ' '.join(name_terms)
+        # names are split into words on punctuation, so the terms are too: "(amoxi" -> "amoxi"
+        word_terms = WORD_RE.findall(name)
+
+        allowed = ordered = None
+        if drug_type or strength:
+            allowed, ordered = self._filter((drug_type or '').lower(), (strength or '').lower())
+            if not name:
+                return [self.medications[i] for i in ordered[:limit]]
+        elif not name:
+            return self.medications[:limit]
+
+        scores = self._name_prefix_scores(name, ordered)
+        if len(scores) < limit and word_terms:
+            self._word_prefix_scores(word_terms, allowed, (drug_type or '').lower(), scores)
+
+        if not scores and len(name) >= MIN_FUZZY_LENGTH:
+            scores = (word_terms and self._typo_scores(word_terms, allowed)) or self._trigram_scores(name, allowed)
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [self.medications[i] for i, score in best]
+
+    def _build_filter(self, drug_type, strength):
+        # cached per (type, strength prefix): the allowed ids, and the same ids in name order
+        allowed = None
+        if drug_type:
+            allowed = self._types.get(drug_type, set())
+        if strength:
+            keys = self._strength_keys
+            pos = bisect_left(keys, strength)
+            matched = set()
+            while pos < len(keys) and keys[pos].startswith(strength):
+                matched |= self._strengths[keys[pos]]
+                pos += 1
+            allowed = matched if allowed is None else allowed & matched
+        return frozenset(allowed), sorted(allowed)
+
+    def _name_prefix_scores(self, name, ordered=None):
+        # ids are in name order, so the names starting with `name` are one id range,
+        # and the allowed ones are one slice of the filter's sorted ids
+        lo = bisect_left(self.names, name)
+        hi = bisect_left(self.names, name + MAX_CHAR, lo)
+        if ordered is None:
+            ids = range(lo, min(hi, lo + MAX_CANDIDATES))
+        else:
+            start = bisect_left(ordered, lo)
+            ids = ordered[start:min(bisect_left(ordered, hi, start), start + MAX_CANDIDATES)]
+        # shorter names first within a band
+        return {i: (EXACT if self.names[i] == name else NAME_PREFIX) - len(self.names[i]) / 1000 for i in ids}
+
+    def _word_prefix_scores(self, terms, allowed, drug_type, scores):
+        # names with a word starting with each term: walk the term with the fewest
+        # words, check the others, and count only matches toward the cap
+        if drug_type:
+            words, keys = self._type_words.get(drug_type, []), self._type_word_keys.get(drug_type, [])
+        else:
+            words, keys = self._words, self._word_keys
+        ranges = [(bisect_left(keys, term), bisect_left(keys, term + MAX_CHAR), term) for term in terms]
+        lo, hi, term = min(ranges, key=lambda r: r[1] - r[0])
+        others = [t for t in terms if t != term]
+        found = 0
+        for pos in range(lo, hi):
+            i = words[pos][1]
+            if i in scores or (allowed is not None and i not in allowed):
+                continue
+            if all(any(w.startswith(t) for w in self._name_words[i]) for t in others):
+                scores[i] = WORD_PREFIX - len(self.names[i]) / 1000
+                found += 1
+                if found >= MAX_CANDIDATES:
+                    break
+
+    def _typo_scores(self, name_terms, allowed):
+        # names containing a word one edit away from the longest term
+        term = max(name_terms, key=len)
+        words = set()
+        for variant in _deletes(term):
+            words |= self._typo_words.get(variant, set())
+
+        scores = {}
+        for word in words:
+            for i in self._word_ids[word]:
+                if allowed is None or i in allowed:
+                    scores[i] = WORD_TYPO - len(self.names[i]) / 1000
+        return scores
+
+    def _trigram_scores(self, name, allowed):
+        # last resort for partial words with typos, scored by trigram similarity
+        grams = sorted(_trigrams(name), key=lambda gram: len(self._trigrams.get(gram, ())))
+        threshold = max(2, (len(grams) + 1) // 2)
+
+        # a name sharing `threshold` grams with the query must contain at least
+        # one of its len(grams) - threshold + 1 rarest grams
+        candidates = set()
+        for gram in grams[:len(grams) - threshold + 1]:
+            candidates.update(islice(self._trigrams.get(gram, ()), MAX_FUZZY_CANDIDATES - len(candidates)))
+            if len(candidates) >= MAX_FUZZY_CANDIDATES:
+                break
+
+        query_grams = frozenset(grams)
+        scores = {}
+        for i in candidates:
+            if allowed is not None and i not in allowed:
+                continue
+            shared = len(self._name_grams[i] & query_grams)
+            if shared >= threshold:
+                scores[i] = shared / len(self._name_grams[i] | query_grams)
+        return scores
+
+
+def load_formulary():
+    path = getattr(settings, 'MEDICATION_FORMULARY', None)
+    if path:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    return MEDICATIONS
+
+
+medication_index = MedicationIndex(load_formulary())
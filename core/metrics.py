@@ -0,0 +1,328 @@
+"""
+Prometheus metrics for requests, the database, PDF rendering, email and caches.
+
+Every metric is a counter or a histogram, and both are stored as plain
+sums (histogram buckets are cumulative counts). Values from different
+processes can therefore simply be added together. Each process writes its
+values to METRICS_DIR/<pid>.json at most every METRICS_FLUSH_SECONDS, and
+again at exit. metrics_view() adds up all the files, using this process's
+live values in place of its own file, so the output covers every worker on
+the host.
+
+A process that reuses a pid picks up the old file's values and keeps
+counting from there, so totals never go backwards. Clear METRICS_DIR when
+the whole server is restarted. With METRICS_DIR set to None, each process
+reports only its own values.
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Registry:
+    """
+    Metric values for this process, keyed by (metric, suffix, labels).
+
+    `suffix` is '' for counters and '_bucket', '_sum' or '_count' for
+    histograms; `labels` is a sorted tuple of (name, value) pairs.
+    """
+
+    def __init__(self, directory=None, flush_seconds=5):
+        self.directory = Path(directory) if directory else None
+        self.flush_seconds = flush_seconds
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._values = {}
+        self._last_flush = 0.0
+        atexit.register(self.flush)
+
+    def _file(self, pid):
+        return self.directory / f'{pid}.json'
+
+    def _read(self, path):
+        try:
+            samples = json.loads(path.read_text())
+        except (OSError, ValueError):
+            # missing, or being replaced by its process right now
+            return {}
+        return {(metric, suffix, tuple(map(tuple, labels))): value for metric, suffix, labels, value in samples}
+
+    def _own_values(self):
+        """This process's values; reset after a fork so a child never counts its parent's."""
+        pid = os.getpid()
+        if self._pid != pid:
+            self._pid = pid
+            self._values = defaultdict(float)
+            if self.directory:
+                self._values.update(self._read(self._file(pid)))
+        return self._values
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add(self, samples):
+        """Add `amount` to each (metric, suffix, labels, amount) in `samples`."""
+        with self._lock:
+            values = self._own_values()
+            for metric, suffix, labels, amount in samples:
+                values[metric, suffix, labels] += amount
+            due = self.directory and time.monotonic() - self._last_flush >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self):
+        if not self.directory:
+            return
+        with self._lock:
+            values = self._own_values()
+            if not values:
+                return
+            snapshot = [[metric, suffix, labels, value] for (metric, suffix, labels), value in values.items()]
+            self._last_flush = time.monotonic()
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self._file(self._pid))
+        except OSError:
+            # metrics must never take a request down; the next flush retries
+            pass
+
+    def collect(self):
+        """Values summed over every process on the host."""
+        totals = defaultdict(float)
+        with self._lock:
+            own = dict(self._own_values())
+            pid = self._pid
+        if self.directory and self.directory.is_dir():
+            for path in self.directory.glob('*.json'):
+                if path.stem == str(pid):
+                    continue
+                for key, value in self._read(path).items():
+                    totals[key] += value
+        for key, value in own.items():
+            totals[key] += value
+        return totals
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        samples = defaultdict(list)
+        for (metric, suffix, labels), value in self.collect().items():
+            samples[metric].append((suffix, labels, value))
+
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for suffix, labels, value in sorted(samples.get(name, ()), key=metric.sort_key):
+                label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+                lines.append(f'{name}{suffix}{{{label_text}}} {_format_value(value)}' if labels
+                             else f'{name}{suffix} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, registry, name, documentation):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        self.registry.add([(self.name, '', tuple(sorted(labels.items())), amount)])
+
+    @staticmethod
+    def sort_key(sample):
+        suffix, labels, value = sample
+        return labels
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets) + (float('inf'),)
+        registry.register(self)
+
+    def observe(self, value, **labels):
+        labels = tuple(sorted(labels.items()))
+        # every bucket is written, even with 0, so each series has the full set
+        samples = [
+            (self.name, '_bucket', labels + (('le', _format_value(bound)),), int(value <= bound))
+            for bound in self.buckets
+        ]
+        samples.append((self.name, '_sum', labels, value))
+        samples.append((self.name, '_count', labels, 1))
+        self.registry.add(samples)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def sort_key(sample):
+        # group each label set's buckets in ascending order, then its _sum and _count
+        suffix, labels, value = sample
+        le = dict(labels).get('le')
+        series = tuple(label for label in labels if label[0] != 'le')
+        return series, ('_bucket', '_sum', '_count').index(suffix), float(le) if le else 0.0
+
+
+registry = Registry(
+    getattr(settings, 'METRICS_DIR', settings.BASE_DIR / '.cache' / 'metrics'),
+    getattr(settings, 'METRICS_FLUSH_SECONDS', 5),
+)
+
+request_duration = Histogram(
+    registry, 'clinic_http_request_duration_seconds',
+    'Time to produce a response, by URL name, method and status class.',
+)
+db_queries = Counter(registry, 'clinic_db_queries_total', 'SQL queries run while handling requests, by URL name.')
+db_query_seconds = Counter(registry, 'clinic_db_query_seconds_total', 'Time spent in SQL queries, by URL name.')
+pdf_render_duration = Histogram(
+    registry, 'clinic_prescription_pdf_render_seconds', 'Time to render a prescription PDF on a cache miss.',
+)
+emails = Counter(registry, 'clinic_emails_total', 'Email dispatch outcomes, by email kind and result.')
+email_duration = Histogram(registry, 'clinic_email_duration_seconds', 'Time to queue or send one email, by kind.')
+cache_requests = Counter(registry, 'clinic_cache_requests_total', 'Cache lookups, by cache and hit or miss.')
+
+
+def cache_lookup(name, hit):
+    cache_requests.inc(cache=name, result='hit' if hit else 'miss')
+
+
+@contextmanager
+def email_dispatch(kind, result):
+    """
+    Time queueing or sending one email and count its outcome. The block may
+    change outcome['result'] from `result`; an exception records 'error'.
+    """
+    outcome = {'result': result}
+    start = time.perf_counter()
+    try:
+        yield outcome
+    except Exception:
+        outcome['result'] = 'error'
+        raise
+    finally:
+        email_duration.observe(time.perf_counter() - start, kind=kind)
+        emails.inc(kind=kind, result=outcome['result'])
+
+
+def records_email(kind):
+    """Decorator for functions that queue an email and return it, or None when there is no recipient."""
+    def decorator(send):
+        @wraps(send)
+        def wrapper(*args, **kwargs):
+            with email_dispatch(kind, 'queued') as outcome:
+                email = send(*args, **kwargs)
+                if email is None:
+                    outcome['result'] = 'skipped'
+            return email
+        return wrapper
+    return decorator
+
+
+class _QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else '<unresolved>'
+
+
+def _record(request, response, duration, timer=None):
+    view = _view_name(request)
+    status = f'{response.status_code // 100}xx' if response is not None else '5xx'
+    request_duration.observe(duration, view=view, method=request.method, status=status)
+    if timer is not None:
+        db_queries.inc(timer.count, view=view)
+        db_query_seconds.inc(timer.seconds, view=view)
+
+
+class MetricsMiddleware:
+    """
+    Records request latency and, for sync requests, query count and time.
+
+    Put it first in MIDDLEWARE so the other middleware's time is included.
+    A streaming response is timed until it is returned, not until its body
+    has been sent. Queries from async views run on other threads and are
+    not counted.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = _QueryTimer()
+        response = None
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timer))
+                response = self.get_response(request)
+        finally:
+            _record(request, response, time.perf_counter() - start, timer)
+        return response
+
+    async def __acall__(self, request):
+        response = None
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _record(request, response, time.perf_counter() - start)
+        return response
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.3 on 2026-10-17 10:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_appointment_pet_age_appointment_pet_weight_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='chief_complaint',
+            field=models.TextField(blank=True, verbose_name='Chief Complaint'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='diagnosis',
+            field=models.CharField(blank=True, db_index=True, max_length=255, verbose_name='Diagnosis'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='follow_up',
+            field=models.TextField(blank=True, verbose_name='Follow-up'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='instructions',
+            field=models.TextField(blank=True, verbose_name='Instructions'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='medications',
+            field=models.TextField(blank=True, verbose_name='Prescription (Rx)'),
+        ),
+        migrations.CreateModel(
+            name='PrescriptionMedication',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('drug_name', models.CharField(db_index=True, max_length=100)),
+                ('strength', models.CharField(blank=True, max_length=30)),
+                ('sig', models.TextField(blank=True)),
+                ('appointment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='medication_lines', to='core.appointment')),
+            ],
+            options={
+                'ordering': ['appointment', 'position'],
+            },
+        ),
+    ]
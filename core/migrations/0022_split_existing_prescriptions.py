@@ -0,0 +1,96 @@
+import re
+
+from django.db import migrations
+
+# Copies of core.utils as they were when this migration was written, so
+# later changes to the live helpers cannot change what it does.
+PRESCRIPTION_SECTIONS = {
+    'chief_complaint': 'CHIEF COMPLAINT',
+    'diagnosis': 'DIAGNOSIS',
+    'medications': 'PRESCRIPTION (Rx)',
+    'instructions': 'INSTRUCTIONS',
+    'follow_up': 'FOLLOW-UP',
+}
+MEDICATION_ITEM_RE = re.compile(r'^\d+\.\s*(.+)$')
+STRENGTH_RE = re.compile(r'\s(\d[\d.,]*\s?(?:mg|mcg|g|ml|U|IU|%)(?:/\w+)?)(?=\s|$)', re.IGNORECASE)
+
+
+def split_prescription(text):
+    sections = dict.fromkeys(PRESCRIPTION_SECTIONS, '')
+    current = None
+    for part in text.replace('\r\n', '\n').split('\n\n'):
+        for field, header in PRESCRIPTION_SECTIONS.items():
+            if part.startswith(f"{header}:"):
+                current = field
+                sections[field] = part.replace(f"{header}:\n", '', 1)
+                break
+        else:
+            if current:
+                sections[current] += '\n\n' + part
+    return sections
+
+
+def parse_medication_lines(text):
+    lines = []
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        item = MEDICATION_ITEM_RE.match(line)
+        if item or not lines:
+            head = item.group(1) if item else line
+            strength = STRENGTH_RE.search(' ' + head)
+            if strength:
+                drug_name = head[:strength.start()].strip() or head
+                strength = strength.group(1)
+            else:
+                drug_name, strength = head, ''
+            lines.append({'drug_name': drug_name[:100], 'strength': strength[:30], 'sig': ''})
+        else:
+            sig = line[4:].strip() if line.lower().startswith('sig:') else line
+            lines[-1]['sig'] = f"{lines[-1]['sig']}\n{sig}".strip()
+    return lines
+
+
+# Appointment.diagnosis is a CharField(max_length=255)
+DIAGNOSIS_MAX_LENGTH = 255
+DIAGNOSIS_MARKER = ' [full diagnosis in chief complaint]'
+
+
+def keep_long_diagnosis(sections):
+    """
+    A diagnosis that does not fit the column is copied in full to the end of
+    the chief complaint, and the column keeps its start plus a marker, so
+    recomposing the prescription later loses none of the text.
+    """
+    diagnosis = sections['diagnosis']
+    if len(diagnosis) <= DIAGNOSIS_MAX_LENGTH:
+        return sections
+    full = f"DIAGNOSIS (full text):\n{diagnosis}"
+    sections['chief_complaint'] = f"{sections['chief_complaint']}\n\n{full}" if sections['chief_complaint'] else full
+    sections['diagnosis'] = diagnosis[:DIAGNOSIS_MAX_LENGTH - len(DIAGNOSIS_MARKER)].rstrip() + DIAGNOSIS_MARKER
+    return sections
+
+
+def split_prescriptions(apps, schema_editor):
+    Appointment = apps.get_model('core', 'Appointment')
+    PrescriptionMedication = apps.get_model('core', 'PrescriptionMedication')
+
+    for appointment in Appointment.objects.exclude(prescription='').iterator():
+        sections = keep_long_diagnosis(split_prescription(appointment.prescription))
+        Appointment.objects.filter(pk=appointment.pk).update(**sections)
+        PrescriptionMedication.objects.bulk_create([
+            PrescriptionMedication(appointment_id=appointment.pk, position=position, **line)
+            for position, line in enumerate(parse_medication_lines(sections['medications']), start=1)
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_appointment_structured_prescription'),
+    ]
+
+    operations = [
+        migrations.RunPython(split_prescriptions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-17 10:00
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def create_sequence(apps, schema_editor):
+    Appointment = apps.get_model('core', 'Appointment')
+    AppointmentIdSequence = apps.get_model('core', 'AppointmentIdSequence')
+    legacy_max_pk = Appointment.objects.aggregate(Max('pk'))['pk__max'] or 0
+    AppointmentIdSequence.objects.create(pk=1, next_value=1, legacy_max_pk=legacy_max_pk)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_outboxemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentIdSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_value', models.BigIntegerField(default=1)),
+                ('legacy_max_pk', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_sequence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.3 on 2026-10-17 10:00
+
+import django.db.models.deletion
+import datetime
+
+from django.db import migrations, models
+
+# core.utils.DAILY_SLOTS when this migration was written: 16 half-hour slots from 09:00
+DAILY_SLOTS = [datetime.time(9 + i // 2, 30 * (i % 2)) for i in range(16)]
+
+
+def build_schedules(apps, schema_editor):
+    Appointment = apps.get_model('core', 'Appointment')
+    VetDaySchedule = apps.get_model('core', 'VetDaySchedule')
+    slot_bits = {slot: 1 << i for i, slot in enumerate(DAILY_SLOTS)}
+
+    masks = {}
+    rows = Appointment.objects.exclude(status='cancelled').filter(
+        assigned_doctor__isnull=False, assigned_date__isnull=False, assigned_time__in=DAILY_SLOTS
+    ).values_list('assigned_doctor_id', 'assigned_date', 'assigned_time')
+    for vet_id, day, at in rows:
+        masks[vet_id, day] = masks.get((vet_id, day), 0) | slot_bits[at]
+    VetDaySchedule.objects.bulk_create([
+        VetDaySchedule(vet_id=vet_id, date=day, booked_mask=mask) for (vet_id, day), mask in masks.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_appointmentidsequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VetDaySchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('booked_mask', models.IntegerField(default=0)),
+                ('vet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.vet')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('vet', 'date'), name='unique_vet_day_schedule')],
+            },
+        ),
+        migrations.RunPython(build_schedules, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.3 on 2026-10-17 10:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_slothold'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appointment',
+            name='assigned_doctor',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.vet'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['assigned_doctor', 'status', 'assigned_date', 'assigned_time'], name='appt_doctor_status_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['assigned_doctor', 'assigned_date', 'assigned_time'], name='appt_doctor_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['email', 'assigned_date', 'assigned_time', 'preferred_date', 'preferred_time'], name='appt_email_schedule_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['assigned_date', 'assigned_time'], name='appt_assigned_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['status'], name='appt_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['payment_status'], name='appt_payment_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['completion_status'], name='appt_completion_status_idx'),
+        ),
+    ]
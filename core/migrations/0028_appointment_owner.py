@@ -0,0 +1,51 @@
+# Generated by Django 5.2.3 on 2026-10-17 10:00
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def link_owners(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    Appointment = apps.get_model('core', 'Appointment')
+
+    # the oldest account wins when several share an email
+    owners = {}
+    for user_id, email in User.objects.exclude(email='').order_by('-pk').values_list('id', 'email'):
+        owners[email.lower()] = user_id
+
+    by_owner = defaultdict(list)
+    for pk, email in Appointment.objects.exclude(email='').values_list('pk', 'email').iterator():
+        if email.lower() in owners:
+            by_owner[owners[email.lower()]].append(pk)
+
+    for user_id, pks in by_owner.items():
+        for start in range(0, len(pks), 500):
+            Appointment.objects.filter(pk__in=pks[start:start + 500]).update(owner_id=user_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_appointment_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='appointment',
+            name='appt_email_schedule_idx',
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='owner',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='appointments', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['owner', 'preferred_date', 'preferred_time'], name='appt_owner_history_idx'),
+        ),
+        migrations.RunPython(link_owners, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:00
+
+import django.db.models.deletion
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+
+# core.utils.DAILY_SLOTS when this migration was written: 16 half-hour slots from 09:00
+DAILY_SLOTS = [datetime.time(9 + i // 2, 30 * (i % 2)) for i in range(16)]
+
+
+def build_rollups(apps, schema_editor):
+    Appointment = apps.get_model('core', 'Appointment')
+    DailyRollup = apps.get_model('core', 'DailyRollup')
+
+    statuses = ['pending', 'confirmed', 'cancelled', 'completed']
+    totals = {status: Count('pk', filter=Q(status=status)) for status in statuses}
+    for payment in ['paid', 'refunded']:
+        totals[f'{payment}_count'] = Count('pk', filter=Q(payment_status=payment))
+        totals[f'{payment}_total'] = Sum('payment_amount', filter=Q(payment_status=payment), default=0)
+    totals['booked_slots'] = Count('pk', filter=Q(
+        assigned_doctor__isnull=False, assigned_date__isnull=False, assigned_time__in=DAILY_SLOTS,
+    ) & ~Q(status='cancelled'))
+
+    rows = (
+        Appointment.objects.annotate(day=Coalesce('assigned_date', 'preferred_date'))
+        .values('day', 'assigned_doctor', 'service')
+        .annotate(**totals)
+        .order_by()
+    )
+    DailyRollup.objects.bulk_create(
+        [
+            DailyRollup(
+                date=row['day'], vet_id=row['assigned_doctor'], service=row['service'],
+                **{field: row[field] for field in totals},
+            )
+            for row in rows
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_appointment_owner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('service', models.CharField(choices=[('Preventive Care', 'Preventive Care'), ('Surgical Procedures', 'Surgical Procedures'), ('Dental Care', 'Dental Care'), ('Diagnostic Imaging', 'Diagnostic Imaging'), ('Emergency Services', 'Emergency Services'), ('Nutritional Counseling', 'Nutritional Counseling')], max_length=40)),
+                ('pending', models.IntegerField(default=0)),
+                ('confirmed', models.IntegerField(default=0)),
+                ('cancelled', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('paid_count', models.IntegerField(default=0)),
+                ('paid_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('refunded_count', models.IntegerField(default=0)),
+                ('refunded_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('booked_slots', models.IntegerField(default=0)),
+                ('vet', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.vet')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'vet', 'service'), name='unique_daily_rollup')],
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
 
-from django.db import models
+from .utils import PRESCRIPTION_SECTIONS, compose_prescription, parse_medication_lines
+from .ids import allocator
 
 class Vet(models.Model):
     DEPARTMENTS = [
@@ -45,9 +46,22 @@ def create_or_update_user_profile(sender, instance, created, **kwargs):
 
         if not hasattr(instance, 'vet'):
             Profile.objects.create(user=instance)
+        if instance.email:
+            # appointments booked under this email before the account existed
+            Appointment.objects.filter(owner__isnull=True, email__iexact=instance.email).update(owner=instance)
     else:
         if hasattr(instance, 'profile'):
-            instance.profile.save()
+            from .writes import run_write
+            run_write(instance.profile.save)
+
+
+class AppointmentManager(models.Manager):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        missing = [obj for obj in objs if not obj.appointment_id]
+        for obj, appointment_id in zip(missing, allocator.allocate(len(missing))):
+            obj.appointment_id = appointment_id
+        return super().bulk_create(objs, *args, **kwargs)
 
 
 class Appointment(models.Model):
@@ -93,6 +107,10 @@ class Appointment(models.Model):
     owner_name = models.CharField(max_length=100)
     phone = models.CharField(max_length=20)
     email = models.EmailField(blank=True)
+    # indexed through appt_owner_history_idx, which starts with this column
+    owner = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='appointments', db_index=False
+    )
     pet_name = models.CharField(max_length=100)
     pet_species = models.CharField(max_length=20, choices=SPECIES_CHOICES)
     pet_age = models.CharField(max_length=20, blank=True, verbose_name="Pet Age")
@@ -102,10 +120,16 @@ class Appointment(models.Model):
     reason = models.TextField(blank=True)
     service = models.CharField(max_length=40, choices=SERVICE_CHOICES)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
-    assigned_doctor = models.ForeignKey('Vet', on_delete=models.SET_NULL, null=True, blank=True)
+    # indexed through appt_doctor_slot_idx, which starts with this column
+    assigned_doctor = models.ForeignKey('Vet', on_delete=models.SET_NULL, null=True, blank=True, db_index=False)
     assigned_time = models.TimeField(null=True, blank=True)
     assigned_date = models.DateField(null=True, blank=True)
     prescription = models.TextField(blank=True, verbose_name="Prescription/Notes")
+    chief_complaint = models.TextField(blank=True, verbose_name="Chief Complaint")
+    diagnosis = models.CharField(max_length=255, blank=True, db_index=True, verbose_name="Diagnosis")
+    medications = models.TextField(blank=True, verbose_name="Prescription (Rx)")
+    instructions = models.TextField(blank=True, verbose_name="Instructions")
+    follow_up = models.TextField(blank=True, verbose_name="Follow-up")
     
     PAYMENT_STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -126,18 +150,34 @@ class Appointment(models.Model):
     def __str__(self):
         return f"{self.owner_name} - {self.appointment_id}"
 
+    objects = AppointmentManager()
+
     def save(self, *args, **kwargs):
         if not self.appointment_id:
             self.appointment_id = self.generate_unique_id()
+        if self._state.adding and not self.owner_id and self.email:
+            # e.g. booked by staff in the admin for a client who has an account
+            self.owner = User.objects.filter(email__iexact=self.email).order_by('pk').first()
         super().save(*args, **kwargs)
 
     def generate_unique_id(self):
-        from random import choices
-        import string
-        while True:
-            unique_id = ''.join(choices(string.ascii_uppercase + string.digits, k=8))
-            if not Appointment.objects.filter(appointment_id=unique_id).exists():
-                return unique_id
+        return allocator.allocate()[0]
+
+    def set_prescription(self, **sections):
+        for field in PRESCRIPTION_SECTIONS:
+            setattr(self, field, sections.get(field, ''))
+        self.prescription = self.compose_prescription()
+
+    def compose_prescription(self):
+        # printable text used by the PDF, receipts and the admin
+        return compose_prescription({field: getattr(self, field) for field in PRESCRIPTION_SECTIONS})
+
+    def sync_medication_lines(self):
+        self.medication_lines.all().delete()
+        PrescriptionMedication.objects.bulk_create([
+            PrescriptionMedication(appointment=self, position=position, **line)
+            for position, line in enumerate(parse_medication_lines(self.medications), start=1)
+        ])
 
     @property
     def display_time(self):
@@ -148,4 +188,227 @@ class Appointment(models.Model):
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['preferred_date', 'preferred_time'], name='unique_preferred_slot')
-        ]
\ No newline at end of file
+        ]
+        # each index backs a query path; test_query_plans checks none of them scans the table
+        indexes = [
+            # doctor dashboard: one vet's confirmed appointments by day and time
+            models.Index(fields=['assigned_doctor', 'status', 'assigned_date', 'assigned_time'], name='appt_doctor_status_day_idx'),
+            # admin conflict check, availability rebuild, "appointments for this vet"
+            models.Index(fields=['assigned_doctor', 'assigned_date', 'assigned_time'], name='appt_doctor_slot_idx'),
+            # profile page: a client's history, paged newest first by (preferred_date, preferred_time)
+            models.Index(fields=['owner', 'preferred_date', 'preferred_time'], name='appt_owner_history_idx'),
+            # admin date hierarchy and upcoming/past filters
+            models.Index(fields=['assigned_date', 'assigned_time'], name='appt_assigned_day_idx'),
+            # admin list filters
+            models.Index(fields=['status'], name='appt_status_idx'),
+            models.Index(fields=['payment_status'], name='appt_payment_status_idx'),
+            models.Index(fields=['completion_status'], name='appt_completion_status_idx'),
+        ]
+
+
+class PrescriptionMedication(models.Model):
+    """One medication line from an appointment's Rx section."""
+    appointment = models.ForeignKey(Appointment, on_delete=models.CASCADE, related_name='medication_lines')
+    position = models.PositiveSmallIntegerField()
+    drug_name = models.CharField(max_length=100, db_index=True)
+    strength = models.CharField(max_length=30, blank=True)
+    sig = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['appointment', 'position']
+
+    def __str__(self):
+        return f"{self.drug_name} {self.strength}".strip()
+
+
+class OutboxEmail(models.Model):
+    """An email waiting to be sent by the send_outbox worker."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.TextField(help_text="Comma-separated recipients")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.to}"
+
+
+class AppointmentIdSequence(models.Model):
+    """Single row (pk=1) holding the next number for core.ids.allocator."""
+    next_value = models.BigIntegerField(default=1)
+    # appointments up to this pk have random IDs from before the allocator
+    legacy_max_pk = models.BigIntegerField(default=0)
+
+
+class VetDaySchedule(models.Model):
+    """Which of a vet's DAILY_SLOTS are taken on a day, as a bitmask (see core.availability)."""
+    vet = models.ForeignKey(Vet, on_delete=models.CASCADE)
+    date = models.DateField()
+    booked_mask = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['vet', 'date'], name='unique_vet_day_schedule')
+        ]
+
+    def __str__(self):
+        return f"{self.vet} - {self.date}"
+
+
+class SlotHold(models.Model):
+    """A user's short-lived claim on a preferred date/time while they finish booking (see core.holds)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    preferred_date = models.DateField()
+    preferred_time = models.TimeField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['preferred_date', 'preferred_time'], name='unique_slot_hold')
+        ]
+
+    def __str__(self):
+        return f"{self.preferred_date} {self.preferred_time} held by {self.user}"
+
+
+class DailyRollup(models.Model):
+    """One day's appointments for one vet (None = unassigned) and service, totalled (see core.rollups)."""
+    date = models.DateField()
+    vet = models.ForeignKey(Vet, on_delete=models.CASCADE, null=True, blank=True)
+    service = models.CharField(max_length=40, choices=Appointment.SERVICE_CHOICES)
+    pending = models.IntegerField(default=0)
+    confirmed = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    paid_count = models.IntegerField(default=0)
+    paid_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    refunded_count = models.IntegerField(default=0)
+    refunded_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # how many of the vet's DAILY_SLOTS these appointments take
+    booked_slots = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'vet', 'service'], name='unique_daily_rollup')
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.vet or 'Unassigned'} - {self.service}"
+
+
+SLOT_FIELDS = ['assigned_doctor_id', 'assigned_date', 'assigned_time', 'status']
+
+
+@receiver(post_init, sender=Appointment)
+def remember_booked_slot(sender, instance, **kwargs):
+    from .availability import booked_slot
+    if instance.get_deferred_fields().intersection(SLOT_FIELDS):
+        instance._booked_slot = None
+        instance._booked_slot_known = False
+    else:
+        instance._booked_slot = booked_slot(
+            instance.assigned_doctor_id, instance.assigned_date, instance.assigned_time, instance.status
+        )
+        instance._booked_slot_known = True
+
+
+@receiver(pre_save, sender=Appointment)
+def load_booked_slot(sender, instance, **kwargs):
+    # instances loaded with .only()/.defer() don't know their old slot yet
+    from .availability import booked_slot
+    if not instance._booked_slot_known and instance.pk:
+        old = Appointment.objects.filter(pk=instance.pk).values_list(*SLOT_FIELDS).first()
+        if old:
+            doctor_id, day, at, status = old
+            instance._booked_slot = booked_slot(doctor_id, day, at, status)
+        instance._booked_slot_known = True
+
+
+@receiver(post_save, sender=Appointment)
+def update_booked_slot(sender, instance, created, **kwargs):
+    from .availability import apply_change, booked_slot
+    from .schedule import invalidate_schedules
+    old = None if created else instance._booked_slot
+    new = booked_slot(instance.assigned_doctor_id, instance.assigned_date, instance.assigned_time, instance.status)
+    apply_change(old, new)
+    invalidate_schedules([old and old[0], instance.assigned_doctor_id])
+    instance._booked_slot = new
+
+
+@receiver(post_delete, sender=Appointment)
+def release_booked_slot(sender, instance, **kwargs):
+    from .availability import apply_change
+    from .schedule import invalidate_schedules
+    apply_change(instance._booked_slot, None)
+    invalidate_schedules([instance._booked_slot and instance._booked_slot[0], instance.assigned_doctor_id])
+
+
+ROLLUP_FIELDS = [
+    'assigned_doctor_id', 'assigned_date', 'assigned_time', 'preferred_date', 'service', 'status',
+    'payment_status', 'payment_amount',
+]
+
+
+@receiver(post_init, sender=Appointment)
+def remember_rollup_values(sender, instance, **kwargs):
+    if instance.get_deferred_fields().intersection(ROLLUP_FIELDS):
+        instance._rollup_values = None
+    else:
+        instance._rollup_values = tuple(getattr(instance, field) for field in ROLLUP_FIELDS)
+
+
+@receiver(pre_save, sender=Appointment)
+def load_rollup_values(sender, instance, **kwargs):
+    if instance._rollup_values is None and instance.pk:
+        instance._rollup_values = Appointment.objects.filter(pk=instance.pk).values_list(*ROLLUP_FIELDS).first()
+
+
+@receiver(post_save, sender=Appointment)
+def update_rollups(sender, instance, created, **kwargs):
+    from .rollups import apply_change
+    new = tuple(getattr(instance, field) for field in ROLLUP_FIELDS)
+    apply_change(None if created else instance._rollup_values, new)
+    instance._rollup_values = new
+
+
+@receiver(post_delete, sender=Appointment)
+def release_rollups(sender, instance, **kwargs):
+    from .rollups import apply_change
+    apply_change(instance._rollup_values, None)
+
+
+@receiver(pre_delete, sender=Vet)
+def remember_rollup_days(sender, instance, **kwargs):
+    # deleting a vet unassigns their appointments with a bulk update, which sends no signals
+    instance._rollup_days = set(DailyRollup.objects.filter(vet=instance).values_list('date', flat=True))
+
+
+@receiver(post_delete, sender=Vet)
+def rebuild_vet_rollups(sender, instance, **kwargs):
+    from .rollups import rebuild
+    rebuild(getattr(instance, '_rollup_days', ()))
+
+
+@receiver(post_save, sender=Vet)
+@receiver(post_delete, sender=Vet)
+def invalidate_vet_pages(sender, **kwargs):
+    # the Our Team page lists every vet
+    from .pagecache import invalidate_pages
+    invalidate_pages()
@@ -0,0 +1,130 @@
+"""
+Durable outgoing email.
+
+queue_email() stores a message in the OutboxEmail table, inside the caller's
+transaction, and returns immediately. Inside `with batched():` the messages
+are inserted together when the block ends. deliver_outbox() (run by
+`manage.py send_outbox`) sends due messages in batches over one connection
+and reschedules failures with exponential backoff.
+"""
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from . import metrics
+from .models import OutboxEmail
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+_batch = threading.local()
+
+
+@contextmanager
+def batched():
+    """Collect the emails queued inside the block and insert them with one query."""
+    if getattr(_batch, 'emails', None) is not None:
+        yield
+        return
+    _batch.emails = []
+    try:
+        yield
+        OutboxEmail.objects.bulk_create(_batch.emails)
+    finally:
+        _batch.emails = None
+
+
+def queue_email(subject, message, recipient_list, from_email=None):
+    recipients = [r for r in recipient_list if r]
+    if not recipients:
+        return None
+    email = OutboxEmail(
+        subject=subject,
+        body=message,
+        from_email=from_email or '',
+        to=','.join(recipients),
+    )
+    if getattr(_batch, 'emails', None) is not None:
+        _batch.emails.append(email)
+    else:
+        email.save()
+    return email
+
+
+def retry_delay(attempts):
+    base = _setting('OUTBOX_RETRY_BASE_SECONDS', 30)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 6 * 60 * 60))
+
+
+def deliver_outbox(batch_size=None, connection=None):
+    """
+    Send one batch of due emails. Returns (sent, failed).
+
+    Only one worker should run at a time; rows are not locked while sending.
+    """
+    batch_size = batch_size or _setting('OUTBOX_BATCH_SIZE', 100)
+    max_attempts = _setting('OUTBOX_MAX_ATTEMPTS', 5)
+    now = timezone.now()
+
+    batch = list(
+        OutboxEmail.objects.filter(status='pending', next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'pk')[:batch_size]
+    )
+    if not batch:
+        return 0, 0
+
+    def fail(email, exc):
+        email.attempts += 1
+        email.last_error = f"{type(exc).__name__}: {exc}"
+        if email.attempts >= max_attempts:
+            email.status = 'failed'
+        else:
+            email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+
+    connection = connection or get_connection()
+    sent = failed = 0
+    try:
+        for position, email in enumerate(batch):
+            try:
+                # no-op while the session is up; reconnects after a failed send
+                connection.open()
+            except Exception as exc:
+                # server unreachable: back off the rest of the batch instead of
+                # waiting for a timeout on every message
+                for email in batch[position:]:
+                    fail(email, exc)
+                failed += len(batch) - position
+                metrics.emails.inc(len(batch) - position, kind='outbox', result='failed')
+                break
+
+            message = EmailMessage(
+                email.subject,
+                email.body,
+                email.from_email or None,
+                email.to.split(','),
+                connection=connection,
+            )
+            with metrics.email_dispatch('outbox', 'sent') as outcome:
+                try:
+                    message.send()
+                except Exception as exc:
+                    outcome['result'] = 'failed'
+                    failed += 1
+                    fail(email, exc)
+                    connection.close()
+                else:
+                    sent += 1
+                    email.status = 'sent'
+                    email.sent_at = timezone.now()
+    finally:
+        connection.close()
+        OutboxEmail.objects.bulk_update(
+            batch, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at']
+        )
+    return sent, failed
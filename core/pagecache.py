@@ -0,0 +1,111 @@
+"""
+Full-page cache for the public marketing pages.
+
+@cached_page stores a page once per login state, because the navbar shows
+Login or Logout. Each entry also holds gzip and brotli copies of the body;
+brotli needs the optional `brotli` package. A hit skips the view and
+template rendering entirely. It sends the best encoding the client
+accepts, and answers If-None-Match / If-Modified-Since with a 304.
+
+Entries are keyed by a version token. invalidate_pages() replaces the
+token when a Vet is saved or deleted (see core.models), because the Our
+Team page lists the vets. Queryset.update() on Vet sends no signals, so
+call invalidate_pages() after one.
+
+Only GET and HEAD requests without a query string are cached. Set
+PAGE_CACHE_SECONDS = 0 to turn the cache off. As with the doctor schedule
+cache, several processes need a shared CACHES backend to see each other's
+invalidations.
+"""
+import hashlib
+import time
+from functools import wraps
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from . import metrics
+from .compression import ENCODINGS, accepted_encodings, compress
+
+VERSION_KEY = 'page-cache-version'
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = uuid4().hex
+        if not cache.add(VERSION_KEY, version, timeout=None):
+            version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def invalidate_pages():
+    """Once the current transaction commits, drop every cached page."""
+    transaction.on_commit(lambda: cache.set(VERSION_KEY, uuid4().hex, timeout=None))
+
+
+def _compressed(body):
+    bodies = {'identity': body}
+    for encoding in ENCODINGS:
+        data = compress(body, encoding)
+        if len(data) < len(body):
+            bodies[encoding] = data
+    return bodies
+
+
+def _entry(response):
+    body = response.content
+    return {
+        'bodies': _compressed(body),
+        'content_type': response['Content-Type'],
+        # weak: the encoded bodies differ byte for byte but are the same page
+        'etag': f'W/"{hashlib.sha256(body).hexdigest()[:32]}"',
+        'last_modified': int(time.time()),
+    }
+
+
+def _serve(request, entry, authenticated):
+    response = get_conditional_response(request, etag=entry['etag'], last_modified=entry['last_modified'])
+    if response is None:
+        accepted = accepted_encodings(request)
+        encoding = next((e for e in ENCODINGS if e in accepted and e in entry['bodies']), None)
+        body = entry['bodies'][encoding or 'identity']
+        response = HttpResponse(body, content_type=entry['content_type'])
+        response['Content-Length'] = str(len(body))
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = entry['etag']
+    response['Last-Modified'] = http_date(entry['last_modified'])
+    patch_vary_headers(response, ['Accept-Encoding', 'Cookie'])
+    # browsers revalidate (cheaply, with a 304) so a login or logout shows at once
+    if authenticated:
+        patch_cache_control(response, no_cache=True, private=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+def cached_page(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        seconds = getattr(settings, 'PAGE_CACHE_SECONDS', 3600)
+        if not seconds or request.method not in ('GET', 'HEAD') or request.GET:
+            return view(request, *args, **kwargs)
+
+        authenticated = request.user.is_authenticated
+        key = f"page:{_version()}:{request.path}:{'user' if authenticated else 'anon'}"
+        entry = cache.get(key)
+        metrics.cache_lookup('page', entry is not None)
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200 or response.streaming or response.cookies:
+                return response
+            entry = _entry(response)
+            cache.set(key, entry, seconds)
+        return _serve(request, entry, authenticated)
+    return wrapper
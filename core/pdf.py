@@ -0,0 +1,284 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+from django.conf import settings
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+from . import metrics
+
+# Bump this whenever render_prescription_pdf draws something differently,
+# so stale cached files stop matching.
+PDF_LAYOUT_VERSION = 1
+
+
+def prescription_pdf_inputs(appointment):
+    """Everything the prescription PDF depends on, as plain data."""
+    return {
+        'appointment_id': appointment.appointment_id,
+        'pet_name': appointment.pet_name,
+        'pet_species': appointment.get_pet_species_display(),
+        'owner_name': appointment.owner_name,
+        'phone': appointment.phone,
+        'service': appointment.service,
+        'prescription': appointment.prescription,
+        'doctor_name': appointment.assigned_doctor.name if appointment.assigned_doctor else '',
+        'assigned_date': appointment.assigned_date.strftime('%B %d, %Y') if appointment.assigned_date else 'N/A',
+    }
+
+
+def render_prescription_pdf(inputs):
+    """Draw the prescription PDF for the dict from prescription_pdf_inputs."""
+    buffer = io.BytesIO()
+
+    p = canvas.Canvas(buffer, pagesize=letter)
+    width, height = letter
+
+    #clinic header
+    p.setFont("Helvetica-Bold", 16)
+    p.drawString(100, height - 100, "Crescent Veterinary Clinic")
+    p.setFont("Helvetica", 10)
+    p.drawString(100, height - 120, "Professional Veterinary Services")
+    p.drawString(100, height - 140, "Phone: +8801111111111 | Email: info@crescentvet.com")
+
+    #patient info
+    p.setFont("Helvetica-Bold", 14)
+    p.drawString(100, height - 180, "PATIENT INFORMATION")
+    p.line(100, height - 185, 500, height - 185)
+
+    p.setFont("Helvetica", 10)
+    y_position = height - 210
+    p.drawString(100, y_position, f"Pet Name: {inputs['pet_name']}")
+    p.drawString(300, y_position, f"Species: {inputs['pet_species']}")
+
+    y_position -= 20
+    p.drawString(100, y_position, f"Owner: {inputs['owner_name']}")
+    p.drawString(300, y_position, f"Phone: {inputs['phone']}")
+
+    y_position -= 20
+    p.drawString(100, y_position, f"Service: {inputs['service']}")
+    p.drawString(300, y_position, f"Appointment ID: {inputs['appointment_id']}")
+
+    # Prescription
+    if inputs['prescription']:
+        y_position -= 40
+        p.setFont("Helvetica-Bold", 14)
+        p.drawString(100, y_position, "PRESCRIPTION")
+        p.line(100, y_position - 5, 500, y_position - 5)
+
+        p.setFont("Helvetica", 10)
+        y_position -= 30
+
+        for line in inputs['prescription'].split('\n'):
+            if y_position < 100:
+                p.showPage()
+                p.setFont("Helvetica", 10)
+                y_position = height - 100
+
+            p.drawString(100, y_position, line)
+            y_position -= 15
+
+    if inputs['doctor_name']:
+        y_position -= 100
+        p.drawString(100, y_position, f"Dr. {inputs['doctor_name']}")
+        y_position -= 15
+        p.line(100, y_position, 250, y_position)
+        y_position -= 15
+        p.drawString(100, y_position, "Signature")
+
+    p.drawString(400, y_position - 20, f"Date: {inputs['assigned_date']}")
+    p.showPage()
+    p.save()
+    return buffer.getvalue()
+
+
+class PrescriptionPDFCache:
+    """
+    On-disk cache of rendered prescription PDFs.
+
+    Files are named <appointment_id>-<hash of inputs>.pdf, so a changed
+    prescription, vet or date simply misses. Each hit bumps the file's mtime
+    and the oldest files are evicted once the directory grows past max_bytes.
+
+    Writes keep a running total of the directory's size instead of listing
+    it each time; the directory is only scanned when that total goes over
+    max_bytes, and every rescan_every writes so files added by other
+    processes are counted too.
+    """
+
+    def __init__(self, directory, max_bytes, rescan_every=100):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.rescan_every = rescan_every
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # bytes on disk as far as this process knows; None until the first scan
+        self._size = None
+        self._writes = 0
+
+    def key(self, inputs):
+        payload = json.dumps([PDF_LAYOUT_VERSION, inputs], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path_for(self, inputs):
+        return self.directory / f"{inputs['appointment_id']}-{self.key(inputs)}.pdf"
+
+    def get(self, inputs):
+        path = self.path_for(inputs)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            self._count('misses')
+            metrics.cache_lookup('prescription_pdf', False)
+            return None
+        self._count('hits')
+        metrics.cache_lookup('prescription_pdf', True)
+        return data
+
+    def put(self, inputs, data):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path_for(inputs)
+        replaced = _file_size(path)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._writes += 1
+            rescan = self._size is None or self._writes % self.rescan_every == 0
+            if not rescan:
+                self._size += len(data) - replaced
+                rescan = self._size > self.max_bytes
+        if rescan:
+            self.evict()
+
+    def get_or_render(self, inputs):
+        data = self.get(inputs)
+        if data is None:
+            with metrics.pdf_render_duration.time():
+                data = render_prescription_pdf(inputs)
+            self.put(inputs, data)
+        return data
+
+    def invalidate(self, appointment_id):
+        removed = 0
+        for path in self.directory.glob(f"{appointment_id}-*.pdf"):
+            removed += _file_size(path)
+            path.unlink(missing_ok=True)
+        with self._lock:
+            if self._size is not None:
+                self._size = max(self._size - removed, 0)
+
+    def evict(self):
+        """Scan the directory, delete the least recently used files over max_bytes and resync the total."""
+        entries = []
+        total = 0
+        for path in self.directory.glob('*.pdf'):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            self._count('evictions')
+        with self._lock:
+            self._size = total
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+def _file_size(path):
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+pdf_cache = PrescriptionPDFCache(
+    getattr(settings, 'PRESCRIPTION_PDF_CACHE_DIR', settings.BASE_DIR / '.cache' / 'prescription_pdfs'),
+    getattr(settings, 'PRESCRIPTION_PDF_CACHE_MAX_BYTES', 50 * 1024 * 1024),
+)
+
+
+class _ZipStream(io.RawIOBase):
+    """Unseekable sink that hands back whatever ZipFile has written so far."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_prescription_zip(appointments, workers=None):
+    """
+    Yield a ZIP of prescription PDFs for the given appointments, chunk by chunk.
+
+    Cached PDFs are written straight away; the rest are rendered in a process
+    pool and written as they finish. Only a bounded number of renders are in
+    flight at once, so memory does not grow with the selection size.
+    """
+    workers = workers or getattr(settings, 'PRESCRIPTION_PDF_EXPORT_WORKERS', None) or os.cpu_count() or 1
+    max_in_flight = workers * 4
+    stream = _ZipStream()
+
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as zf, ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+
+        def write_done(futures):
+            for future in futures:
+                inputs = pending.pop(future)
+                data = future.result()
+                pdf_cache.put(inputs, data)
+                zf.writestr(f"prescription_{inputs['appointment_id']}.pdf", data)
+
+        for appointment in appointments:
+            inputs = prescription_pdf_inputs(appointment)
+            data = pdf_cache.get(inputs)
+            if data is not None:
+                zf.writestr(f"prescription_{inputs['appointment_id']}.pdf", data)
+            else:
+                pending[pool.submit(render_prescription_pdf, inputs)] = inputs
+                if len(pending) >= max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    write_done(done)
+            yield stream.drain()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            write_done(done)
+            yield stream.drain()
+
+    yield stream.drain()
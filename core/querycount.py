@@ -0,0 +1,98 @@
+"""
+Per-request SQL recording and N+1 detection.
+
+QueryRecorder hooks every database connection with execute_wrapper(), so it
+works with DEBUG off and in tests. Queries are grouped by shape: the SQL
+with its parameters left as placeholders and IN lists collapsed. A shape
+that runs N_PLUS_ONE_THRESHOLD or more times in one request is almost
+always a query issued per row of a list.
+
+QueryCountMiddleware logs those shapes to the "core.queries" logger and,
+when enabled, adds an X-Query-Count header. QueryBudgetMixin gives tests an
+assertQueryBudget() context manager for the same checks.
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('core.queries')
+
+N_PLUS_ONE_THRESHOLD = 5
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+def query_shape(sql):
+    return IN_LIST_RE.sub('IN (...)', sql)
+
+
+class QueryRecorder:
+    """Context manager collecting (sql, duration) for every query on every connection."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """[(shape, count)] for shapes run at least `threshold` times, most frequent first."""
+        counts = Counter(query_shape(sql) for sql, duration in self.queries)
+        return [(shape, count) for shape, count in counts.most_common() if count >= threshold]
+
+
+class QueryCountMiddleware:
+    """
+    Logs repeated query shapes per request; enabled by QUERY_INSPECTOR_ENABLED.
+
+    Queries run while a streaming response is being sent happen after this
+    returns and are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'QUERY_INSPECTOR_ENABLED', False):
+            return self.get_response(request)
+
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+
+        response['X-Query-Count'] = str(len(recorder))
+        for shape, count in recorder.repeated():
+            logger.warning('Possible N+1 on %s %s: %d x %s', request.method, request.path, count, shape)
+        return response
+
+
+class QueryBudgetMixin:
+    """TestCase mixin: fail when a block runs too many queries or the same query per row."""
+
+    @contextmanager
+    def assertQueryBudget(self, budget, threshold=N_PLUS_ONE_THRESHOLD):
+        with QueryRecorder() as recorder:
+            yield recorder
+        queries = '\n'.join(sql for sql, duration in recorder.queries)
+        self.assertLessEqual(len(recorder), budget, f'{len(recorder)} queries, budget {budget}:\n{queries}')
+        self.assertEqual(recorder.repeated(threshold), [], 'repeated query shapes (N+1)')
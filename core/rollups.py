@@ -0,0 +1,184 @@
+"""
+Daily revenue and utilisation rollups.
+
+Each DailyRollup row totals the appointments of one day, one vet (None for
+unassigned ones) and one service: how many are in each status, how many
+are paid or refunded and for how much, and how many of the vet's
+DAILY_SLOTS they take. An appointment counts on its assigned date, or on
+its preferred date until it has been assigned.
+
+Saves and deletes of an Appointment move its share between rows through
+signals in core.models, so report() reads a few small rows per day instead
+of scanning the appointments. Bulk queryset.update(), bulk_create() and
+bulk_update() calls bypass signals, so they must call rebuild() for the
+days they touched; the rebuild_rollups command recomputes a date range the
+same way.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .availability import booked_slot
+from .models import Appointment, DailyRollup, Vet
+from .utils import DAILY_SLOTS
+
+STATUSES = [status for status, label in Appointment.STATUS_CHOICES]
+PAYMENTS = ['paid', 'refunded']
+
+# the DailyRollup columns that hold totals
+TOTAL_FIELDS = STATUSES + ['paid_count', 'paid_total', 'refunded_count', 'refunded_total', 'booked_slots']
+
+
+def contribution(values):
+    """
+    The (date, vet_id, service) row an appointment counts towards and what
+    it adds there, from its values for models.ROLLUP_FIELDS.
+    """
+    doctor_id, assigned_date, assigned_time, preferred_date, service, status, payment_status, amount = values
+    day = assigned_date or preferred_date
+    if day is None:
+        return None
+    totals = {}
+    if status in STATUSES:
+        totals[status] = 1
+    if payment_status in PAYMENTS:
+        totals[f'{payment_status}_count'] = 1
+        totals[f'{payment_status}_total'] = Decimal(amount or 0)
+    if booked_slot(doctor_id, assigned_date, assigned_time, status):
+        totals['booked_slots'] = 1
+    return (day, doctor_id, service), totals
+
+
+def apply_change(old, new):
+    """Move an appointment's share from its `old` values to its `new` ones (either may be None)."""
+    if old == new:
+        return
+    changes = defaultdict(dict)
+    for values, sign in ((old, -1), (new, 1)):
+        entry = values and contribution(values)
+        if entry:
+            key, totals = entry
+            for field, value in totals.items():
+                changes[key][field] = changes[key].get(field, 0) + sign * value
+    for key, totals in changes.items():
+        _add(key, {field: value for field, value in totals.items() if value})
+
+
+def _add(key, totals):
+    if not totals:
+        return
+    day, vet_id, service = key
+    rows = DailyRollup.objects.filter(date=day, vet_id=vet_id, service=service)
+    increments = {field: F(field) + value for field, value in totals.items()}
+    if rows.update(**increments):
+        return
+    _, created = DailyRollup.objects.get_or_create(date=day, vet_id=vet_id, service=service, defaults=totals)
+    if not created:
+        rows.update(**increments)
+
+
+def _appointment_totals():
+    booked = Q(assigned_doctor__isnull=False, assigned_date__isnull=False, assigned_time__in=DAILY_SLOTS)
+    totals = {status: Count('pk', filter=Q(status=status)) for status in STATUSES}
+    for payment in PAYMENTS:
+        totals[f'{payment}_count'] = Count('pk', filter=Q(payment_status=payment))
+        totals[f'{payment}_total'] = Sum('payment_amount', filter=Q(payment_status=payment), default=Decimal(0))
+    totals['booked_slots'] = Count('pk', filter=booked & ~Q(status='cancelled'))
+    return totals
+
+
+def _recompute(rollups, appointments):
+    rows = (
+        appointments.annotate(day=Coalesce('assigned_date', 'preferred_date'))
+        .values('day', 'assigned_doctor', 'service')
+        .annotate(**_appointment_totals())
+        .order_by()
+    )
+    with transaction.atomic():
+        rollups.delete()
+        DailyRollup.objects.bulk_create(
+            [
+                DailyRollup(
+                    date=row['day'], vet_id=row['assigned_doctor'], service=row['service'],
+                    **{field: row[field] for field in TOTAL_FIELDS},
+                )
+                for row in rows
+            ],
+            batch_size=500,
+        )
+
+
+def rebuild(days):
+    """Recompute every row for the given dates from the appointments."""
+    days = {day for day in days if day}
+    if not days:
+        return
+    _recompute(
+        DailyRollup.objects.filter(date__in=days),
+        Appointment.objects.filter(Q(assigned_date__in=days) | Q(assigned_date__isnull=True, preferred_date__in=days)),
+    )
+
+
+def rebuild_range(start, end):
+    """Recompute every row from start to end (inclusive) in one transaction."""
+    _recompute(
+        DailyRollup.objects.filter(date__range=(start, end)),
+        Appointment.objects.filter(
+            Q(assigned_date__range=(start, end)) | Q(assigned_date__isnull=True, preferred_date__range=(start, end))
+        ),
+    )
+
+
+def _summarise(row, capacity):
+    summary = {field: row[f'sum_{field}'] or 0 for field in TOTAL_FIELDS}
+    summary['appointments'] = sum(summary[status] for status in STATUSES)
+    summary['utilisation'] = summary['booked_slots'] / capacity if capacity else None
+    return summary
+
+
+def report(start, end):
+    """
+    Totals from start to end (inclusive), overall and by day, vet and
+    service. Utilisation is booked slots over DAILY_SLOTS for every vet
+    (or every vet of the service) on every day of the range.
+    """
+    rows = DailyRollup.objects.filter(date__range=(start, end))
+    sums = {f'sum_{field}': Sum(field) for field in TOTAL_FIELDS}
+    days = (end - start).days + 1
+    slots = len(DAILY_SLOTS)
+    vets = list(Vet.objects.order_by('name').values_list('id', 'name', 'specialty'))
+    vets_per_service = defaultdict(int)
+    for vet_id, name, specialty in vets:
+        vets_per_service[specialty] += 1
+
+    by_day = {row['date']: row for row in rows.values('date').annotate(**sums).order_by()}
+    by_vet = {row['vet']: row for row in rows.values('vet').annotate(**sums).order_by()}
+    by_service = {row['service']: row for row in rows.values('service').annotate(**sums).order_by()}
+    empty = dict.fromkeys(sums, 0)
+
+    day_rows = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        day_rows.append({'date': day, **_summarise(by_day.get(day, empty), len(vets) * slots)})
+    vet_rows = [
+        {'name': name, 'specialty': specialty, **_summarise(by_vet.get(vet_id, empty), days * slots)}
+        for vet_id, name, specialty in vets
+    ]
+    if None in by_vet:
+        vet_rows.append({'name': 'Unassigned', 'specialty': '', **_summarise(by_vet[None], 0)})
+    service_rows = [
+        {'service': service, **_summarise(by_service.get(service, empty), vets_per_service[service] * days * slots)}
+        for service, label in Appointment.SERVICE_CHOICES
+    ]
+    return {
+        'start': start,
+        'end': end,
+        'totals': _summarise(rows.aggregate(**sums), len(vets) * days * slots),
+        'days': day_rows,
+        'vets': vet_rows,
+        'services': service_rows,
+    }
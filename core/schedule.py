@@ -0,0 +1,86 @@
+"""
+Cached per-vet schedule for the doctor dashboard.
+
+doctor_schedule() loads a vet's confirmed appointments for today and the
+next SCHEDULE_DAYS days in one query and caches the result. The cache key
+includes a per-vet version token, and invalidate_schedules() replaces that
+token whenever one of the vet's appointments changes. Old entries are never
+read again and simply expire. Saves and deletes invalidate through signals
+in core.models; bulk updates go through availability.rebuild(), which
+invalidates too.
+
+With the default local-memory cache every process has its own copy, so a
+multi-process deployment needs a shared backend in CACHES for invalidations
+to reach all workers.
+"""
+from datetime import date, timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import metrics
+from .events import broker
+from .models import Appointment
+
+SCHEDULE_DAYS = 7
+
+# the fields doctor_dashboard.html reads
+DASHBOARD_FIELDS = [
+    'appointment_id', 'owner_name', 'phone', 'pet_name', 'pet_species', 'pet_age', 'pet_weight',
+    'service', 'reason', 'status', 'completion_status', 'prescription', 'assigned_doctor',
+    'assigned_date', 'assigned_time',
+]
+
+
+def _version_key(vet_id):
+    return f'doctor-schedule-version:{vet_id}'
+
+
+def _version(vet_id):
+    version = cache.get(_version_key(vet_id))
+    if version is None:
+        version = uuid4().hex
+        if not cache.add(_version_key(vet_id), version, timeout=None):
+            version = cache.get(_version_key(vet_id), version)
+    return version
+
+
+def doctor_schedule(vet_id, today=None):
+    """Return (today's, upcoming) confirmed appointments for a vet, in time order."""
+    today = today or date.today()
+    key = f'doctor-schedule:{vet_id}:{_version(vet_id)}:{today.isoformat()}'
+    schedule = cache.get(key)
+    metrics.cache_lookup('doctor_schedule', schedule is not None)
+    if schedule is None:
+        appointments = list(
+            Appointment.objects.filter(
+                assigned_doctor_id=vet_id,
+                status='confirmed',
+                assigned_date__range=(today, today + timedelta(days=SCHEDULE_DAYS)),
+            ).order_by('assigned_date', 'assigned_time').only(*DASHBOARD_FIELDS)
+        )
+        schedule = (
+            [a for a in appointments if a.assigned_date == today],
+            [a for a in appointments if a.assigned_date > today],
+        )
+        cache.set(key, schedule, getattr(settings, 'DOCTOR_SCHEDULE_CACHE_SECONDS', 600))
+    return schedule
+
+
+def invalidate_schedules(vet_ids):
+    """
+    Once the current transaction commits, drop the cached schedules of these
+    vets and tell their open dashboards to refresh.
+    """
+    vet_ids = {vet_id for vet_id in vet_ids if vet_id}
+    if not vet_ids:
+        return
+
+    def changed():
+        cache.set_many({_version_key(vet_id): uuid4().hex for vet_id in vet_ids}, timeout=None)
+        for vet_id in vet_ids:
+            broker.publish(vet_id, {'type': 'schedule'})
+
+    transaction.on_commit(changed)
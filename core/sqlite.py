@@ -0,0 +1,99 @@
+"""
+Tuned SQLite connection profile.
+
+configure_connection() runs on every new SQLite connection (it is connected
+to connection_created in CoreConfig.ready()) and applies SQLITE_PRAGMAS:
+
+- journal_mode=WAL: readers and the writer no longer block each other.
+  There is still only one writer at a time, which write_transaction() and
+  the timeout in DATABASES queue up.
+- synchronous=NORMAL: WAL commits skip the fsync. The database stays
+  consistent after a power cut, though the last few commits may be lost.
+- busy_timeout: how long to wait for the write lock, in milliseconds.
+- mmap_size: read the file through a memory map instead of read() calls.
+- cache_size: page cache per connection; negative values are KiB.
+- temp_store=MEMORY: sorts and temporary indexes stay off disk.
+
+With CONN_MAX_AGE, each worker thread keeps its connection between
+requests. Opening the file, reading the schema and applying the pragmas
+then happens once per thread, not once per request.
+
+WAL needs the database on a local disk, not a network share. It keeps
+-wal and -shm files next to the database while connections are open. Set
+SQLITE_PRAGMAS = {} to use SQLite's defaults.
+
+journal_mode=WAL is the one pragma SQLite stores in the database file
+itself; the db.sqlite3 checked into the repository is already in WAL mode,
+so opening it does not change the file. Databases listed in
+SQLITE_KEEP_JOURNAL_MODE keep whatever journal mode they have. Without WAL,
+synchronous=NORMAL can corrupt the database on a power cut, so those run
+with synchronous=FULL instead.
+
+Transactions start DEFERRED, so read-only ones (admin lists, reports,
+exports) never touch the write lock. A deferred transaction that reads and
+then writes cannot wait for the lock, though: if another connection
+committed since its read, SQLite fails it at once with "database is
+locked". The booking, hold and write-queue transactions read before they
+write and run under contention, so they use write_transaction(), which
+starts with BEGIN IMMEDIATE and waits its turn for the lock instead.
+"""
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -16000,
+    'temp_store': 'MEMORY',
+}
+
+
+def pragmas():
+    return getattr(settings, 'SQLITE_PRAGMAS', DEFAULT_PRAGMAS)
+
+
+def _keeps_journal_mode(name):
+    return str(name) in {str(path) for path in getattr(settings, 'SQLITE_KEEP_JOURNAL_MODE', ())}
+
+
+def apply_pragmas(dbapi_connection, profile):
+    """Apply `profile` ({pragma: value}) to a sqlite3 connection."""
+    for name, value in profile.items():
+        dbapi_connection.execute(f'PRAGMA {name} = {value}')
+
+
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    profile = pragmas()
+    if _keeps_journal_mode(connection.settings_dict['NAME']):
+        profile = {name: value for name, value in profile.items() if name != 'journal_mode'}
+        if 'synchronous' in profile:
+            profile['synchronous'] = 'FULL'
+    # straight on the sqlite3 connection, so these don't show up as queries
+    apply_pragmas(connection.connection, profile)
+
+
+@contextmanager
+def write_transaction(using=None):
+    """
+    transaction.atomic() that takes SQLite's write lock when it begins. Inside
+    an existing transaction it is a plain savepoint.
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    with ExitStack() as stack:
+        if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+            # Django reads transaction_mode when it issues BEGIN, on entering atomic()
+            connection.ensure_connection()
+            mode, connection.transaction_mode = connection.transaction_mode, 'IMMEDIATE'
+            try:
+                stack.enter_context(transaction.atomic(using=using))
+            finally:
+                connection.transaction_mode = mode
+        else:
+            stack.enter_context(transaction.atomic(using=using))
+        yield
@@ -0,0 +1,403 @@
+// URLs and page values come from data-* attributes on <body> (see doctor_dashboard.html)
+const dashboard = document.body.dataset;
+
+let prescriptionTemplates = {};
+let medicationsDB = [];
+
+document.addEventListener('DOMContentLoaded', function() {
+
+    // Refresh when this vet's appointments change, instead of polling (only served under ASGI)
+    if (window.EventSource && dashboard.liveUpdates === 'true') {
+        let refreshPending = false;
+        const events = new EventSource(dashboard.eventsUrl);
+        events.addEventListener('schedule', function() {
+            // don't throw away a prescription that is being written
+            if (document.querySelector('.modal.show')) {
+                if (!refreshPending) {
+                    refreshPending = true;
+                    showToast('Your schedule has changed. It will refresh when you close this window.', 'success');
+                }
+                return;
+            }
+            window.location.reload();
+        });
+        document.addEventListener('hidden.bs.modal', function() {
+            if (refreshPending && !document.querySelector('.modal.show')) {
+                window.location.reload();
+            }
+        });
+    }
+
+    const prescriptionModal = document.getElementById('prescriptionModal');
+    const openPrescriptionBtns = document.querySelectorAll('.open-prescription-btn');
+    const savePrescriptionBtn = document.getElementById('savePrescriptionBtn');
+    const previewBtn = document.getElementById('previewBtn');
+
+    openPrescriptionBtns.forEach(btn => {
+        btn.addEventListener('click', function() {
+            const appointmentId = this.dataset.appointmentId;
+            openPrescriptionModal(appointmentId);
+        });
+    });
+    savePrescriptionBtn.addEventListener('click', savePrescription);
+    previewBtn.addEventListener('click', showPreview);
+    document.querySelectorAll('.view-prescription-btn').forEach(btn => {
+        btn.addEventListener('click', function() {
+            const prescription = this.dataset.prescription;
+            showExistingPrescription(prescription);
+        });
+    });
+});
+
+async function openPrescriptionModal(appointmentId) {
+    try {
+        //templates and medications)
+        const response = await fetch(`${dashboard.catalogueUrl}?v=${dashboard.catalogueVersion}`);
+        const data = await response.json();
+
+        prescriptionTemplates = data.templates;
+        medicationsDB = data.medications;
+        document.getElementById('currentAppointmentId').value = appointmentId;
+        const appointmentCard = document.querySelector(`[data-appointment-id="${appointmentId}"]`).closest('.appointment-card');
+
+
+        const h5 = appointmentCard.querySelector('h5');
+        const petName = Array.from(h5.childNodes)
+            .filter(node => node.nodeType === Node.TEXT_NODE)
+            .map(node => node.textContent.trim())
+            .join(' ')
+            .trim();
+
+        const ownerName = appointmentCard.querySelector('.patient-info p:first-of-type strong').nextSibling.textContent.trim();
+        const phone = appointmentCard.querySelector('.patient-info p:nth-of-type(2)').textContent.replace(/.*: /, '');
+        const species = appointmentCard.querySelector('.badge').textContent;
+        const service = appointmentCard.querySelector('.patient-info p:nth-of-type(3) strong').nextSibling.textContent.replace(' ', '').trim();
+        const ageBadge = appointmentCard.querySelector('.badge.bg-info');
+        const weightBadge = appointmentCard.querySelector('.badge.bg-warning');
+
+        const petAge = ageBadge ? ageBadge.textContent.replace('Age: ', '') : '';
+        const petWeight = weightBadge ? weightBadge.textContent.replace('Weight: ', '').replace(' kg', '') : '';
+
+        // Populate modal fields
+        document.getElementById('modalPetName').textContent = petName;
+        document.getElementById('modalOwnerName').textContent = ownerName;
+        document.getElementById('modalPhone').textContent = phone;
+        document.getElementById('modalPetSpecies').textContent = species;
+        document.getElementById('modalPetAge').textContent = petAge;
+        document.getElementById('modalPetWeight').textContent = petWeight;
+        document.getElementById('modalService').textContent = service;
+        document.getElementById('modalAppointmentId').textContent = appointmentId;
+
+        // Load templates
+        const appointmentResponse = await fetch(`/doctor/get-existing-prescription/${appointmentId}/`);
+        const prescriptionData = await appointmentResponse.json();
+
+        if (prescriptionData.prescription) {
+            loadExistingPrescription(prescriptionData);
+        } else {
+            clearPrescriptionForm();
+        }
+
+        loadTemplateButtons();
+        loadMedicationSuggestions();
+
+    } catch (error) {
+        console.error('Error loading prescription data:', error);
+        showToast('Error loading prescription data. Please try again.', 'error');
+    }
+}
+
+function loadExistingPrescription(prescription) {
+    document.getElementById('chiefComplaint').value = prescription.chief_complaint;
+    document.getElementById('diagnosis').value = prescription.diagnosis;
+    document.getElementById('medications').value = prescription.medications;
+    document.getElementById('instructions').value = prescription.instructions;
+    document.getElementById('followUp').value = prescription.follow_up;
+}
+
+function loadTemplateButtons() {
+    const container = document.getElementById('templateButtons');
+    container.innerHTML = '';
+
+    Object.keys(prescriptionTemplates).forEach(key => {
+        const template = prescriptionTemplates[key];
+        const btn = document.createElement('button');
+        btn.type = 'button';
+        btn.className = 'btn btn-outline-primary btn-sm template-btn';
+        btn.innerHTML = `<i class="fas fa-clipboard me-1"></i>${template.name}`;
+        btn.onclick = () => applyTemplate(key);
+        container.appendChild(btn);
+    });
+}
+
+function renderMedicationSuggestions(medications) {
+    const container = document.getElementById('medicationSuggestions');
+    container.innerHTML = '';
+
+    medications.forEach(med => {
+        const div = document.createElement('div');
+        div.className = 'drug-suggestion p-2 border-bottom';
+        div.style.cursor = "pointer";
+        div.innerHTML = `
+            <div class="fw-bold">${med.name}</div>
+            <small class="text-muted">${med.strengths.join(', ')} | ${med.type}</small>
+        `;
+        div.onclick = () => insertMedication(med);
+        container.appendChild(div);
+    });
+}
+
+let medicationSearchTimer = null;
+let medicationSearchSeq = 0;
+
+function loadMedicationSuggestions() {
+    renderMedicationSuggestions(medicationsDB);
+
+    // Search the full formulary on the server (name, "name strength" or strength)
+    const searchInput = document.getElementById('medicationSearch');
+    searchInput.onkeyup = function () {
+        const query = this.value.trim();
+        clearTimeout(medicationSearchTimer);
+        if (!query) {
+            renderMedicationSuggestions(medicationsDB);
+            return;
+        }
+        medicationSearchTimer = setTimeout(async () => {
+            const seq = ++medicationSearchSeq;
+            const params = new URLSearchParams({ q: query, limit: 20 });
+            const response = await fetch(`${dashboard.searchUrl}?${params}`);
+            const data = await response.json();
+            // ignore responses that arrive after a newer search
+            if (seq === medicationSearchSeq) {
+                renderMedicationSuggestions(data.results);
+            }
+        }, 150);
+    };
+}
+
+
+function applyTemplate(templateKey) {
+    const template = prescriptionTemplates[templateKey];
+
+    document.getElementById('diagnosis').value = template.diagnosis;
+    document.getElementById('medications').value = template.medications;
+    document.getElementById('instructions').value = template.instructions;
+    document.getElementById('followUp').value = template.follow_up;
+
+    showToast('Template applied successfully!', 'success');
+}
+
+function insertMedication(medication) {
+    const medicationsField = document.getElementById('medications');
+    const currentText = medicationsField.value;
+
+    // Find the next medication number
+    const lines = currentText.split('\n');
+    let nextNum = 1;
+    lines.forEach(line => {
+        const match = line.match(/^(\d+)\./);
+        if (match) {
+            nextNum = Math.max(nextNum, parseInt(match[1]) + 1);
+        }
+    });
+
+    const newMedication = `${nextNum}. ${medication.name} ${medication.strengths[0]}\n   Sig: [Add dosing instructions here]\n\n`;
+
+    if (currentText.trim()) {
+        medicationsField.value = currentText + '\n' + newMedication;
+    } else {
+        medicationsField.value = newMedication;
+    }
+
+    // Focus on the field and place cursor at the dosing instruction
+    medicationsField.focus();
+    const pos = medicationsField.value.indexOf('[Add dosing instructions here]');
+    if (pos !== -1) {
+        medicationsField.setSelectionRange(pos, pos + 31);
+    }
+}
+
+async function savePrescription() {
+    const appointmentId = document.getElementById('currentAppointmentId').value;
+    const formData = new FormData();
+
+    formData.append('csrfmiddlewaretoken', document.querySelector('[name=csrfmiddlewaretoken]').value);
+    formData.append('chief_complaint', document.getElementById('chiefComplaint').value);
+    formData.append('diagnosis', document.getElementById('diagnosis').value);
+    formData.append('medications', document.getElementById('medications').value);
+    formData.append('instructions', document.getElementById('instructions').value);
+    formData.append('follow_up', document.getElementById('followUp').value);
+    formData.append('mark_complete', document.getElementById('markCompleteCheck').checked);
+
+    try {
+        const response = await fetch(`/doctor/save-prescription/${appointmentId}/`, {
+            method: 'POST',
+            body: formData
+        });
+
+        const data = await response.json();
+
+        if (data.success) {
+            showToast('Prescription saved successfully!', 'success');
+
+            const btn = document.querySelector(`[data-appointment-id="${appointmentId}"]`);
+            btn.innerHTML = '<i class="fas fa-prescription-bottle-alt me-2"></i>Edit Prescription';
+
+            bootstrap.Modal.getInstance(document.getElementById('prescriptionModal')).hide();
+            setTimeout(() => {
+                location.reload();
+            }, 1000);
+        } else {
+            showToast('Error saving prescription: ' + data.error, 'error');
+        }
+    } catch (error) {
+        console.error('Error saving prescription:', error);
+        showToast('Error saving prescription. Please try again.', 'error');
+    }
+}
+
+function showPreview() {
+    const chiefComplaint = document.getElementById('chiefComplaint').value;
+    const diagnosis = document.getElementById('diagnosis').value;
+    const medications = document.getElementById('medications').value;
+    const instructions = document.getElementById('instructions').value;
+    const followUp = document.getElementById('followUp').value;
+
+    const previewContent = `
+        <div class="prescription-header" style="background: var(--primary); color: white; padding: 20px; margin: -20px -20px 20px -20px;">
+            <div class="row">
+                <div class="col-6">
+                    <h4><i class="fas fa-clinic-medical me-2"></i>Crescent Veterinary Clinic</h4>
+                    <p class="mb-0">Professional Veterinary Services</p>
+                    <small>Phone: +8801111111111 | Email: info@crescentvet.com</small>
+                </div>
+                <div class="col-6 text-end">
+                    <h5>Dr. ${escapeHtml(dashboard.doctorName)}</h5>
+                    <p class="mb-0">${escapeHtml(dashboard.doctorSpecialty)}</p>
+                    <small>Date: ${escapeHtml(dashboard.today)}</small>
+                </div>
+            </div>
+        </div>
+
+        <div class="patient-section mb-4">
+            <h6 class="border-bottom pb-2">PATIENT INFORMATION</h6>
+            <div class="row">
+                <div class="col-6">
+                    <p><strong>Pet Name:</strong> ${document.getElementById('modalPetName').textContent}</p>
+                    <p><strong>Species:</strong> ${document.getElementById('modalPetSpecies').textContent}</p>
+                    <p><strong>Age:</strong> ${document.getElementById('modalPetAge').textContent}</p>
+                    <p><strong>Weight:</strong> ${document.getElementById('modalPetWeight').textContent} kg</p>
+                    <p><strong>Service:</strong> ${document.getElementById('modalService').textContent}</p>
+                </div>
+                <div class="col-6">
+                    <p><strong>Owner:</strong> ${document.getElementById('modalOwnerName').textContent}</p>
+                    <p><strong>Phone:</strong> ${document.getElementById('modalPhone').textContent}</p>
+                    <p><strong>Appointment ID:</strong> ${document.getElementById('modalAppointmentId').textContent}</p>
+                </div>
+            </div>
+        </div>
+
+        ${chiefComplaint ? `
+        <div class="mb-4">
+            <h6 class="border-bottom pb-2">CHIEF COMPLAINT</h6>
+            <p>${chiefComplaint.replace(/\n/g, '<br>')}</p>
+        </div>
+        ` : ''}
+
+        ${diagnosis ? `
+        <div class="mb-4">
+            <h6 class="border-bottom pb-2">DIAGNOSIS</h6>
+            <p>${diagnosis.replace(/\n/g, '<br>')}</p>
+        </div>
+        ` : ''}
+
+        ${medications ? `
+        <div class="mb-4">
+            <h6 class="border-bottom pb-2">PRESCRIPTION (Rx)</h6>
+            <div style="font-family: 'Courier New', monospace; white-space: pre-line; background: #f8f9fa; padding: 15px; border-radius: 5px;">${medications}</div>
+        </div>
+        ` : ''}
+
+        ${instructions ? `
+        <div class="mb-4">
+            <h6 class="border-bottom pb-2">INSTRUCTIONS & ADVICE</h6>
+            <p>${instructions.replace(/\n/g, '<br>')}</p>
+        </div>
+        ` : ''}
+
+        ${followUp ? `
+        <div class="mb-4">
+            <h6 class="border-bottom pb-2">FOLLOW-UP CARE</h6>
+            <p>${followUp.replace(/\n/g, '<br>')}</p>
+        </div>
+        ` : ''}
+
+        <div class="signature-line mt-5 pt-3">
+            <div class="row">
+                <div class="col-6">
+                    <p class="small mb-0">Dr. ${escapeHtml(dashboard.doctorName)}</p>
+                    <p class="mb-0">_______________________________</p>
+                    <p class="small">Dept. of ${escapeHtml(dashboard.doctorSpecialty)}</p>
+                </div>
+                <div class="col-6 text-end">
+                    <p class="small mb-0">Date: ${escapeHtml(dashboard.today)}</p>
+                </div>
+            </div>
+        </div>
+    `;
+
+    document.getElementById('prescriptionPreview').innerHTML = previewContent;
+    new bootstrap.Modal(document.getElementById('previewModal')).show();
+}
+
+function showExistingPrescription(prescription) {
+    document.getElementById('prescriptionPreview').innerHTML = `
+        <div class="prescription-preview">
+            <h5 class="mb-3">Current Prescription</h5>
+            <div style="white-space: pre-line; background: #f8f9fa; padding: 20px; border-radius: 5px; border-left: 4px solid var(--primary);">
+                ${prescription}
+            </div>
+        </div>
+    `;
+    new bootstrap.Modal(document.getElementById('previewModal')).show();
+}
+
+function clearPrescriptionForm() {
+    document.getElementById('chiefComplaint').value = '';
+    document.getElementById('diagnosis').value = '';
+    document.getElementById('medications').value = '';
+    document.getElementById('instructions').value = '';
+    document.getElementById('followUp').value = '';
+}
+
+function showToast(message, type) {
+    const existingToasts = document.querySelectorAll('.custom-toast');
+    existingToasts.forEach(toast => toast.remove());
+
+    const toast = document.createElement('div');
+    toast.className = `custom-toast ${type === 'error' ? 'error' : ''}`;
+    toast.innerHTML = `
+        <div class="d-flex align-items-center">
+            <i class="fas fa-${type === 'success' ? 'check-circle' : 'exclamation-circle'} me-2 fa-lg ${type === 'success' ? 'text-success' : 'text-danger'}"></i>
+            <div>${message}</div>
+            <button type="button" class="btn-close ms-auto" onclick="this.parentElement.parentElement.remove()"></button>
+        </div>
+    `;
+    document.body.appendChild(toast);
+
+    setTimeout(() => {
+        toast.classList.add('show');
+    }, 10);
+
+    setTimeout(() => {
+        if (toast.parentElement) {
+            toast.remove();
+        }
+    }, 5000);
+}
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+}
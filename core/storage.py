@@ -0,0 +1,140 @@
+"""
+Static files build: content-hashed names, precompressed siblings and
+responsive WebP photos.
+
+`manage.py collectstatic` with StaticAssetStorage does three things:
+
+- Writes WebP copies of the vet photos (images/vet<N>.jpg, the paths
+  Vet.photo_url points at), resized to each of STATIC_IMAGE_WIDTHS that is
+  narrower than the original (for example images/vet1.300w.webp). Other
+  images, such as the CSS background, are never offered through srcset
+  and are left alone.
+- Copies every file under a content-hashed name, rewriting url()
+  references in CSS, as ManifestStaticFilesStorage does.
+- Writes .gz and, when the optional brotli package is installed, .br
+  siblings of the hashed text assets (CSS, JS, SVG, ...).
+
+A hashed name changes whenever its content does, so the web server can
+cache /static/ for a year and serve the precompressed siblings directly.
+For example, in nginx:
+
+    location /static/ {
+        alias /path/to/staticfiles/;
+        gzip_static on;
+        brotli_static on;
+        expires 1y;
+        add_header Cache-Control "public, immutable";
+    }
+
+Until collectstatic has run (a fresh checkout, the test suite) there is no
+manifest, and {% static %} falls back to the plain names.
+"""
+import gzip
+import io
+import re
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.files.base import ContentFile
+from PIL import Image
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.json', '.map', '.svg', '.txt', '.xml', '.html', '.ico'}
+RESPONSIVE_IMAGE_RE = re.compile(r'^images/vet\d+\.(jpe?g|png)$', re.IGNORECASE)
+WEBP_QUALITY = 80
+
+
+def image_widths():
+    return getattr(settings, 'STATIC_IMAGE_WIDTHS', [150, 300, 450])
+
+
+def variant_name(name, width):
+    """images/vet1.jpg -> images/vet1.300w.webp"""
+    path = PurePosixPath(name)
+    return str(path.with_name(f'{path.stem}.{width}w.webp'))
+
+
+def responsive_variants(name):
+    """
+    [(url, width)] for the collected WebP variants of a static image,
+    narrowest first; empty when there are none.
+
+    While DEBUG is on, static files are served from the source folders,
+    which do not contain the variants, so none are returned then.
+    """
+    hashed_files = getattr(staticfiles_storage, 'hashed_files', None)
+    if settings.DEBUG or not hashed_files:
+        return []
+    return [
+        (staticfiles_storage.url(variant_name(name, width)), width)
+        for width in sorted(image_widths())
+        if variant_name(name, width) in hashed_files
+    ]
+
+
+def _resized_webp(source, width):
+    with Image.open(source) as image:
+        if width >= image.width:
+            return None
+        height = round(image.height * width / image.width)
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        resized = image.resize((width, height), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    resized.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=6)
+    return buffer.getvalue()
+
+
+class StaticAssetStorage(ManifestStaticFilesStorage):
+    def stored_name(self, name):
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            yield from super().post_process(paths, dry_run, **options)
+            return
+
+        for name, data in self._image_variants(paths):
+            if self.exists(name):
+                self.delete(name)
+            self._save(name, ContentFile(data))
+            paths[name] = (self, name)
+
+        final = {}
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                final[name] = hashed_name
+            yield name, hashed_name, processed
+
+        for hashed_name in final.values():
+            if PurePosixPath(hashed_name).suffix.lower() in COMPRESSIBLE_EXTENSIONS:
+                self._write_compressed(hashed_name)
+
+    def _image_variants(self, paths):
+        for name, (storage, path) in list(paths.items()):
+            if not RESPONSIVE_IMAGE_RE.match(name):
+                continue
+            for width in image_widths():
+                with storage.open(path) as source:
+                    data = _resized_webp(source, width)
+                if data is not None:
+                    yield variant_name(name, width), data
+
+    def _write_compressed(self, name):
+        with self.open(name) as f:
+            data = f.read()
+        siblings = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            siblings['.br'] = brotli.compress(data, quality=11)
+        for suffix, compressed in siblings.items():
+            if len(compressed) >= len(data):
+                continue
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(compressed))
@@ -0,0 +1,21 @@
+from django import template
+from django.utils.html import format_html
+
+from ..storage import responsive_variants
+
+register = template.Library()
+
+
+@register.simple_tag
+def static_srcset(path, sizes):
+    """
+    srcset and sizes attributes listing the WebP variants of a static image,
+    or nothing when collectstatic has not made any:
+
+        <img src="{% static path %}" {% static_srcset path "150px" %}>
+    """
+    variants = responsive_variants(path)
+    if not variants:
+        return ''
+    srcset = ', '.join(f'{url} {width}w' for url, width in variants)
+    return format_html('srcset="{}" sizes="{}"', srcset, sizes)
@@ -1,3 +1,1877 @@
-from django.test import TestCase
+import asyncio
+import atexit
+import base64
+import csv
+import datetime
+import gzip
+import importlib
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from PIL import Image
+from django.apps import apps
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.db import connection, transaction
+from django.forms.models import model_to_dict
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.asgi import get_asgi_application
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.template import Context, Template
+from django.urls import reverse
+from django.utils import timezone
+
+from .admin import AppointmentAdminForm
+from .assignment import assign_pending
+from .availability import SLOT_BITS, availability, rebuild as rebuild_availability
+from .catalogue import CATALOGUE_JSON, CATALOGUE_VERSION
+from .changelist import DateFacetQuerySet, EstimatedCountPaginator, estimate_row_count
+from .compression import MIN_LENGTH, CompressionMiddleware, accepted_encodings, brotli
+from .events import broker
+from .exports import (
+    APPOINTMENT_CSV_HEADER, APPOINTMENT_JSONL_FIELDS, PRESCRIPTION_CSV_HEADER, appointment_csv_rows,
+    appointment_jsonl_rows, stream_csv, stream_jsonl,
+)
+from .holds import confirm_hold, hold_slot, reap_expired
+from .loadtest import NOISE_MS, TAIL_SAMPLES, Recorder, compare, personas_for, summarise
+from .ids import ALPHABET, AppointmentIdAllocator, decode, encode
+from .medsearch import MAX_CANDIDATES, MedicationIndex
+from .metrics import Counter, Histogram, Registry
+from .pdf import PrescriptionPDFCache, pdf_cache, prescription_pdf_inputs, stream_prescription_zip
+from .pagecache import VERSION_KEY as PAGE_VERSION_KEY
+from .schedule import _version as schedule_version, doctor_schedule
+from .storage import variant_name
+from .sqlite import configure_connection, write_transaction
+from .models import (
+    Appointment, AppointmentIdSequence, DailyRollup, OutboxEmail, PrescriptionMedication, SlotHold, Vet,
+    VetDaySchedule,
+)
+from .outbox import deliver_outbox, queue_email
+from .querycount import QueryBudgetMixin
+from .rollups import rebuild_range
+from .utils import DAILY_SLOTS
+from .writes import WriteQueue, WriteQueueTimeout, run_write
+
+BOOKING = {
+    'owner_name': 'Owner',
+    'owner_phone': '01234567890',
+    'pet_name': 'Rex',
+    'pet_species': 'dog',
+    'service': 'Preventive Care',
+    'reason': 'Check-up',
+}
+
+
+class SlotHoldTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        self.day = datetime.date(2030, 1, 7)
+        self.at = datetime.time(9)
+
+    def test_hold_blocks_other_users(self):
+        self.assertIsNotNone(hold_slot(self.alice, self.day, self.at))
+        self.assertIsNone(hold_slot(self.bob, self.day, self.at))
+        self.assertIsNone(confirm_hold(self.bob, self.day, self.at, owner_name='Bob'))
+        self.assertIsNotNone(confirm_hold(self.alice, self.day, self.at, owner_name='Alice'))
+        self.assertFalse(SlotHold.objects.exists())
+
+    def test_expired_hold_can_be_taken_over(self):
+        hold = hold_slot(self.alice, self.day, self.at)
+        SlotHold.objects.filter(pk=hold.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertIsNotNone(hold_slot(self.bob, self.day, self.at))
+        self.assertIsNone(confirm_hold(self.alice, self.day, self.at, owner_name='Alice'))
+
+    def test_new_hold_releases_previous_one(self):
+        hold_slot(self.alice, self.day, self.at)
+        hold_slot(self.alice, self.day, datetime.time(9, 30))
+        self.assertEqual(SlotHold.objects.filter(user=self.alice).count(), 1)
+        self.assertIsNotNone(hold_slot(self.bob, self.day, self.at))
+
+    def test_reap_expired(self):
+        hold_slot(self.alice, self.day, self.at)
+        hold_slot(self.bob, self.day, datetime.time(10))
+        self.assertEqual(reap_expired(timezone.now() + timedelta(hours=1)), 2)
+
+    def test_booking_a_taken_slot_returns_409(self):
+        confirm_hold(self.alice, self.day, self.at, owner_name='Alice')
+        client = Client()
+        client.force_login(self.bob)
+        data = dict(BOOKING, appointment_date='2030-01-07', appointment_time='09:00')
+        self.assertEqual(client.post(reverse('hold_slot'), data).status_code, 409)
+        self.assertEqual(client.post(reverse('appt'), data).status_code, 409)
+
+    def test_impossible_dates_and_times_return_400(self):
+        self.client.force_login(self.alice)
+        for date_value, time_value in [('2030-02-30', '09:00'), ('2030-01-07', '25:00'), ('2030-13-01', '09:00'),
+                                       ('', '09:00'), ('tomorrow', '09:00')]:
+            with self.subTest(date=date_value, time=time_value):
+                data = dict(BOOKING, appointment_date=date_value, appointment_time=time_value)
+                self.assertEqual(self.client.post(reverse('hold_slot'), data).status_code, 400)
+                response = self.client.post(reverse('appt'), data)
+                self.assertContains(response, 'Please choose a valid date and time.', status_code=400)
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_unknown_service_returns_400(self):
+        self.client.force_login(self.alice)
+        data = dict(BOOKING, service='General Checkup', appointment_date='2030-01-07', appointment_time='09:00')
+        self.assertContains(self.client.post(reverse('appt'), data), 'Please choose one of our services.', status_code=400)
+        self.assertEqual(self.client.post(reverse('appt'), dict(data, service='Preventive Care')).status_code, 302)
+        self.assertEqual(Appointment.objects.get().service, 'Preventive Care')
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    """Several hundred clients race for a handful of slots."""
+    CLIENTS = 300
+    SLOTS = 10
+    WORKERS = 32
+
+    def test_no_errors_and_no_double_bookings(self):
+        User.objects.bulk_create(
+            User(username=f'client{i}', email=f'client{i}@example.com', password='!')
+            for i in range(self.CLIENTS)
+        )
+        users = list(User.objects.order_by('pk'))
+        day = datetime.date(2030, 1, 7)
+        slots = [(datetime.datetime(2030, 1, 7, 9) + timedelta(minutes=30 * i)).strftime('%H:%M')
+                 for i in range(self.SLOTS)]
+
+        def book(i):
+            client = Client(raise_request_exception=False)
+            client.force_login(users[i])
+            data = dict(BOOKING, appointment_date=day.isoformat(), appointment_time=slots[i % self.SLOTS])
+            try:
+                statuses = []
+                # every third client skips the hold and submits straight away
+                if i % 3:
+                    statuses.append(client.post(reverse('hold_slot'), data).status_code)
+                statuses.append(client.post(reverse('appt'), data).status_code)
+                return statuses
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.WORKERS) as pool:
+            results = list(pool.map(book, range(self.CLIENTS)))
+
+        statuses = [status for result in results for status in result]
+        self.assertNotIn(500, statuses)
+        self.assertLessEqual(set(statuses), {200, 302, 409})
+
+        booked = sorted(
+            t.strftime('%H:%M') for t in
+            Appointment.objects.filter(preferred_date=day).values_list('preferred_time', flat=True)
+        )
+        self.assertEqual(booked, slots)
+        self.assertEqual(sum(result[-1] == 302 for result in results), self.SLOTS)
+
+
+@override_settings(WRITE_QUEUE_ENABLED=True, WRITE_QUEUE_TIMEOUT=5)
+class WriteQueueTests(TransactionTestCase):
+    def setUp(self):
+        self.queue = WriteQueue()
+        self.addCleanup(self.queue.stop, 5)
+        patcher = mock.patch('core.writes.write_queue', self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.vet = Vet.objects.create(name='Dr. Jones', specialty='Dental Care', email='j@example.com', phone='1')
+
+    def block_writer(self):
+        """Occupy the writer until the returned event is set, so later jobs queue up."""
+        started, release = threading.Event(), threading.Event()
+
+        def blocker():
+            started.set()
+            release.wait(5)
+
+        future = self.queue.submit(blocker)
+        self.assertTrue(started.wait(5))
+        self.addCleanup(release.set)
+        return release, future
+
+    def count_commits(self):
+        commits = []
+        wrapper_class = type(transaction.get_connection())
+        commit = wrapper_class.commit
+
+        def counted(wrapper):
+            if self.queue.is_writer_thread():
+                commits.append(wrapper)
+            return commit(wrapper)
+
+        patcher = mock.patch.object(wrapper_class, 'commit', counted)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return commits
+
+    def create_user(self, username, fail=False):
+        user = User.objects.create(username=username)
+        if fail:
+            raise ValueError(username)
+        return user.pk
+
+    def test_queued_jobs_share_one_commit(self):
+        commits = self.count_commits()
+        release, blocker = self.block_writer()
+        futures = [self.queue.submit(self.create_user, f'user{i}') for i in range(3)]
+        release.set()
+        blocker.result(5)
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(sorted(future.result(5) for future in futures),
+                         sorted(User.objects.filter(username__startswith='user').values_list('pk', flat=True)))
+        self.assertEqual(len(commits), 2)
+
+    def test_failing_job_only_rolls_back_its_savepoint(self):
+        commits = self.count_commits()
+        release, _ = self.block_writer()
+        first = self.queue.submit(self.create_user, 'first')
+        failing = self.queue.submit(self.create_user, 'failing', fail=True)
+        last = self.queue.submit(self.create_user, 'last')
+        release.set()
+        first.result(5), last.result(5)
+        with self.assertRaisesMessage(ValueError, 'failing'):
+            failing.result(5)
+        self.assertEqual(sorted(User.objects.values_list('username', flat=True)), ['first', 'last'])
+        self.assertEqual(len(commits), 2)
+
+    def test_errors_reach_the_caller(self):
+        with self.assertRaisesMessage(ValueError, 'failing'):
+            run_write(self.create_user, 'failing', fail=True)
+        self.assertFalse(User.objects.exists())
+        self.assertTrue(self.queue._thread.is_alive())
+
+    def test_runs_inline_inside_a_transaction_or_on_the_writer(self):
+        def thread_name():
+            return threading.current_thread().name
+
+        with transaction.atomic():
+            self.assertEqual(run_write(thread_name), threading.current_thread().name)
+        self.assertIsNone(self.queue._thread)
+        self.assertEqual(run_write(thread_name), 'write-queue')
+        # a job that itself calls run_write() must not wait on its own queue
+        self.assertEqual(run_write(run_write, thread_name), 'write-queue')
+
+    def test_restarts_after_stop_and_fork(self):
+        self.assertEqual(run_write(self.create_user, 'before'), User.objects.get().pk)
+        first = self.queue._thread
+        self.queue.stop(5)
+        self.assertFalse(first.is_alive())
+
+        run_write(self.create_user, 'after stop')
+        second = self.queue._thread
+        self.assertIsNot(second, first)
+
+        # a forked worker sees another pid: it gets its own queue and writer
+        jobs = self.queue._jobs
+        self.queue._pid = -1
+        run_write(self.create_user, 'after fork')
+        self.assertIsNot(self.queue._jobs, jobs)
+        self.assertIsNot(self.queue._thread, second)
+        jobs.put(None)
+        second.join(5)
+        self.assertEqual(User.objects.count(), 3)
+
+    def test_on_commit_callbacks_run_after_the_group_commit(self):
+        appointment = Appointment.objects.create(
+            owner_name='Owner', phone='1', pet_name='Rex', pet_species='dog', service='Dental Care',
+            preferred_date=datetime.date(2030, 1, 7), preferred_time=datetime.time(9),
+        )
+        schedule, page = schedule_version(self.vet.pk), cache.get(PAGE_VERSION_KEY)
+        seen = []
+
+        def assign():
+            appointment.assigned_doctor = self.vet
+            appointment.save()
+            self.vet.save()
+            seen.append((schedule_version(self.vet.pk), cache.get(PAGE_VERSION_KEY)))
+
+        release, _ = self.block_writer()
+        futures = [self.queue.submit(assign), self.queue.submit(self.create_user, 'other')]
+        release.set()
+        for future in futures:
+            future.result(5)
+        # unchanged while the batch ran, replaced once it committed
+        self.assertEqual(seen, [(schedule, page)])
+        self.assertNotEqual(schedule_version(self.vet.pk), schedule)
+        self.assertNotEqual(cache.get(PAGE_VERSION_KEY), page)
+
+    def test_saving_a_prescription_through_the_queue_invalidates_its_pdf(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.vet.user = User.objects.create_user('drjones', 'jones@example.com', 'pw')
+        self.vet.save()
+        appointment = Appointment.objects.create(
+            owner_name='Owner', phone='1', pet_name='Rex', pet_species='dog', service='Dental Care',
+            preferred_date=datetime.date(2030, 1, 7), preferred_time=datetime.time(9),
+            assigned_doctor=self.vet, assigned_date=datetime.date(2030, 1, 7), assigned_time=datetime.time(9),
+        )
+        with mock.patch.object(pdf_cache, 'directory', Path(directory.name)):
+            pdf_cache.get_or_render(prescription_pdf_inputs(appointment))
+            self.client.force_login(self.vet.user)
+            response = self.client.post(reverse('save_prescription', args=[appointment.appointment_id]),
+                                        {'diagnosis': 'Gingivitis'})
+            self.assertTrue(response.json()['success'])
+            self.assertEqual(list(Path(directory.name).glob('*.pdf')), [])
+        self.assertEqual(Appointment.objects.get().diagnosis, 'Gingivitis')
+
+    @override_settings(WRITE_QUEUE_TIMEOUT=0.05)
+    def test_timed_out_jobs_are_cancelled_unrun(self):
+        release, _ = self.block_writer()
+        with self.assertRaises(WriteQueueTimeout):
+            run_write(self.create_user, 'late')
+        release.set()
+        run_write(self.create_user, 'next')
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), ['next'])
+
+    @override_settings(WRITE_QUEUE_TIMEOUT=0.05)
+    def test_running_jobs_are_waited_for(self):
+        def slow():
+            time.sleep(0.3)
+            return self.create_user('slow')
+
+        self.assertEqual(run_write(slow), User.objects.get(username='slow').pk)
+
+    @override_settings(WRITE_QUEUE_TIMEOUT=0.05)
+    def test_busy_queue_answers_503(self):
+        user = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.client.force_login(user)
+        release, _ = self.block_writer()
+        response = self.client.post(reverse('appt'), dict(BOOKING, appointment_date='2030-01-07',
+                                                          appointment_time='09:00'))
+        self.assertEqual(response.status_code, 503)
+        release.set()
+        self.queue.stop(5)
+        self.assertFalse(Appointment.objects.exists())
+
+        self.vet.user = user
+        run_write(self.vet.save)
+        appointment = run_write(
+            Appointment.objects.create, owner_name='Owner', phone='1', pet_name='Rex', pet_species='dog',
+            service='Dental Care', preferred_date=datetime.date(2030, 1, 7), preferred_time=datetime.time(9),
+            assigned_doctor=self.vet,
+        )
+        release, _ = self.block_writer()
+        response = self.client.post(reverse('save_prescription', args=[appointment.appointment_id]),
+                                    {'diagnosis': 'Gingivitis'})
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.json()['success'])
+        release.set()
+        self.queue.stop(5)
+        self.assertEqual(Appointment.objects.get().diagnosis, '')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite-specific')
+class AppointmentQueryPlanTests(TestCase):
+    """The hot Appointment queries must be answered from an index, not a table scan."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vet_user = User.objects.create_user('drsmith', 'smith@example.com', 'pw')
+        cls.vet = Vet.objects.create(
+            name='Dr. Smith', specialty='Dental Care', email='smith@example.com', phone='1', user=cls.vet_user
+        )
+        cls.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        cls.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        cls.appointment = Appointment.objects.create(
+            owner_name='Owner', phone='1', email='owner@example.com', pet_name='Rex', pet_species='dog',
+            service='Dental Care', preferred_date=datetime.date.today(), preferred_time=datetime.time(9),
+            assigned_doctor=cls.vet, assigned_date=datetime.date.today(), assigned_time=datetime.time(9),
+            status='confirmed',
+        )
+
+    def assertIndexed(self, sql, params=(), ordered=False):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = '\n'.join(row[-1] for row in cursor.fetchall())
+        self.assertNotIn('SCAN core_appointment', plan, f'{sql}\n{plan}')
+        if ordered:
+            self.assertNotIn('TEMP B-TREE FOR ORDER BY', plan, f'{sql}\n{plan}')
+
+    def assertQuerysetIndexed(self, queryset, ordered=False):
+        sql, params = queryset.query.sql_with_params()
+        self.assertIndexed(sql, params, ordered)
+
+    def test_doctor_dashboard(self):
+        cache.clear()
+        self.client.force_login(self.vet_user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('doctor_dashboard'))
+        schedule_queries = [q['sql'] for q in queries if 'FROM "core_appointment"' in q['sql']]
+        self.assertEqual(len(schedule_queries), 1)
+        self.assertIndexed(schedule_queries[0], ordered=True)
+
+    def test_profile(self):
+        self.client.force_login(self.owner)
+        for params in ({}, {'before': '2030-01-07T09:00:00'}, {'after': '2020-01-07T09:00:00'}):
+            with self.subTest(params=params), CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('profile'), params)
+            history_queries = [q['sql'] for q in queries if 'FROM "core_appointment"' in q['sql']]
+            self.assertEqual(len(history_queries), 1)
+            self.assertIndexed(history_queries[0], ordered=True)
+
+    def test_admin_conflict_check(self):
+        data = model_to_dict(self.appointment)
+        data['assigned_time'] = '09:00'
+        form = AppointmentAdminForm(data=data, instance=self.appointment)
+        with CaptureQueriesContext(connection) as queries:
+            form.is_valid()
+        conflict_checks = [q['sql'] for q in queries if '"core_appointment"."assigned_time" =' in q['sql']]
+        self.assertTrue(conflict_checks)
+        for sql in conflict_checks:
+            self.assertIndexed(sql)
+
+    def test_admin_list_filters(self):
+        model_admin = admin.site._registry[Appointment]
+        for params in ({'status__exact': 'pending'}, {'payment_status__exact': 'paid'},
+                       {'completion_status__exact': 'complete'}, {'assigned_date__year': '2030'}):
+            with self.subTest(params=params):
+                request = RequestFactory().get('/admin/core/appointment/', params)
+                request.user = self.admin_user
+                changelist = model_admin.get_changelist_instance(request)
+                self.assertQuerysetIndexed(changelist.queryset)
+
+
+
+@override_settings(PROFILE_HISTORY_PAGE_SIZE=2)
+class ProfileHistoryTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.appointments = [
+            Appointment.objects.create(
+                owner=self.owner, owner_name='Owner', phone='1', pet_name='Rex', pet_species='dog',
+                service='Dental Care', preferred_date=datetime.date(2030, 1, day), preferred_time=datetime.time(9),
+            )
+            for day in (5, 6, 7)
+        ]
+        self.client.force_login(self.owner)
+
+    def page(self, **params):
+        response = self.client.get(reverse('profile'), params)
+        self.assertEqual(response.status_code, 200)
+        return [a.pk for a in response.context['appointments']], response.context['older_cursor']
+
+    def test_cursors_page_through_history(self):
+        first, older = self.page()
+        self.assertEqual(first, [self.appointments[2].pk, self.appointments[1].pk])
+        self.assertEqual(self.page(before=older), ([self.appointments[0].pk], None))
+        self.assertEqual(self.page(after='2030-01-05T09:00:00')[0], first)
+
+    def test_malformed_cursor_is_ignored(self):
+        first = self.page()
+        for cursor in ('2030-02-30T09:00:00', '2030-01-07T25:00', 'yesterday', ''):
+            for direction in ('before', 'after'):
+                with self.subTest(**{direction: cursor}):
+                    self.assertEqual(self.page(**{direction: cursor}), first)
+
+class DoctorScheduleCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.vet = Vet.objects.create(name='Dr. Jones', specialty='Dental Care', email='j@example.com', phone='1')
+        self.other_vet = Vet.objects.create(name='Dr. Lee', specialty='Dental Care', email='l@example.com', phone='1')
+        self.today = datetime.date(2030, 1, 7)
+        self.appointment = Appointment.objects.create(
+            owner_name='Owner', phone='1', pet_name='Rex', pet_species='dog', service='Dental Care',
+            preferred_date=self.today, preferred_time=datetime.time(9),
+            assigned_doctor=self.vet, assigned_date=self.today, assigned_time=datetime.time(9), status='confirmed',
+        )
+
+    def test_repeat_loads_skip_the_database(self):
+        with self.assertNumQueries(1):
+            doctor_schedule(self.vet.pk, self.today)
+        with self.assertNumQueries(0):
+            todays, upcoming = doctor_schedule(self.vet.pk, self.today)
+        self.assertEqual([a.pk for a in todays], [self.appointment.pk])
+        self.assertEqual(upcoming, [])
+
+    def test_saves_and_bulk_actions_invalidate(self):
+        doctor_schedule(self.vet.pk, self.today)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.appointment.assigned_date = self.today + timedelta(days=2)
+            self.appointment.save()
+        todays, upcoming = doctor_schedule(self.vet.pk, self.today)
+        self.assertEqual((len(todays), len(upcoming)), (0, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.appointment.assigned_doctor = self.other_vet
+            self.appointment.save()
+        self.assertEqual(doctor_schedule(self.vet.pk, self.today), ([], []))
+
+        doctor_schedule(self.other_vet.pk, self.today)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:core_appointment_changelist'),
+                             {'action': 'cancel_selected', '_selected_action': [self.appointment.pk]})
+        self.assertEqual(doctor_schedule(self.other_vet.pk, self.today), ([], []))
+
+
+class DailyRollupTests(TestCase):
+    FIELDS = ['date', 'vet_id', 'service', 'pending', 'confirmed', 'cancelled', 'completed', 'paid_count',
+              'paid_total', 'refunded_count', 'refunded_total', 'booked_slots']
+
+    def setUp(self):
+        self.vet = Vet.objects.create(name='Dr. Jones', specialty='Dental Care', email='j@example.com', phone='1')
+        self.day = datetime.date(2030, 1, 7)
+        self.appointments = [
+            Appointment.objects.create(
+                owner_name='Owner', phone='1', pet_name='Rex', pet_species='dog', service='Dental Care',
+                preferred_date=self.day, preferred_time=datetime.time(9 + i),
+            )
+            for i in range(3)
+        ]
+
+    def rows(self):
+        return sorted(DailyRollup.objects.exclude(
+            pending=0, confirmed=0, cancelled=0, completed=0, paid_count=0, refunded_count=0, booked_slots=0,
+        ).values_list(*self.FIELDS), key=str)
+
+    def assertMatchesRebuild(self):
+        incremental = self.rows()
+        rebuild_range(self.day - timedelta(days=7), self.day + timedelta(days=7))
+        self.assertEqual(incremental, self.rows())
+        return incremental
+
+    def test_saves_bulk_actions_and_deletes_keep_rollups_exact(self):
+        first, second, third = self.appointments
+        first.assigned_doctor, first.assigned_date, first.assigned_time = self.vet, self.day, datetime.time(10)
+        first.status, first.payment_status, first.payment_amount = 'confirmed', 'paid', '120.50'
+        first.save()
+        second.assigned_doctor, second.assigned_date, second.assigned_time = self.vet, self.day, datetime.time(11)
+        second.save()
+        third.delete()
+        rows = self.assertMatchesRebuild()
+        self.assertIn((self.day, self.vet.pk, 'Dental Care', 1, 1, 0, 0, 1, 120.5, 0, 0, 2), rows)
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        self.client.post(reverse('admin:core_appointment_changelist'),
+                         {'action': 'complete_selected', '_selected_action': [first.pk, second.pk]})
+        first = Appointment.objects.get(pk=first.pk)
+        first.assigned_date += timedelta(days=1)
+        first.payment_status = 'refunded'
+        first.save()
+        self.assertMatchesRebuild()
+
+        self.vet.delete()
+        self.assertEqual(self.assertMatchesRebuild()[0][1], None)
+
+    def test_report_page(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        response = self.client.get(reverse('reports'), {'start': '2030-01-01', 'end': '2030-01-31'})
+        self.assertContains(response, 'Dr. Jones')
+        self.assertEqual(response.context['report']['totals']['pending'], 3)
+        self.assertEqual(self.client.get(reverse('reports'), {'start': '2030-01-31', 'end': '2030-01-01'}).status_code, 400)
+        for dates in ({'start': '2030-02-30'}, {'start': '2030-01-01', 'end': '2030-13-01'}, {'end': 'soon'}):
+            with self.subTest(dates=dates):
+                self.assertContains(self.client.get(reverse('reports'), dates), 'Date range must be 0-366 days',
+                                    status_code=400)
+
+
+class DashboardEventsLoadTests(TransactionTestCase):
+    """Hundreds of idle dashboards on the real ASGI app, all told about one change."""
+    SUBSCRIBERS = 300
+
+    async def test_idle_subscribers_receive_updates(self):
+        user = await sync_to_async(User.objects.create_user)('drkim', 'kim@example.com', 'pw')
+        vet = await Vet.objects.acreate(name='Dr. Kim', specialty='Dental Care', email='kim@example.com', phone='1', user=user)
+        appointment = await Appointment.objects.acreate(
+            owner_name='Owner', phone='1', pet_name='Rex', pet_species='dog', service='Dental Care',
+            preferred_date=datetime.date(2030, 1, 7), preferred_time=datetime.time(9),
+            assigned_doctor=vet, assigned_date=datetime.date(2030, 1, 7), assigned_time=datetime.time(9),
+        )
+        client = AsyncClient()
+        await client.aforce_login(user)
+        cookie = f"sessionid={client.cookies['sessionid'].value}".encode()
+        application = get_asgi_application()
+        path = reverse('doctor_events')
+
+        disconnect = asyncio.Event()
+        received = {}
+
+        async def subscriber(i):
+            requested = False
+
+            async def receive():
+                nonlocal requested
+                if not requested:
+                    requested = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    self.assertEqual(message['status'], 200)
+                elif b'event: schedule' in message.get('body', b''):
+                    received.setdefault(i, time.perf_counter())
+
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+                'root_path': '', 'headers': [(b'host', b'testserver'), (b'cookie', cookie)],
+                'client': ('127.0.0.1', 10000 + i), 'server': ('testserver', 80),
+            }
+            await application(scope, receive, send)
+
+        tasks = [asyncio.create_task(subscriber(i)) for i in range(self.SUBSCRIBERS)]
+        try:
+            deadline = time.perf_counter() + 30
+            while broker.subscriber_count(vet.pk) < self.SUBSCRIBERS:
+                self.assertLess(time.perf_counter(), deadline, 'subscribers did not connect')
+                await asyncio.sleep(0.05)
+
+            appointment.status = 'confirmed'
+            changed_at = time.perf_counter()
+            await sync_to_async(appointment.save)()
+            while len(received) < self.SUBSCRIBERS and time.perf_counter() - changed_at < 10:
+                await asyncio.sleep(0.01)
+            self.assertEqual(len(received), self.SUBSCRIBERS)
+            self.assertLess(max(received.values()) - changed_at, 2)
+        finally:
+            disconnect.set()
+            await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), 30)
+        self.assertEqual(broker.subscriber_count(vet.pk), 0)
+
+
+
+class DashboardLiveUpdatesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('drkim', 'kim@example.com', 'pw')
+        Vet.objects.create(name='Dr. Kim', specialty='Dental Care', email='kim@example.com', phone='1', user=self.user)
+
+    def test_wsgi_has_no_event_stream(self):
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(reverse('doctor_dashboard')), 'data-live-updates="false"')
+        response = self.client.get(reverse('doctor_events'))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(response.streaming)
+        self.assertEqual(broker.subscriber_count(self.user.vet.pk), 0)
+
+    async def test_asgi_dashboard_opens_the_stream(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('doctor_dashboard'))
+        self.assertContains(response, 'data-live-updates="true"')
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Pages and admin actions run a bounded number of queries, none of them once per row."""
+
+    @classmethod
+    def setUpTestData(cls):
+        today = datetime.date.today()
+        specialties = [name for name, label in Vet.DEPARTMENTS]
+        cls.vets = []
+        for i, specialty in enumerate(specialties):
+            user = User.objects.create_user(f'vet{i}', f'vet{i}@example.com', 'pw')
+            cls.vets.append(Vet.objects.create(
+                name=f'Dr. {i}', specialty=specialty, email=f'vet{i}@example.com', phone='1', user=user
+            ))
+        cls.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        cls.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        for i in range(40):
+            vet = cls.vets[i % len(cls.vets)]
+            Appointment.objects.create(
+                owner_name='Owner', phone='1', email='owner@example.com', pet_name=f'Pet {i}', pet_species='dog',
+                service=vet.specialty, preferred_date=today + timedelta(days=i // 8),
+                preferred_time=datetime.time(9 + i % 8), assigned_doctor=vet,
+                assigned_date=today + timedelta(days=i // 8), assigned_time=datetime.time(9 + i % 8),
+                status='confirmed' if i % 2 else 'pending', prescription='Rest' if i % 3 == 0 else '',
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, user, url, budget):
+        self.client.force_login(user)
+        with self.assertQueryBudget(budget):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def run_action(self, action, budget):
+        self.client.force_login(self.admin_user)
+        url = reverse('admin:core_appointment_changelist')
+        data = {'action': action, '_selected_action': list(Appointment.objects.values_list('pk', flat=True))}
+        with self.assertQueryBudget(budget):
+            response = self.client.post(url, data)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response
+
+    def test_home(self):
+        self.get(self.owner, reverse('home'), 2)
+
+    def test_profile(self):
+        self.get(self.owner, reverse('profile'), 3)
+
+    def test_doctor_dashboard(self):
+        self.get(self.vets[0].user, reverse('doctor_dashboard'), 3)
+
+    def test_appointment_changelist(self):
+        self.get(self.admin_user, reverse('admin:core_appointment_changelist'), 9)
+
+    def test_vet_changelist(self):
+        self.get(self.admin_user, reverse('admin:core_vet_changelist'), 6)
+
+    def test_exports(self):
+        for action in ['export_as_csv', 'export_as_jsonl', 'export_prescriptions_csv']:
+            with self.subTest(action=action):
+                self.assertEqual(self.run_action(action, 8).status_code, 200)
+
+    def test_confirm_selected(self):
+        self.run_action('confirm_selected', 21)
+        self.assertFalse(Appointment.objects.exclude(status='confirmed').exists())
+
+
+class PrescriptionPDFCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        user = User.objects.create_user('drjones', 'jones@example.com', 'pw')
+        self.vet = Vet.objects.create(name='Dr. Jones', specialty='Dental Care', email='j@example.com', phone='1', user=user)
+        self.appointment = Appointment.objects.create(
+            owner_name='Owner', phone='1', pet_name='Rex', pet_species='dog', service='Dental Care',
+            preferred_date=datetime.date(2030, 1, 7), preferred_time=datetime.time(9),
+            assigned_doctor=self.vet, assigned_date=datetime.date(2030, 1, 7), assigned_time=datetime.time(9),
+            prescription='Rest',
+        )
+
+    def inputs(self, appointment_id, prescription='Rest'):
+        return dict(prescription_pdf_inputs(self.appointment), appointment_id=appointment_id, prescription=prescription)
+
+    def test_hit_and_miss(self):
+        cache = PrescriptionPDFCache(self.directory, 1024 * 1024)
+        inputs = self.inputs('A1')
+        self.assertIsNone(cache.get(inputs))
+        pdf = cache.get_or_render(inputs)
+        self.assertTrue(pdf.startswith(b'%PDF'))
+        self.assertEqual(cache.get(inputs), pdf)
+        self.assertIsNone(cache.get(self.inputs('A1', prescription='Rest and fluids')))
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 3, 'evictions': 0})
+
+    def test_evicts_least_recently_used_without_scanning_every_write(self):
+        cache = PrescriptionPDFCache(self.directory, 250, rescan_every=1000)
+        with mock.patch.object(cache, 'evict', wraps=cache.evict) as evict:
+            for i, name in enumerate(['A1', 'A2']):
+                cache.put(self.inputs(name), b'x' * 100)
+                os.utime(cache.path_for(self.inputs(name)), (1000 + i, 1000 + i))
+            # only the first write scans, to learn what is already on disk
+            self.assertEqual(evict.call_count, 1)
+            cache.get(self.inputs('A1'))
+            cache.put(self.inputs('A3'), b'x' * 100)
+            self.assertEqual(evict.call_count, 2)
+
+        self.assertIsNone(cache.get(self.inputs('A2')))
+        self.assertIsNotNone(cache.get(self.inputs('A1')))
+        self.assertIsNotNone(cache.get(self.inputs('A3')))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_invalidate_frees_space(self):
+        cache = PrescriptionPDFCache(self.directory, 250, rescan_every=1000)
+        cache.put(self.inputs('A1'), b'x' * 100)
+        cache.put(self.inputs('A2'), b'x' * 100)
+        cache.invalidate('A1')
+        with mock.patch.object(cache, 'evict') as evict:
+            cache.put(self.inputs('A3'), b'x' * 100)
+        evict.assert_not_called()
+        self.assertEqual(sorted(path.name[:2] for path in self.directory.glob('*.pdf')), ['A2', 'A3'])
+
+    def test_saving_a_prescription_invalidates_its_pdf(self):
+        with mock.patch.object(pdf_cache, 'directory', self.directory):
+            pdf_cache.get_or_render(prescription_pdf_inputs(self.appointment))
+            self.assertEqual(len(list(self.directory.glob(f'{self.appointment.appointment_id}-*.pdf'))), 1)
+
+            self.client.force_login(self.vet.user)
+            response = self.client.post(
+                reverse('save_prescription', args=[self.appointment.appointment_id]),
+                {'diagnosis': 'Gingivitis', 'medications': 'Clindamycin 25mg - 1 tablet daily'},
+            )
+            self.assertTrue(response.json()['success'])
+            self.assertEqual(list(self.directory.glob(f'{self.appointment.appointment_id}-*.pdf')), [])
+
+
+class PrescriptionZipExportTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(pdf_cache, 'directory', Path(directory.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.vet = Vet.objects.create(name='Dr. Jones', specialty='Dental Care', email='j@example.com', phone='1')
+        self.appointments = [
+            Appointment.objects.create(
+                owner_name='Owner', phone='1', pet_name=f'Pet {i}', pet_species='dog', service='Dental Care',
+                preferred_date=datetime.date(2030, 1, 7), preferred_time=datetime.time(9 + i),
+                assigned_doctor=self.vet, assigned_date=datetime.date(2030, 1, 7), assigned_time=datetime.time(9 + i),
+                prescription=f'Rest for {i} days' if i < 3 else '',
+            )
+            for i in range(4)
+        ]
+
+    def test_admin_action_zips_one_pdf_per_prescription(self):
+        with_rx = self.appointments[:3]
+        # one cached, the others rendered during the export
+        cached = pdf_cache.get_or_render(prescription_pdf_inputs(with_rx[0]))
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        response = self.client.post(reverse('admin:core_appointment_changelist'), {
+            'action': 'export_prescriptions_pdf_zip',
+            '_selected_action': [a.pk for a in self.appointments],
+        })
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+        self.assertEqual(
+            sorted(archive.namelist()), sorted(f'prescription_{a.appointment_id}.pdf' for a in with_rx)
+        )
+        self.assertEqual(archive.read(f'prescription_{with_rx[0].appointment_id}.pdf'), cached)
+        for appointment in with_rx[1:]:
+            data = archive.read(f'prescription_{appointment.appointment_id}.pdf')
+            self.assertTrue(data.startswith(b'%PDF'))
+            # rendered PDFs are cached for next time
+            self.assertEqual(pdf_cache.get(prescription_pdf_inputs(appointment)), data)
+
+    def test_streams_before_reading_every_appointment(self):
+        with_rx = self.appointments[:3]
+        for appointment in with_rx:
+            pdf_cache.get_or_render(prescription_pdf_inputs(appointment))
+        consumed = []
+
+        def appointments():
+            for appointment in with_rx:
+                consumed.append(appointment)
+                yield appointment
+
+        chunks = stream_prescription_zip(appointments(), workers=1)
+        first = next(chunk for chunk in chunks if chunk)
+        self.assertEqual(len(consumed), 1)
+        self.assertTrue(first.startswith(b'PK'))
+        rest = b''.join(chunks)
+        self.assertEqual(len(zipfile.ZipFile(io.BytesIO(first + rest)).namelist()), 3)
+
+
+class StructuredPrescriptionTests(TestCase):
+    RX = '1. Carprofen 25mg\nSig: 1 tablet twice daily\n\n2. Gabapentin 100 mg\n3. Ear cleaner'
+
+    def setUp(self):
+        user = User.objects.create_user('drjones', 'jones@example.com', 'pw')
+        self.vet = Vet.objects.create(name='Dr. Jones', specialty='Dental Care', email='j@example.com', phone='1', user=user)
+        self.appointment = Appointment.objects.create(
+            owner_name='Owner', phone='1', pet_name='Rex', pet_species='dog', service='Dental Care',
+            preferred_date=datetime.date(2030, 1, 7), preferred_time=datetime.time(9),
+            assigned_doctor=self.vet, assigned_date=datetime.date(2030, 1, 7), assigned_time=datetime.time(9),
+        )
+
+    def test_set_prescription_composes_text_and_medication_rows(self):
+        self.appointment.set_prescription(diagnosis='Strain', medications=self.RX, follow_up='2 weeks')
+        self.appointment.save()
+        self.appointment.sync_medication_lines()
+
+        self.assertEqual(self.appointment.chief_complaint, '')
+        self.assertEqual(
+            self.appointment.prescription,
+            f'DIAGNOSIS:\nStrain\n\nPRESCRIPTION (Rx):\n{self.RX}\n\nFOLLOW-UP:\n2 weeks',
+        )
+        self.assertEqual(
+            list(self.appointment.medication_lines.values_list('position', 'drug_name', 'strength', 'sig')),
+            [(1, 'Carprofen', '25mg', '1 tablet twice daily'), (2, 'Gabapentin', '100 mg', ''), (3, 'Ear cleaner', '', '')],
+        )
+
+        # saving again replaces the rows rather than adding to them
+        self.appointment.set_prescription(medications='1. Meloxicam 1.5mg/ml')
+        self.appointment.sync_medication_lines()
+        self.assertEqual(list(self.appointment.medication_lines.values_list('drug_name', 'strength')),
+                         [('Meloxicam', '1.5mg/ml')])
+        self.assertEqual(self.appointment.diagnosis, '')
+
+    def test_split_migration(self):
+        migration = importlib.import_module('core.migrations.0022_split_existing_prescriptions')
+        self.appointment.set_prescription(
+            chief_complaint='Limping', diagnosis='Strain', medications=self.RX, instructions='Rest',
+        )
+        packed = self.appointment.prescription
+        Appointment.objects.filter(pk=self.appointment.pk).update(
+            prescription=packed, chief_complaint='', diagnosis='', medications='', instructions='',
+        )
+
+        migration.split_prescriptions(apps, None)
+
+        appointment = Appointment.objects.get(pk=self.appointment.pk)
+        self.assertEqual(
+            (appointment.chief_complaint, appointment.diagnosis, appointment.medications, appointment.instructions,
+             appointment.follow_up),
+            ('Limping', 'Strain', self.RX, 'Rest', ''),
+        )
+        self.assertEqual(appointment.prescription, packed)
+        self.assertEqual(appointment.compose_prescription(), packed)
+        self.assertEqual(PrescriptionMedication.objects.filter(appointment=appointment).count(), 3)
+
+    def test_split_migration_keeps_long_diagnoses(self):
+        migration = importlib.import_module('core.migrations.0022_split_existing_prescriptions')
+        diagnosis = 'Chronic gingivostomatitis ' * 20
+        packed = f'CHIEF COMPLAINT:\nDrooling\n\nDIAGNOSIS:\n{diagnosis}\n\nPRESCRIPTION (Rx):\n{self.RX}'
+        Appointment.objects.filter(pk=self.appointment.pk).update(prescription=packed)
+
+        migration.split_prescriptions(apps, None)
+
+        appointment = Appointment.objects.get(pk=self.appointment.pk)
+        self.assertEqual(len(appointment.diagnosis), 255)
+        self.assertTrue(appointment.diagnosis.endswith(migration.DIAGNOSIS_MARKER))
+        self.assertEqual(appointment.chief_complaint, f'Drooling\n\nDIAGNOSIS (full text):\n{diagnosis}')
+        self.assertEqual(appointment.medications, self.RX)
+        # the recomposed text, which the next dashboard save writes, still holds all of it
+        self.assertIn(diagnosis, appointment.compose_prescription())
+
+    def test_overlong_diagnosis_is_rejected_not_truncated(self):
+        self.client.force_login(self.vet.user)
+        url = reverse('save_prescription', args=[self.appointment.appointment_id])
+
+        response = self.client.post(url, {'diagnosis': 'x' * 256})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['success'])
+        self.assertEqual(Appointment.objects.get(pk=self.appointment.pk).diagnosis, '')
+
+        self.assertTrue(self.client.post(url, {'diagnosis': 'x' * 255}).json()['success'])
+        self.assertEqual(Appointment.objects.get(pk=self.appointment.pk).diagnosis, 'x' * 255)
+
+
+class PrescriptionCatalogueTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('drjones', 'jones@example.com', 'pw')
+        Vet.objects.create(name='Dr. Jones', specialty='Dental Care', email='j@example.com', phone='1', user=user)
+        self.client.force_login(user)
+        self.url = reverse('prescription_catalogue')
+
+    def test_current_version_is_cached_for_good(self):
+        response = self.client.get(self.url, {'v': CATALOGUE_VERSION})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, CATALOGUE_JSON)
+        self.assertEqual(response['ETag'], f'"{CATALOGUE_VERSION}"')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=31536000, immutable')
+
+    def test_other_versions_revalidate_with_304(self):
+        response = self.client.get(self.url, {'v': 'old'})
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        response = self.client.get(self.url, {'v': 'old'}, headers={'if-none-match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        response = self.client.get(self.url, headers={'if-none-match': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_vets_only(self):
+        self.client.force_login(User.objects.create_user('owner', 'owner@example.com', 'pw'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class MedicationSearchTests(unittest.TestCase):
+    FORMULARY = [
+        {'name': 'Amoxicillin', 'strengths': ['250mg', '500mg'], 'type': 'Antibiotic'},
+        {'name': 'Amoxicillin Clavulanate', 'strengths': ['62.5mg', '125mg'], 'type': 'Antibiotic'},
+        {'name': 'Amox', 'strengths': ['50mg'], 'type': 'Antibiotic'},
+        {'name': 'Clavamox Amoxi Drops', 'strengths': ['50mg/ml'], 'type': 'Antibiotic'},
+        {'name': 'Carprofen', 'strengths': ['25mg', '75mg', '100mg'], 'type': 'Anti-inflammatory'},
+        {'name': 'Meloxicam', 'strengths': ['1.5mg/ml', '7.5mg'], 'type': 'Anti-inflammatory'},
+        {'name': 'Gabapentin', 'strengths': ['100mg', '300mg'], 'type': 'Pain Relief'},
+    ]
+
+    def names(self, index, *args, **kwargs):
+        return [med['name'] for med in index.search(*args, **kwargs)]
+
+    def test_prefix_ranking(self):
+        index = MedicationIndex(self.FORMULARY)
+        # exact name, then names starting with the query (shorter first), then names with a word starting with it
+        self.assertEqual(
+            self.names(index, 'amox'), ['Amox', 'Amoxicillin', 'Amoxicillin Clavulanate', 'Clavamox Amoxi Drops']
+        )
+        self.assertEqual(self.names(index, 'amox clav'), ['Clavamox Amoxi Drops', 'Amoxicillin Clavulanate'])
+        self.assertEqual(self.names(index, 'amox', limit=2), ['Amox', 'Amoxicillin'])
+
+    def test_typo_tolerance(self):
+        index = MedicationIndex(self.FORMULARY)
+        self.assertEqual(self.names(index, 'amoxicilin')[0], 'Amoxicillin')
+        self.assertEqual(self.names(index, 'carpofren'), ['Carprofen'])
+        self.assertEqual(self.names(index, 'gabapentn'), ['Gabapentin'])
+        self.assertEqual(self.names(index, 'zzzz'), [])
+
+    def test_type_and_strength_filters(self):
+        index = MedicationIndex(self.FORMULARY)
+        self.assertEqual(self.names(index, '', drug_type='anti-inflammatory'), ['Carprofen', 'Meloxicam'])
+        self.assertEqual(self.names(index, 'amox 250'), ['Amoxicillin'])
+        self.assertEqual(self.names(index, '', strength='100mg'), ['Carprofen', 'Gabapentin'])
+        self.assertEqual(self.names(index, 'c', drug_type='Anti-inflammatory', strength='25'), ['Carprofen'])
+
+    def test_filtered_short_query_finds_every_match(self):
+        # far more names start with "a" than the candidate cap, and the ones the filter wants sort last
+        formulary = [
+            {'name': f'Aa {i:04d}', 'strengths': ['10mg'], 'type': 'Antibiotic'} for i in range(MAX_CANDIDATES * 2)
+        ] + [
+            {'name': f'Az {i}', 'strengths': ['10mg'], 'type': 'Anti-inflammatory'} for i in range(30)
+        ]
+        index = MedicationIndex(formulary)
+        self.assertEqual(len(index.search('a', drug_type='Anti-inflammatory', limit=50)), 30)
+        self.assertEqual(len(index.search('a', limit=50)), 50)
+
+    def test_better_bands_are_not_cut_off_by_the_cap(self):
+        # more names have a word "car..." sorting before "carprofen" than the cap allows
+        formulary = self.FORMULARY + [
+            {'name': f'Zz Car N{i:04d}', 'strengths': ['10mg'], 'type': 'Antibiotic'} for i in range(MAX_CANDIDATES * 2)
+        ]
+        index = MedicationIndex(formulary)
+        self.assertEqual(self.names(index, 'car', limit=3), ['Carprofen', 'Zz Car N0000', 'Zz Car N0001'])
+        self.assertEqual(self.names(index, 'car', drug_type='anti-inflammatory'), ['Carprofen'])
+        # every term narrows the scan, not just the first
+        self.assertEqual(self.names(index, 'zz n0399'), ['Zz Car N0399'])
+        self.assertEqual(self.names(index, 'clavamox (amoxi'), ['Clavamox Amoxi Drops'])
+
+
+class FlakyEmailBackend(LocmemEmailBackend):
+    """The test backend, except that messages with 'bounce' in the subject fail."""
+
+    def send_messages(self, messages):
+        for message in messages:
+            if 'bounce' in message.subject:
+                raise ConnectionError('550 mailbox unavailable')
+        return super().send_messages(messages)
+
+
+class UnreachableEmailBackend(LocmemEmailBackend):
+    def open(self):
+        raise ConnectionRefusedError('connection refused')
+
+
+@override_settings(OUTBOX_RETRY_BASE_SECONDS=30, OUTBOX_MAX_ATTEMPTS=3)
+class OutboxTests(TestCase):
+    def make_due(self):
+        OutboxEmail.objects.filter(status='pending').update(next_attempt_at=timezone.now())
+
+    def test_sends_a_batch_over_one_connection_once(self):
+        for i in range(3):
+            queue_email(f'Reminder {i}', 'See you soon', [f'owner{i}@example.com'])
+        self.assertEqual(mail.outbox, [])
+
+        with mock.patch('core.outbox.get_connection', wraps=get_connection) as connect:
+            self.assertEqual(deliver_outbox(), (3, 0))
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['owner0@example.com', 'owner1@example.com', 'owner2@example.com'])
+        self.assertFalse(OutboxEmail.objects.exclude(status='sent').exists())
+        self.assertFalse(OutboxEmail.objects.filter(sent_at__isnull=True).exists())
+
+        self.make_due()
+        self.assertEqual(deliver_outbox(), (0, 0))
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_failures_back_off_exponentially(self):
+        queue_email('Confirmed', 'Body', ['ok@example.com'])
+        bounce = queue_email('Confirmed (bounce)', 'Body', ['bad@example.com'])
+
+        before = timezone.now()
+        self.assertEqual(deliver_outbox(connection=FlakyEmailBackend()), (1, 1))
+        bounce.refresh_from_db()
+        self.assertEqual((bounce.status, bounce.attempts), ('pending', 1))
+        self.assertIn('550 mailbox unavailable', bounce.last_error)
+        self.assertGreaterEqual(bounce.next_attempt_at, before + timedelta(seconds=30))
+        self.assertLess(bounce.next_attempt_at, before + timedelta(seconds=60))
+
+        # not due yet
+        self.assertEqual(deliver_outbox(connection=FlakyEmailBackend()), (0, 0))
+
+        self.make_due()
+        before = timezone.now()
+        self.assertEqual(deliver_outbox(connection=FlakyEmailBackend()), (0, 1))
+        bounce.refresh_from_db()
+        self.assertEqual(bounce.attempts, 2)
+        self.assertGreaterEqual(bounce.next_attempt_at, before + timedelta(seconds=60))
+        self.assertEqual([message.to for message in mail.outbox], [['ok@example.com']])
+
+    def test_gives_up_after_max_attempts(self):
+        bounce = queue_email('Cancelled (bounce)', 'Body', ['bad@example.com'])
+        for attempt in range(3):
+            self.make_due()
+            self.assertEqual(deliver_outbox(connection=FlakyEmailBackend()), (0, 1))
+        bounce.refresh_from_db()
+        self.assertEqual((bounce.status, bounce.attempts), ('failed', 3))
+
+        OutboxEmail.objects.filter(pk=bounce.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_outbox(connection=FlakyEmailBackend()), (0, 0))
+
+    def test_unreachable_server_defers_the_whole_batch(self):
+        for i in range(3):
+            queue_email(f'Reminder {i}', 'Body', [f'owner{i}@example.com'])
+        self.assertEqual(deliver_outbox(connection=UnreachableEmailBackend()), (0, 3))
+        self.assertEqual(set(OutboxEmail.objects.values_list('status', 'attempts')), {('pending', 1)})
+
+
+class AppointmentIdTests(TestCase):
+    def test_encoding_is_a_reversible_permutation(self):
+        ids = [encode(number) for number in range(5000)]
+        self.assertEqual(len(set(ids)), len(ids))
+        for number, appointment_id in enumerate(ids[:500]):
+            self.assertEqual(len(appointment_id), 8)
+            self.assertLessEqual(set(appointment_id), set(ALPHABET))
+            self.assertEqual(decode(appointment_id), number)
+
+    def test_skips_ids_issued_before_the_allocator(self):
+        AppointmentIdSequence.objects.update_or_create(pk=1, defaults={'next_value': 1})
+        legacy = Appointment.objects.create(
+            appointment_id=encode(2), owner_name='Owner', phone='1', pet_name='Rex', pet_species='dog',
+            service='Dental Care', preferred_date=datetime.date(2030, 1, 7), preferred_time=datetime.time(9),
+        )
+        AppointmentIdSequence.objects.filter(pk=1).update(next_value=1, legacy_max_pk=legacy.pk)
+
+        ids = AppointmentIdAllocator().allocate(3)
+        self.assertEqual(ids, [encode(1), encode(3), encode(4)])
+
+        appointment = Appointment.objects.create(
+            owner_name='Owner', phone='1', pet_name='Rex', pet_species='dog', service='Dental Care',
+            preferred_date=datetime.date(2030, 1, 7), preferred_time=datetime.time(10),
+        )
+        self.assertNotEqual(appointment.appointment_id, legacy.appointment_id)
+
+
+class AppointmentIdBlockTests(TransactionTestCase):
+    """The allocator caches blocks of numbers; two of them stand in for two workers."""
+
+    def test_allocators_sharing_the_sequence_never_repeat(self):
+        first, second = AppointmentIdAllocator(block_size=7), AppointmentIdAllocator(block_size=7)
+        ids = []
+        for count in (1, 3, 10, 2, 25):
+            ids += first.allocate(count)
+            ids += second.allocate(count)
+        with transaction.atomic():
+            ids += first.allocate(4)
+        self.assertEqual(len(ids), 2 * 41 + 4)
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def test_transactions_reserve_once_per_block(self):
+        allocator = AppointmentIdAllocator(block_size=10)
+        allocator.allocate()
+        with transaction.atomic():
+            with self.assertNumQueries(0):
+                ids = allocator.allocate(5)
+        self.assertEqual(len(set(ids)), 5)
+
+        # the cache is used up; the next block is reserved inside the transaction and used by it
+        allocator.allocate(4)
+        with transaction.atomic():
+            with self.assertNumQueries(1):
+                ids = allocator.allocate(3)
+            with self.assertNumQueries(0):
+                ids += allocator.allocate(3)
+        # after the commit, the rest of that block is shared
+        with self.assertNumQueries(0):
+            ids += allocator.allocate(4)
+        self.assertEqual(len(set(ids)), 10)
+
+    def test_rolled_back_blocks_are_not_reused(self):
+        allocator, other = AppointmentIdAllocator(block_size=10), AppointmentIdAllocator(block_size=10)
+        committed = []
+        with transaction.atomic():
+            with self.assertRaises(ZeroDivisionError), transaction.atomic():
+                allocator.allocate()
+                1 / 0
+            # the savepoint took the reservation with it, so this reserves again
+            committed += allocator.allocate(2)
+        with self.assertRaises(ZeroDivisionError), transaction.atomic():
+            allocator.allocate(3)
+            1 / 0
+        with transaction.atomic():
+            committed += allocator.allocate(3)
+        committed += allocator.allocate(5) + other.allocate(15)
+        self.assertEqual(len(set(committed)), len(committed))
+
+
+class AvailabilityTests(TestCase):
+    def setUp(self):
+        self.day = datetime.date(2030, 1, 7)
+        self.jones = Vet.objects.create(name='Dr. Jones', specialty='Dental Care', email='j@example.com', phone='1')
+        self.lee = Vet.objects.create(name='Dr. Lee', specialty='Dental Care', email='l@example.com', phone='1')
+        self.client_user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+
+    def book(self, at, vet=None, day=None, **fields):
+        day = day or self.day
+        return Appointment.objects.create(
+            owner_name='Owner', phone='1', pet_name='Rex', pet_species='dog', service='Dental Care',
+            preferred_date=day, preferred_time=at, assigned_doctor=vet, assigned_date=day if vet else None,
+            assigned_time=at if vet else None, **fields,
+        )
+
+    def mask(self, vet):
+        return VetDaySchedule.objects.filter(vet=vet, date=self.day).values_list('booked_mask', flat=True).first() or 0
+
+    def free(self, **kwargs):
+        return [slot.strftime('%H:%M') for slot in availability('Dental Care', self.day, self.day, **kwargs)[0]['free']]
+
+    def test_masks_follow_saves_and_deletes(self):
+        nine, ten = datetime.time(9), datetime.time(10)
+        appointment = self.book(nine, self.jones, status='confirmed')
+        self.assertEqual(self.mask(self.jones), SLOT_BITS[nine])
+
+        appointment.assigned_time = ten
+        appointment.save()
+        self.assertEqual(self.mask(self.jones), SLOT_BITS[ten])
+
+        appointment.assigned_doctor = self.lee
+        appointment.save()
+        self.assertEqual((self.mask(self.jones), self.mask(self.lee)), (0, SLOT_BITS[ten]))
+
+        appointment.status = 'cancelled'
+        appointment.save()
+        self.assertEqual(self.mask(self.lee), 0)
+
+        appointment.status = 'confirmed'
+        appointment.save()
+        Appointment.objects.get(pk=appointment.pk).delete()
+        self.assertEqual(self.mask(self.lee), 0)
+
+    def test_rebuild_repairs_bulk_updates(self):
+        appointment = self.book(datetime.time(9), self.jones, status='confirmed')
+        Appointment.objects.filter(pk=appointment.pk).update(assigned_time=datetime.time(11))
+        rebuild_availability([(self.jones.pk, self.day)])
+        self.assertEqual(self.mask(self.jones), SLOT_BITS[datetime.time(11)])
+
+    def test_a_slot_is_free_while_any_vet_is(self):
+        # requested for 8:00, before opening, and given Dr. Jones's 9:30 slot instead
+        Appointment.objects.create(
+            owner_name='Owner', phone='1', pet_name='Rex', pet_species='dog', service='Dental Care',
+            preferred_date=self.day, preferred_time=datetime.time(8), assigned_doctor=self.jones,
+            assigned_date=self.day, assigned_time=datetime.time(9, 30), status='confirmed',
+        )
+        day = availability('Dental Care', self.day, self.day)[0]
+        jones, lee = day['vets']
+        self.assertNotIn(datetime.time(9, 30), jones['free'])
+        self.assertIn(datetime.time(9, 30), lee['free'])
+        self.assertIn(datetime.time(9, 30), day['free'])
+
+        Appointment.objects.create(
+            owner_name='Owner', phone='1', pet_name='Tom', pet_species='cat', service='Dental Care',
+            preferred_date=self.day, preferred_time=datetime.time(8, 30), assigned_doctor=self.lee,
+            assigned_date=self.day, assigned_time=datetime.time(9, 30), status='confirmed',
+        )
+        self.assertNotIn(datetime.time(9, 30), availability('Dental Care', self.day, self.day)[0]['free'])
+
+    def test_unbookable_slots_are_left_out(self):
+        # a pending request without a vet still owns its preferred slot
+        self.book(datetime.time(9))
+        self.book(datetime.time(9, 30), status='cancelled')
+        bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        hold_slot(bob, self.day, datetime.time(10))
+        hold_slot(self.client_user, self.day, datetime.time(10, 30))
+        expired = hold_slot(User.objects.create_user('carol', 'carol@example.com', 'pw'), self.day, datetime.time(11))
+        SlotHold.objects.filter(pk=expired.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        free = self.free(user=self.client_user)
+        for taken in ('09:00', '09:30', '10:00'):
+            self.assertNotIn(taken, free)
+        self.assertIn('10:30', free)
+        self.assertIn('11:00', free)
+        self.assertNotIn('10:30', self.free(user=bob))
+
+        # everything the API offers can actually be held
+        for at in free:
+            self.assertIsNotNone(hold_slot(self.client_user, self.day, datetime.time.fromisoformat(at)), at)
+
+    def test_api(self):
+        self.book(datetime.time(9), self.jones, status='confirmed')
+        self.client.force_login(self.client_user)
+        url = reverse('availability')
+        response = self.client.get(url, {'service': 'Dental Care', 'start': '2030-01-07', 'end': '2030-01-08'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([day['date'] for day in data['days']], ['2030-01-07', '2030-01-08'])
+        self.assertEqual([vet['name'] for vet in data['days'][0]['vets']], ['Dr. Jones', 'Dr. Lee'])
+        self.assertNotIn('09:00', data['days'][0]['free'])
+        self.assertEqual(len(data['days'][1]['free']), len(SLOT_BITS))
+
+        self.assertEqual(self.client.get(url, {'service': 'Haircuts'}).status_code, 400)
+        for dates in ({'start': '2030-02-30'}, {'start': '2030-01-07', 'end': '2030-13-01'}, {'start': 'soon'}):
+            with self.subTest(dates=dates):
+                self.assertEqual(self.client.get(url, {'service': 'Dental Care', **dates}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'service': 'Dental Care', 'start': '2030-01-07', 'end': '2030-03-07'}).status_code, 400)
+
+
+class AssignmentTests(TestCase):
+    def setUp(self):
+        self.day = datetime.date(2030, 1, 7)
+        self.now = timezone.make_aware(datetime.datetime(2030, 1, 1, 8))
+        self.jones = Vet.objects.create(name='Dr. Jones', specialty='Dental Care', email='j@example.com', phone='1')
+        self.lee = Vet.objects.create(name='Dr. Lee', specialty='Dental Care', email='l@example.com', phone='1')
+
+    def request(self, at, day=None, **fields):
+        return Appointment.objects.create(
+            owner_name='Owner', phone='1', pet_name='Rex', pet_species='dog', service='Dental Care',
+            preferred_date=day or self.day, preferred_time=at, **fields,
+        )
+
+    def assign(self, **kwargs):
+        assigned, unassigned = assign_pending(now=kwargs.pop('now', self.now), **kwargs)
+        return {a.pk: (a.assigned_doctor_id, a.assigned_date, a.assigned_time) for a in assigned}, unassigned
+
+    def test_nearest_free_slot(self):
+        # both vets are busy at 10:00; 9:30 and 10:30 are equally near, the earlier wins
+        for vet, at in ((self.jones, datetime.time(7)), (self.lee, datetime.time(7, 30))):
+            Appointment.objects.filter(pk=self.request(at).pk).update(
+                assigned_doctor=vet, assigned_date=self.day, assigned_time=datetime.time(10), status='confirmed'
+            )
+            rebuild_availability([(vet.pk, self.day)])
+        appointment = self.request(datetime.time(10))
+
+        assigned, unassigned = self.assign()
+        self.assertEqual(unassigned, [])
+        vet_id, day, at = assigned[appointment.pk]
+        self.assertEqual((day, at), (self.day, datetime.time(9, 30)))
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.assigned_time, datetime.time(9, 30))
+        self.assertEqual(VetDaySchedule.objects.get(vet_id=vet_id, date=self.day).booked_mask,
+                         SLOT_BITS[datetime.time(9, 30)] | SLOT_BITS[datetime.time(10)])
+
+    def test_load_is_spread_across_vets(self):
+        # Dr. Jones already has two bookings that day
+        for at in (datetime.time(15), datetime.time(15, 30)):
+            self.request(at, assigned_doctor=self.jones, assigned_date=self.day, assigned_time=at, status='confirmed')
+        requests = [self.request(datetime.time(9, 30 * i)) for i in range(2)] + [self.request(datetime.time(10))]
+
+        assigned, unassigned = self.assign()
+        self.assertEqual(unassigned, [])
+        vets = [assigned[a.pk][0] for a in requests]
+        self.assertEqual(vets, [self.lee.pk, self.lee.pk, self.jones.pk])
+        self.assertEqual([assigned[a.pk][2] for a in requests], [a.preferred_time for a in requests])
+
+    def test_no_slot_is_given_twice_in_one_run(self):
+        self.lee.delete()
+        requests = [self.request(slot) for slot in DAILY_SLOTS]
+        requests += [self.request(datetime.time(17, 30)), self.request(datetime.time(9), day=self.day + timedelta(days=1))]
+
+        assigned, unassigned = self.assign(search_days=1)
+        self.assertEqual(unassigned, [])
+        self.assertEqual(len(set(assigned.values())), len(requests))
+        # the day is full, so the late request moves to the next day, next to the one already there
+        self.assertEqual(assigned[requests[-2].pk][1:], (self.day + timedelta(days=1), datetime.time(16, 30)))
+        self.assertEqual(assigned[requests[-1].pk][1:], (self.day + timedelta(days=1), datetime.time(9)))
+
+        more = self.request(datetime.time(12, 15))
+        assigned, unassigned = self.assign(search_days=0)
+        self.assertEqual(assigned, {})
+        self.assertEqual(unassigned, [more])
+
+    def test_slots_that_have_started_are_skipped(self):
+        now = timezone.make_aware(datetime.datetime.combine(self.day, datetime.time(11, 10)))
+        today = self.request(datetime.time(9))
+        overdue = self.request(datetime.time(12), day=self.day - timedelta(days=2))
+
+        assigned, unassigned = self.assign(now=now)
+        self.assertEqual(unassigned, [])
+        self.assertEqual(assigned[today.pk][1:], (self.day, datetime.time(11, 30)))
+        self.assertEqual(assigned[overdue.pk][1:], (self.day, datetime.time(12)))
+
+        late = self.request(datetime.time(12), day=self.day - timedelta(days=1))
+        assigned, unassigned = self.assign(now=now.replace(hour=17), search_days=0)
+        self.assertEqual(assigned, {})
+        self.assertEqual(unassigned, [late])
+
+
+@override_settings(ADMIN_LARGE_TABLE_ROWS=1000, ADMIN_COUNT_LIMIT=3)
+class AdminLargeTableTests(TestCase):
+    ESTIMATE_KEY = f'admin-row-estimate:default:{Appointment._meta.db_table}'
+
+    def setUp(self):
+        cache.clear()
+        for hour in range(9, 14):
+            Appointment.objects.create(
+                owner_name='Owner', phone='1', pet_name='Rex', pet_species='dog', service='Dental Care',
+                preferred_date=datetime.date(2030, 1, 7), preferred_time=datetime.time(hour),
+            )
+
+    def test_estimate_comes_from_statistics(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        # the newest row goes, so the highest primary key would say 4
+        Appointment.objects.filter(preferred_time=datetime.time(13)).delete()
+        self.assertEqual(estimate_row_count(Appointment), 5)
+        # cached, so the next pages don't read the statistics again
+        with self.assertNumQueries(0):
+            self.assertEqual(estimate_row_count(Appointment), 5)
+
+    def test_paginator_counts(self):
+        cache.set(self.ESTIMATE_KEY, 50000)
+        with self.assertNumQueries(0):
+            self.assertEqual(EstimatedCountPaginator(Appointment.objects.order_by('pk'), 100).count, 50000)
+        with self.assertNumQueries(1):
+            paginator = EstimatedCountPaginator(Appointment.objects.filter(status='pending').order_by('pk'), 2)
+            self.assertEqual((paginator.count, paginator.num_pages), (3, 2))
+        self.assertEqual(EstimatedCountPaginator(Appointment.objects.filter(pet_name='Tom').order_by('pk'), 2).count, 0)
+
+    def test_admin_switches_at_the_threshold(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        url = reverse('admin:core_appointment_changelist')
+        for estimate, large in ((999, False), (1000, True)):
+            with self.subTest(estimate=estimate):
+                cache.set(self.ESTIMATE_KEY, estimate)
+                changelist = self.client.get(url).context['cl']
+                self.assertEqual(isinstance(changelist.paginator, EstimatedCountPaginator), large)
+                self.assertEqual(changelist.result_count, estimate if large else 5)
+                self.assertEqual(isinstance(changelist.queryset, DateFacetQuerySet), large)
+
+
+class MetricsRenderTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.registry = Registry(self.directory.name, flush_seconds=3600)
+        self.addCleanup(atexit.unregister, self.registry.flush)
+        self.requests = Counter(self.registry, 'app_requests_total', 'Requests.')
+        self.latency = Histogram(self.registry, 'app_latency_seconds', 'Latency.', buckets=(0.1, 1))
+
+    def test_text_format(self):
+        self.requests.inc(view='home')
+        self.requests.inc(2, view='say "hi"\n')
+        self.latency.observe(0.25, view='home')
+        self.latency.observe(0.5, view='home')
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# HELP app_requests_total Requests.',
+            '# TYPE app_requests_total counter',
+            'app_requests_total{view="home"} 1',
+            'app_requests_total{view="say \\"hi\\"\\n"} 2',
+            '# HELP app_latency_seconds Latency.',
+            '# TYPE app_latency_seconds histogram',
+            'app_latency_seconds_bucket{view="home",le="0.1"} 0',
+            'app_latency_seconds_bucket{view="home",le="1"} 2',
+            'app_latency_seconds_bucket{view="home",le="+Inf"} 2',
+            'app_latency_seconds_sum{view="home"} 0.75',
+            'app_latency_seconds_count{view="home"} 2',
+        ]) + '\n')
+
+    def test_other_processes_are_added_in(self):
+        self.requests.inc(view='home')
+        self.registry.flush()
+        Path(self.directory.name, '1.json').write_text(json.dumps([
+            ['app_requests_total', '', [['view', 'home']], 4],
+            ['app_requests_total', '', [['view', 'profile']], 1],
+        ]))
+        Path(self.directory.name, '2.json').write_text('[["app_requests_')
+        self.requests.inc(view='home')
+
+        # this process's file is stale; its live values are used instead
+        self.assertIn('app_requests_total{view="home"} 6\n', self.registry.render())
+        self.assertIn('app_requests_total{view="profile"} 1\n', self.registry.render())
+
+
+class MetricsViewTests(TestCase):
+    def setUp(self):
+        User.objects.create_user('staff', 'staff@example.com', 'pw', is_staff=True)
+        User.objects.create_user('alice', 'alice@example.com', 'pw')
+
+    def basic(self, credentials):
+        return {'HTTP_AUTHORIZATION': 'Basic ' + base64.b64encode(credentials.encode()).decode()}
+
+    def test_staff_only(self):
+        url = reverse('metrics')
+        refused = [{}, self.basic('alice:pw'), self.basic('staff:wrong'), {'HTTP_AUTHORIZATION': 'Basic !!!'},
+                   {'HTTP_AUTHORIZATION': 'Bearer token'}]
+        for headers in refused:
+            with self.subTest(headers=headers):
+                response = self.client.get(url, **headers)
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response['WWW-Authenticate'], 'Basic realm="metrics"')
+
+        self.client.login(username='alice', password='pw')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        response = self.client.get(url, **self.basic('staff:pw'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+
+    def test_requests_are_recorded(self):
+        self.client.get(reverse('home'))
+        text = self.client.get(reverse('metrics'), **self.basic('staff:pw')).content.decode()
+        self.assertIn('# TYPE clinic_http_request_duration_seconds histogram', text)
+        self.assertRegex(text, r'clinic_http_request_duration_seconds_count\{method="GET",status="2xx",view="home"\} \d+')
+        self.assertRegex(text, r'clinic_db_queries_total\{view="home"\} \d+')
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.vet = Vet.objects.create(name='Jones', specialty='Dental Care', email='j@example.com', phone='1')
+
+    def test_hits_skip_the_view(self):
+        url = reverse('ourteam')
+        with self.assertNumQueries(1):
+            first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertTrue(first['ETag'].startswith('W/"'))
+        self.assertEqual(first['Cache-Control'], 'no-cache')
+        self.assertIn('Cookie', first['Vary'])
+        # query strings are not cached
+        with self.assertNumQueries(1):
+            self.client.get(url, {'page': '2'})
+
+    def test_conditional_requests_get_304(self):
+        first = self.client.get(reverse('home'))
+        for headers in ({'HTTP_IF_NONE_MATCH': first['ETag']}, {'HTTP_IF_MODIFIED_SINCE': first['Last-Modified']}):
+            with self.subTest(headers=headers):
+                response = self.client.get(reverse('home'), **headers)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b'')
+                self.assertEqual(response['ETag'], first['ETag'])
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH='W/"stale"').status_code, 200)
+
+    def test_compressed_copies(self):
+        plain = self.client.get(reverse('home'))
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        response = self.client.get(reverse('home'), HTTP_ACCEPT_ENCODING='gzip;q=1.0, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['ETag'], plain['ETag'])
+
+    def test_login_state_is_cached_separately(self):
+        self.assertContains(self.client.get(reverse('home')), 'Login')
+        self.client.force_login(User.objects.create_user('alice', 'alice@example.com', 'pw'))
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Logout')
+        self.assertEqual(response['Cache-Control'], 'no-cache, private')
+
+    def test_vet_changes_invalidate(self):
+        url = reverse('ourteam')
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            lee = Vet.objects.create(name='Lee', specialty='Surgical Procedures', email='l@example.com', phone='1')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Dr. Lee')
+        self.assertNotEqual(response['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lee.specialty = 'Emergency Services'
+            lee.save()
+        self.assertContains(self.client.get(url), 'Emergency Services')
+        with self.captureOnCommitCallbacks(execute=True):
+            lee.delete()
+        self.assertNotContains(self.client.get(url), 'Dr. Lee')
+
+    @override_settings(PAGE_CACHE_SECONDS=0)
+    def test_can_be_turned_off(self):
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse('ourteam'))
+            self.assertFalse(response.has_header('ETag'))
+
+
+class CompressionMiddlewareTests(unittest.TestCase):
+    BODY = b'<p>' + b'Appointments for today. ' * 40 + b'</p>'
+
+    def respond(self, response, **headers):
+        request = RequestFactory().get('/', **headers)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def html(self, body=BODY, **headers):
+        return HttpResponse(body, content_type='text/html; charset=utf-8', **headers)
+
+    def test_accept_encoding(self):
+        self.assertEqual(accepted_encodings(RequestFactory().get('/', HTTP_ACCEPT_ENCODING='GZIP, br;q=0, deflate;q=0.5')),
+                         {'gzip', 'deflate'})
+        for header, encoded in (('gzip, deflate', True), ('gzip;q=0.0', False), ('identity', False), (None, False)):
+            with self.subTest(header=header):
+                headers = {'HTTP_ACCEPT_ENCODING': header} if header else {}
+                response = self.respond(self.html(), **headers)
+                self.assertEqual(response.get('Content-Encoding'), 'gzip' if encoded else None)
+                self.assertEqual(response['Vary'], 'Accept-Encoding')
+                if encoded:
+                    self.assertEqual(gzip.decompress(response.content), self.BODY)
+                    self.assertEqual(int(response['Content-Length']), len(response.content))
+                else:
+                    self.assertEqual(response.content, self.BODY)
+
+    def test_json_and_etags(self):
+        response = self.respond(JsonResponse({'names': ['Amoxicillin'] * 40}, headers={'ETag': '"abc"'}),
+                                HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], 'W/"abc"')
+
+    def test_left_alone(self):
+        small = self.html(b'x' * (MIN_LENGTH - 1))
+        pdf = HttpResponse(self.BODY, content_type='application/pdf')
+        stream = StreamingHttpResponse(iter([self.BODY]), content_type='text/html')
+        encoded = self.html(headers={'Content-Encoding': 'br'})
+        for response in (small, pdf, stream, encoded):
+            with self.subTest(response=response):
+                result = self.respond(response, HTTP_ACCEPT_ENCODING='gzip')
+                self.assertIs(result, response)
+                self.assertNotEqual(result.get('Content-Encoding'), 'gzip')
+                self.assertFalse(result.has_header('Vary'))
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli_is_preferred(self):
+        response = self.respond(self.html(), HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), self.BODY)
+
+
+class StaticAssetStorageTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name)
+        static_settings = override_settings(STATIC_ROOT=self.root, DEBUG=False)
+        static_settings.enable()
+        self.addCleanup(static_settings.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.manifest = json.loads((self.root / 'staticfiles.json').read_text())['paths']
+
+    def test_vet_photos_get_hashed_webp_variants(self):
+        for photo in ('images/vet1.jpg', 'images/vet2.jpg'):
+            self.assertIn(photo, self.manifest)
+            for width in (150, 300, 450):
+                hashed = self.manifest[variant_name(photo, width)]
+                with Image.open(self.root / hashed) as image:
+                    self.assertEqual((image.format, image.width), ('WEBP', width))
+
+    def test_other_images_are_not_resized(self):
+        self.assertIn('images/vetwithpet.jpg', self.manifest)
+        self.assertFalse([name for name in self.manifest if name.startswith('images/vetwithpet.')
+                          and name != 'images/vetwithpet.jpg'])
+        self.assertFalse(list(self.root.glob('images/vetwithpet*.webp')))
+
+    def test_text_assets_get_gzip_siblings(self):
+        for name in ('style.css', 'doctor_dashboard.js'):
+            hashed = self.root / self.manifest[name]
+            self.assertNotEqual(self.manifest[name], name)
+            self.assertEqual(gzip.decompress((hashed.parent / (hashed.name + '.gz')).read_bytes()),
+                             hashed.read_bytes())
+        self.assertFalse(list(self.root.glob('images/*.gz')))
+
+    def test_srcset_lists_hashed_variants(self):
+        html = Template(
+            '{% load static_images %}{% static_srcset "images/vet1.jpg" "150px" %}'
+        ).render(Context())
+        srcset = ', '.join(
+            f'/static/{self.manifest[variant_name("images/vet1.jpg", width)]} {width}w'
+            for width in (150, 300, 450)
+        )
+        self.assertEqual(html, f'srcset="{srcset}" sizes="150px"')
+        self.assertEqual(Template(
+            '{% load static_images %}{% static_srcset "images/vetwithpet.jpg" "150px" %}'
+        ).render(Context()), '')
+
+
+class SqliteProfileTests(unittest.TestCase):
+    def open(self, path):
+        raw = sqlite3.connect(path)
+        self.addCleanup(raw.close)
+        configure_connection(None, SimpleNamespace(vendor='sqlite', connection=raw, settings_dict={'NAME': path}))
+        return raw
+
+    def test_databases_run_in_wal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            raw = self.open(Path(directory, 'clinic.sqlite3'))
+            self.assertEqual(raw.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(raw.execute('PRAGMA synchronous').fetchone()[0], 1)  # NORMAL
+            self.assertEqual(raw.execute('PRAGMA busy_timeout').fetchone()[0], 20000)
+
+    def test_kept_journal_mode_runs_with_full_sync(self):
+        with tempfile.TemporaryDirectory() as directory:
+            kept = Path(directory, 'kept.sqlite3')
+            with override_settings(SQLITE_KEEP_JOURNAL_MODE=[kept]):
+                raw = self.open(kept)
+            self.assertEqual(raw.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+            self.assertEqual(raw.execute('PRAGMA synchronous').fetchone()[0], 2)  # FULL
+            self.assertEqual(raw.execute('PRAGMA busy_timeout').fetchone()[0], 20000)
+            raw.close()
+            self.assertFalse(Path(directory, 'kept.sqlite3-wal').exists())
+
+    def test_checked_in_database_is_in_wal(self):
+        path = Path(settings.BASE_DIR, 'db.sqlite3')
+        with path.open('rb') as f:
+            header = f.read(20)
+        # file format read/write versions: 2 = WAL, 1 = rollback journal
+        self.assertEqual(header[18:20], b'\x02\x02')
+
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'BEGIN IMMEDIATE is SQLite-specific')
+class WriteTransactionTests(TransactionTestCase):
+    def other_writer(self):
+        raw = sqlite3.connect(connection.settings_dict['NAME'], timeout=0)
+        self.addCleanup(raw.close)
+        return raw
+
+    def test_only_write_transactions_take_the_lock_up_front(self):
+        with CaptureQueriesContext(connection) as queries, transaction.atomic():
+            Vet.objects.count()
+            # a read-only transaction leaves the lock free for bookings
+            other = self.other_writer()
+            other.execute('BEGIN IMMEDIATE')
+            other.rollback()
+        self.assertEqual(queries[0]['sql'], 'BEGIN')
+
+        with CaptureQueriesContext(connection) as queries, write_transaction():
+            with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+                self.other_writer().execute('BEGIN IMMEDIATE')
+            # nested, it is a savepoint in the same transaction
+            with write_transaction():
+                Vet.objects.count()
+        self.assertEqual(queries[0]['sql'], 'BEGIN IMMEDIATE')
+        self.assertTrue(queries[1]['sql'].startswith('SAVEPOINT'))
+        self.assertIsNone(connection.transaction_mode)
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.vet = Vet.objects.create(name='Dr. Jones', specialty='Dental Care', email='j@example.com', phone='1')
+        self.treated = Appointment.objects.create(
+            owner_name='Smith, Jane', phone='1', email='jane@example.com', pet_name='Rex', pet_species='dog',
+            service='Dental Care', preferred_date=datetime.date(2030, 1, 6), preferred_time=datetime.time(9),
+            assigned_doctor=self.vet, assigned_date=datetime.date(2030, 1, 7), assigned_time=datetime.time(9, 30),
+            status='confirmed', payment_amount='45.50',
+        )
+        self.treated.set_prescription(chief_complaint='Bad breath', diagnosis='Tartar',
+                                      medications='1. Carprofen 25mg\nSig: 1 tablet daily\n2. Ear cleaner',
+                                      follow_up='2 weeks')
+        self.treated.save()
+        self.treated.sync_medication_lines()
+        self.waiting = Appointment.objects.create(
+            owner_name='Owner', phone='1', pet_name='Tom', pet_species='cat', service='Preventive Care',
+            preferred_date=datetime.date(2030, 1, 8), preferred_time=datetime.time(10),
+        )
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+
+    def export(self, action, *appointments):
+        response = self.client.post(reverse('admin:core_appointment_changelist'), {
+            'action': action, '_selected_action': [a.pk for a in appointments],
+        })
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_appointments_csv(self):
+        rows = list(csv.reader(io.StringIO(self.export('export_as_csv', self.treated, self.waiting))))
+        self.assertEqual(rows, [
+            ['ID', 'Owner', 'Pet', 'Date', 'Time', 'Service', 'Doctor', 'Status'],
+            [self.treated.appointment_id, 'Smith, Jane', 'Rex', '2030-01-07', '09:30', 'Dental Care', 'Dr. Jones',
+             'Confirmed'],
+            [self.waiting.appointment_id, 'Owner', 'Tom', '', '', 'Preventive Care', '', 'Pending Confirmation'],
+        ])
+
+    def test_prescriptions_csv(self):
+        rows = list(csv.reader(io.StringIO(self.export('export_prescriptions_csv', self.treated, self.waiting))))
+        self.assertEqual(rows, [
+            PRESCRIPTION_CSV_HEADER,
+            [self.treated.appointment_id, '2030-01-07', 'Smith, Jane', 'Rex', 'Dr. Jones', 'Bad breath', 'Tartar',
+             'Carprofen 25mg; Ear cleaner', '', '2 weeks'],
+        ])
+
+    def test_appointments_jsonl(self):
+        lines = self.export('export_as_jsonl', self.treated, self.waiting).splitlines()
+        treated, waiting = map(json.loads, lines)
+        self.assertEqual(set(treated), set(APPOINTMENT_JSONL_FIELDS) - {'assigned_doctor__name'} | {'assigned_doctor_name'})
+        self.assertEqual(
+            {key: treated[key] for key in ('appointment_id', 'owner_name', 'assigned_date', 'assigned_time',
+                                           'assigned_doctor_id', 'assigned_doctor_name', 'payment_amount', 'diagnosis')},
+            {'appointment_id': self.treated.appointment_id, 'owner_name': 'Smith, Jane', 'assigned_date': '2030-01-07',
+             'assigned_time': '09:30:00', 'assigned_doctor_id': self.vet.pk, 'assigned_doctor_name': 'Dr. Jones',
+             'payment_amount': '45.50', 'diagnosis': 'Tartar'},
+        )
+        self.assertEqual((waiting['assigned_date'], waiting['assigned_doctor_name']), (None, None))
+
+    def test_empty_querysets(self):
+        none = Appointment.objects.none()
+        self.assertEqual(list(stream_csv(APPOINTMENT_CSV_HEADER, appointment_csv_rows(none))),
+                         ['ID,Owner,Pet,Date,Time,Service,Doctor,Status\r\n'])
+        self.assertEqual(list(stream_jsonl(appointment_jsonl_rows(none))), [])
+        # nothing selected has a prescription
+        self.assertEqual(list(csv.reader(io.StringIO(self.export('export_prescriptions_csv', self.waiting)))),
+                         [PRESCRIPTION_CSV_HEADER])
+
+
+class LoadTestReportTests(unittest.TestCase):
+    def row(self, p50=100.0, p95=200.0, requests=TAIL_SAMPLES, rps=10.0, errors=0):
+        return {'requests': requests, 'rps': rps, 'p50': p50, 'p95': p95, 'p99': p95, 'max': p95, 'errors': errors}
+
+    def problems(self, current, base=None, name='home'):
+        (row,) = compare({name: current}, {name: base or self.row()}, 0.25)
+        return row[4]
+
+    def test_personas_split_by_largest_remainder(self):
+        mix = {'browser': 6, 'client': 3, 'vet': 2, 'staff': 1}
+        counts = lambda users: {name: [p.name for p in personas_for(users, mix)].count(name) for name in mix}
+        self.assertEqual(counts(10), {'browser': 5, 'client': 2, 'vet': 2, 'staff': 1})
+        self.assertEqual(counts(12), {'browser': 6, 'client': 3, 'vet': 2, 'staff': 1})
+        # rounding each share would make 4 users here
+        even = {'browser': 1, 'client': 1, 'vet': 1, 'staff': 1}
+        self.assertEqual(len(personas_for(3, even)), 3)
+        self.assertEqual({p.name for p in personas_for(2, {'vet': 1, 'staff': 0})}, {'vet'})
+
+    def test_summarise(self):
+        recorder = Recorder()
+        recorder.measure_from = 0
+        self.assertEqual(summarise(recorder, 10)['total']['requests'], 0)
+        self.assertEqual(summarise(recorder, 10)['total']['max'], 0)
+
+        recorder.record('home', 1, 0.05, ok=False)
+        results = summarise(recorder, 10)
+        for name in ('home', 'total'):
+            self.assertEqual(results[name]['requests'], 1)
+            self.assertEqual(results[name]['errors'], 1)
+            self.assertAlmostEqual(results[name]['rps'], 0.1)
+            for key in ('p50', 'p95', 'p99', 'max'):
+                self.assertAlmostEqual(results[name][key], 50)
+
+        recorder.record('home', 1, 0.01, ok=True)
+        recorder.record('search', 1, 0.03, ok=True)
+        results = summarise(recorder, 10)
+        self.assertAlmostEqual(results['home']['p50'], 30)
+        self.assertEqual(results['total']['requests'], 3)
+        self.assertAlmostEqual(results['total']['p50'], 30)
+
+    def test_empty_summary_compares_without_problems(self):
+        empty = summarise(Recorder(), 10)
+        # no samples: the percentiles are NaN, which never counts as slower
+        (row,) = compare(empty, empty, 0.25)
+        self.assertEqual((row[0], row[3], row[4]), ('total', 0.0, []))
+
+    def test_flags_slower_medians_beyond_noise(self):
+        self.assertEqual(self.problems(self.row(p50=150)), ['p50 +50%'])
+        # 50% slower, but under NOISE_MS
+        base = self.row(p50=2, p95=4)
+        self.assertEqual(self.problems(self.row(p50=3, p95=6), base), [])
+        self.assertEqual(self.problems(self.row(p50=2 + NOISE_MS * 2, p95=4), base), ['p50 +500%'])
+        # beyond NOISE_MS, within tolerance
+        self.assertEqual(self.problems(self.row(p50=120, p95=240)), [])
+
+    def test_tail_needs_enough_samples(self):
+        self.assertEqual(self.problems(self.row(p95=400)), ['p95 +100%'])
+        few = TAIL_SAMPLES - 1
+        self.assertEqual(self.problems(self.row(p95=400, requests=few)), [])
+        self.assertEqual(self.problems(self.row(p95=400), self.row(requests=few)), [])
+
+    def test_flags_new_errors(self):
+        self.assertEqual(self.problems(self.row(errors=3)), ['3 errors'])
+        self.assertEqual(self.problems(self.row(errors=3), self.row(errors=1)), [])
+
+    def test_flags_throughput_drop_on_total_only(self):
+        self.assertEqual(self.problems(self.row(rps=5), name='total'), ['throughput -50%'])
+        self.assertEqual(self.problems(self.row(rps=5)), [])
+        self.assertEqual(self.problems(self.row(rps=9), name='total'), [])
+
+    def test_missing_requests_are_reported(self):
+        self.assertEqual(compare({}, {'home': self.row()}, 0.25), [('home', None, None, None, ['not run'])])
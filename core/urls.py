@@ -17,10 +17,17 @@ urlpatterns = [
     path('profile/', views.profile_view, name='profile'),
     path('appt/', views.appointment_view, name='appt'),
     path('ourteam/', views.our_team_view, name='ourteam'),
+    path('availability/', views.availability_view, name='availability'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('reports/', views.reports_view, name='reports'),
+    path('appointment/hold/', views.hold_slot_view, name='hold_slot'),
     path('receipt/<str:appointment_id>/', views.receipt_view, name='receipt'),
     path('doctor-dashboard/', views.doctor_dashboard, name='doctor_dashboard'),
+    path('doctor-dashboard/events/', views.doctor_events, name='doctor_events'),
     path('doctor/save-prescription/<str:appointment_id>/', views.save_prescription, name='save_prescription'),
     path('doctor/prescription-data/<str:appointment_id>/', views.get_prescription_data, name='get_prescription_data'),
+    path('doctor/prescription-catalogue/', views.get_prescription_data, name='prescription_catalogue'),
+    path('doctor/medications/search/', views.search_medications, name='search_medications'),
     path('prescription-pdf/<str:appointment_id>/', views.prescription_pdf_view, name='prescription_pdf'),
     path('doctor/get-existing-prescription/<str:appointment_id>/', views.get_existing_prescription, name='get_existing_prescription'),
     path('prescription-pdf/<str:appointment_id>/', views.prescription_pdf_view, name='prescription_pdf'),
@@ -1,4 +1,5 @@
 # utils.py or somewhere reusable
+import re
 from datetime import time, timedelta, datetime
 
 def generate_daily_slots():
@@ -10,3 +11,70 @@ def generate_daily_slots():
     return slots
 
 DAILY_SLOTS = generate_daily_slots()
+
+
+# Appointment field -> header used in the printable prescription text
+PRESCRIPTION_SECTIONS = {
+    'chief_complaint': 'CHIEF COMPLAINT',
+    'diagnosis': 'DIAGNOSIS',
+    'medications': 'PRESCRIPTION (Rx)',
+    'instructions': 'INSTRUCTIONS',
+    'follow_up': 'FOLLOW-UP',
+}
+
+
+def compose_prescription(sections):
+    return "\n\n".join(
+        f"{header}:\n{sections[field]}"
+        for field, header in PRESCRIPTION_SECTIONS.items()
+        if sections.get(field)
+    )
+
+
+def split_prescription(text):
+    """Parse the old packed prescription text back into its sections."""
+    sections = dict.fromkeys(PRESCRIPTION_SECTIONS, '')
+    current = None
+    for part in text.replace('\r\n', '\n').split('\n\n'):
+        for field, header in PRESCRIPTION_SECTIONS.items():
+            if part.startswith(f"{header}:"):
+                current = field
+                sections[field] = part.replace(f"{header}:\n", '', 1)
+                break
+        else:
+            # a blank line inside a section, e.g. between two medications
+            if current:
+                sections[current] += '\n\n' + part
+    return sections
+
+
+MEDICATION_ITEM_RE = re.compile(r'^\d+\.\s*(.+)$')
+STRENGTH_RE = re.compile(r'\s(\d[\d.,]*\s?(?:mg|mcg|g|ml|U|IU|%)(?:/\w+)?)(?=\s|$)', re.IGNORECASE)
+
+
+def parse_medication_lines(text):
+    """
+    Split an Rx section into medication lines.
+
+    Numbered lines ("1. Amoxicillin 250mg") start a medication and the lines
+    under them ("Sig: ...") become its directions.
+    """
+    lines = []
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        item = MEDICATION_ITEM_RE.match(line)
+        if item or not lines:
+            head = item.group(1) if item else line
+            strength = STRENGTH_RE.search(' ' + head)
+            if strength:
+                drug_name = head[:strength.start()].strip() or head
+                strength = strength.group(1)
+            else:
+                drug_name, strength = head, ''
+            lines.append({'drug_name': drug_name[:100], 'strength': strength[:30], 'sig': ''})
+        else:
+            sig = line[4:].strip() if line.lower().startswith('sig:') else line
+            lines[-1]['sig'] = f"{lines[-1]['sig']}\n{sig}".strip()
+    return lines
@@ -5,188 +5,78 @@ from django.contrib.auth.models import User
 from django.contrib import messages
 from .models import Appointment, Vet
 from datetime import datetime, date, timedelta
-import uuid
 from django.contrib.admin.views.decorators import staff_member_required
-from django.core.mail import send_mail
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
+from .outbox import queue_email
+from . import metrics
+from django.views.decorators.http import require_POST, condition
+import asyncio
+import base64
+import binascii
 import io
-from django.http import JsonResponse, FileResponse 
+import json
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, FileResponse, HttpResponse, StreamingHttpResponse
+from .pdf import pdf_cache, prescription_pdf_inputs
+from .catalogue import CATALOGUE_JSON, CATALOGUE_VERSION
+from .medsearch import medication_index
+from .availability import availability
+from .holds import confirm_hold, hold_seconds, hold_slot
+from .schedule import doctor_schedule
+from .events import broker
+from .pagecache import cached_page
+from .writes import WriteQueueTimeout, run_write
+from .rollups import report
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
+
+def _parse(parser, value):
+    """
+    parse_date/parse_time/parse_datetime that also returns None for well-formed
+    but impossible values such as 2030-02-30 or 25:00, which raise ValueError.
+    """
+    try:
+        return parser(value or '')
+    except ValueError:
+        return None
+
 
 @staff_member_required
 def prescription_pdf_view(request, appointment_id):
-    appointment = get_object_or_404(Appointment, appointment_id=appointment_id)
-    buffer = io.BytesIO()
-
-    p = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    
-    #clinic header
-    p.setFont("Helvetica-Bold", 16)
-    p.drawString(100, height - 100, "Crescent Veterinary Clinic")
-    p.setFont("Helvetica", 10)
-    p.drawString(100, height - 120, "Professional Veterinary Services")
-    p.drawString(100, height - 140, "Phone: +8801111111111 | Email: info@crescentvet.com")
-    
-    
-    #patient info
-    p.setFont("Helvetica-Bold", 14)
-    p.drawString(100, height - 180, "PATIENT INFORMATION")
-    p.line(100, height - 185, 500, height - 185)
-    
-    p.setFont("Helvetica", 10)
-    y_position = height - 210
-    p.drawString(100, y_position, f"Pet Name: {appointment.pet_name}")
-    p.drawString(300, y_position, f"Species: {appointment.get_pet_species_display()}")
-    
-    y_position -= 20
-    p.drawString(100, y_position, f"Owner: {appointment.owner_name}")
-    p.drawString(300, y_position, f"Phone: {appointment.phone}")
-    
-    y_position -= 20
-    p.drawString(100, y_position, f"Service: {appointment.service}")
-    p.drawString(300, y_position, f"Appointment ID: {appointment.appointment_id}")
-    
-    # Prescription
-    if appointment.prescription:
-        y_position -= 40
-        p.setFont("Helvetica-Bold", 14)
-        p.drawString(100, y_position, "PRESCRIPTION")
-        p.line(100, y_position - 5, 500, y_position - 5)
-        
-        p.setFont("Helvetica", 10)
-        y_position -= 30
-
-        lines = appointment.prescription.split('\n')
-        for line in lines:
-            if y_position < 100: 
-                p.showPage()
-                p.setFont("Helvetica", 10)
-                y_position = height - 100
-            
-            p.drawString(100, y_position, line)
-            y_position -= 15
-            
-            
-    if appointment.assigned_doctor:
-
-        y_position -= 100 
-        p.drawString(100, y_position, f"Dr. {appointment.assigned_doctor.name}")    
-        y_position -= 15  
-        p.line(100, y_position, 250, y_position)  
-        y_position -= 15
-        p.drawString(100, y_position, "Signature")
-
-    
-    p.drawString(400, y_position - 20, f"Date: {appointment.assigned_date.strftime('%B %d, %Y') if appointment.assigned_date else 'N/A'}")
-    p.showPage()
-    p.save()
-    buffer.seek(0)
-    return FileResponse(buffer, as_attachment=False, filename=f"prescription_{appointment_id}.pdf")
-
-@login_required
-def doctor_dashboard(request):
-    if not hasattr(request.user, 'vet'):
-        messages.error(request, "Access denied. You are not authorized to view this page.")
-        return redirect('home')
-    
-    doctor = request.user.vet
-    today = date.today()
-    
-    todays_appointments = Appointment.objects.filter(
-        assigned_doctor=doctor,
-        assigned_date=today,
-        status="confirmed"
-    ).order_by('assigned_time')
-    
-
-    upcoming_appointments = Appointment.objects.filter(
-        assigned_doctor=doctor,
-        assigned_date__gt=today,
-        assigned_date__lte=today + timedelta(days=7),
-        status="confirmed"
-    ).order_by('assigned_date', 'assigned_time')
-    
-    context = {
-        'doctor': doctor,
-        'today': today,
-        'todays_appointments': todays_appointments,
-        'upcoming_appointments': upcoming_appointments,
-    }
-    
-    return render(request, 'doctor_dashboard.html', context)
-
+    appointment = get_object_or_404(
+        Appointment.objects.select_related('assigned_doctor'), appointment_id=appointment_id
+    )
+    pdf = pdf_cache.get_or_render(prescription_pdf_inputs(appointment))
+    return FileResponse(io.BytesIO(pdf), as_attachment=False, filename=f"prescription_{appointment_id}.pdf")
 
-@login_required
-@require_POST
-def save_prescription(request, appointment_id):
-    if not hasattr(request.user, 'vet'):
-        return JsonResponse({'success': False, 'error': 'Unauthorized'})
-    
-    appointment = get_object_or_404(Appointment, appointment_id=appointment_id)
-    
-    if appointment.assigned_doctor != request.user.vet:
-        return JsonResponse({'success': False, 'error': 'Not your appointment'})
-    
-    chief_complaint = request.POST.get('chief_complaint', '').strip()
-    diagnosis = request.POST.get('diagnosis', '').strip()
-    medications = request.POST.get('medications', '').strip()
-    instructions = request.POST.get('instructions', '').strip()
-    follow_up = request.POST.get('follow_up', '').strip()
-    mark_complete = request.POST.get('mark_complete', 'false') == 'true'
-    
-    prescription_parts = []
-    
-    if chief_complaint:
-        prescription_parts.append(f"CHIEF COMPLAINT:\n{chief_complaint}")
-    
-    if diagnosis:
-        prescription_parts.append(f"DIAGNOSIS:\n{diagnosis}")
-    
-    if medications:
-        prescription_parts.append(f"PRESCRIPTION (Rx):\n{medications}")
-    
-    if instructions:
-        prescription_parts.append(f"INSTRUCTIONS:\n{instructions}")
-    
-    if follow_up:
-        prescription_parts.append(f"FOLLOW-UP:\n{follow_up}")
-    
-    full_prescription = "\n\n".join(prescription_parts)
-    
-    appointment.prescription = full_prescription
-    
-    # Update completion status if requested
-    if mark_complete:
-        appointment.completion_status = 'complete'
-        appointment.status = 'completed'
-    
-    appointment.save()
-    
-    return JsonResponse({'success': True, 'message': 'Prescription saved successfully'})
+@cached_page
 def home(request):
     return render(request, 'index.html')
 
+@cached_page
 def services(request):
     return render(request, 'services.html')
 
+@cached_page
 def prevcare(request):
     return render(request, 'prevcare.html')
 
+@cached_page
 def surg(request):
     return render(request, 'surg.html')
 
+@cached_page
 def dent(request):
     return render(request, 'dent.html')
 
+@cached_page
 def diag(request):
     return render(request, 'diag.html')
 
+@cached_page
 def emer(request):
     return render(request, 'emer.html')
 
+@cached_page
 def nutri(request):
     return render(request, 'nutri.html')
 
@@ -256,33 +146,76 @@ def appointment_view(request):
         pet_age = request.POST.get('pet_age', '')
         pet_weight = request.POST.get('pet_weight', '')
         service = request.POST.get('service')
-        preferred_date = request.POST.get('appointment_date')
-        preferred_time = request.POST.get('appointment_time')
+        preferred_date = _parse(parse_date, request.POST.get('appointment_date'))
+        preferred_time = _parse(parse_time, request.POST.get('appointment_time'))
         reason = request.POST.get('reason')
-        appointment_id = str(uuid.uuid4())[:8].upper()
-
-        Appointment.objects.create(
-            appointment_id=appointment_id,
-            owner_name=owner_name,
-            phone=phone,
-            email=email,
-            pet_name=pet_name,
-            pet_species=pet_species,
-            pet_age=pet_age,
-            pet_weight=pet_weight,
-            service=service,
-            preferred_date=preferred_date,
-            preferred_time=preferred_time,
-            reason=reason,
-        )
+        if not preferred_date or not preferred_time:
+            return render(request, 'appt.html', {
+                'today_date': datetime.today(),
+                'hold_seconds': hold_seconds(),
+                'error': 'Please choose a valid date and time.',
+            }, status=400)
+        if service not in dict(Appointment.SERVICE_CHOICES):
+            return render(request, 'appt.html', {
+                'today_date': datetime.today(),
+                'hold_seconds': hold_seconds(),
+                'error': 'Please choose one of our services.',
+            }, status=400)
+
+        try:
+            appointment = run_write(
+                confirm_hold,
+                request.user,
+                preferred_date,
+                preferred_time,
+                owner=request.user,
+                owner_name=owner_name,
+                phone=phone,
+                email=email,
+                pet_name=pet_name,
+                pet_species=pet_species,
+                pet_age=pet_age,
+                pet_weight=pet_weight,
+                service=service,
+                reason=reason,
+            )
+        except WriteQueueTimeout:
+            return render(request, 'appt.html', {
+                'today_date': datetime.today(),
+                'hold_seconds': hold_seconds(),
+                'error': 'We are very busy right now and could not book your appointment. '
+                         'Nothing was saved; please try again in a moment.',
+            }, status=503)
+        if appointment is None:
+            return render(request, 'appt.html', {
+                'today_date': datetime.today(),
+                'hold_seconds': hold_seconds(),
+                'error': 'Sorry, that time was just booked by someone else. Please pick another slot.',
+            }, status=409)
         return redirect('profile')
 
     context = {
         'today_date': datetime.today(),
+        'hold_seconds': hold_seconds(),
     }
     return render(request, 'appt.html', context)
 
 
+@login_required
+@require_POST
+def hold_slot_view(request):
+    """Hold the posted appointment_date/appointment_time for the current user."""
+    day = _parse(parse_date, request.POST.get('appointment_date'))
+    at = _parse(parse_time, request.POST.get('appointment_time'))
+    if not day or not at:
+        return JsonResponse({'error': 'Invalid date or time'}, status=400)
+
+    hold = hold_slot(request.user, day, at)
+    if hold is None:
+        return JsonResponse({'error': 'That time is no longer available'}, status=409)
+    return JsonResponse({'held': True, 'expires_at': hold.expires_at})
+
+
 def logout_view(request):
     logout(request)
     return redirect('home')
@@ -293,29 +226,113 @@ def appt(request):
     return render(request, 'appt.html', {'today_date': datetime.today()})
 
 
+def _history_cursor(appointment):
+    return f"{appointment.preferred_date.isoformat()}T{appointment.preferred_time.isoformat()}"
+
+
+def _parse_history_cursor(value):
+    moment = _parse(parse_datetime, value)
+    return (moment.date(), moment.time()) if moment else None
+
+
 @login_required
 def profile_view(request):
+    """
+    The client's appointment history, newest first, paged by keyset.
+
+    Pages are keyed on (preferred_date, preferred_time), which is unique and
+    never null, so ?before=/?after= cursors seek straight into
+    appt_owner_history_idx and every page costs the same.
+    """
     user = request.user
-    appointments = Appointment.objects.filter(email=user.email).order_by('-assigned_date', '-assigned_time', '-preferred_date', '-preferred_time')
+    page_size = getattr(settings, 'PROFILE_HISTORY_PAGE_SIZE', 20)
+    history = Appointment.objects.filter(owner=user).select_related('assigned_doctor')
+    before = _parse_history_cursor(request.GET.get('before'))
+    after = _parse_history_cursor(request.GET.get('after'))
+
+    if after:
+        day, at = after
+        rows = list(
+            history.filter(preferred_date__gte=day).exclude(preferred_date=day, preferred_time__lte=at)
+            .order_by('preferred_date', 'preferred_time')[:page_size + 1]
+        )
+        has_newer, has_older = len(rows) > page_size, True
+        appointments = rows[:page_size][::-1]
+    else:
+        if before:
+            day, at = before
+            history = history.filter(preferred_date__lte=day).exclude(preferred_date=day, preferred_time__gte=at)
+        rows = list(history.order_by('-preferred_date', '-preferred_time')[:page_size + 1])
+        has_newer, has_older = before is not None, len(rows) > page_size
+        appointments = rows[:page_size]
 
-    
     return render(request, 'profile.html', {
         'appointments': appointments,
         'user': user,
+        'newer_cursor': _history_cursor(appointments[0]) if has_newer and appointments else None,
+        'older_cursor': _history_cursor(appointments[-1]) if has_older and appointments else None,
     })
 
 
+@cached_page
 def our_team_view(request):
     doctors = Vet.objects.all()
     return render(request, 'ourteam.html', {'doctors': doctors})
 
 
+@login_required
+def availability_view(request):
+    """Free slots for a service: ?service=Dental Care&start=YYYY-MM-DD&end=YYYY-MM-DD"""
+    service = request.GET.get('service', '')
+    start = _parse(parse_date, request.GET.get('start'))
+    end = _parse(parse_date, request.GET.get('end'))
+
+    if service not in dict(Appointment.SERVICE_CHOICES):
+        return JsonResponse({'error': 'Unknown service'}, status=400)
+    if (request.GET.get('start') and not start) or (request.GET.get('end') and not end):
+        return JsonResponse({'error': 'Dates must be real days in YYYY-MM-DD form'}, status=400)
+    start = start or date.today()
+    end = end or start
+    if end < start or (end - start).days > 31:
+        return JsonResponse({'error': 'Date range must be 0-31 days'}, status=400)
+
+    days = availability(service, start, end, request.user)
+    return JsonResponse({
+        'service': service,
+        'days': [
+            {
+                'date': day['date'].isoformat(),
+                'free': [slot.strftime('%H:%M') for slot in day['free']],
+                'vets': [
+                    {'id': vet['id'], 'name': vet['name'], 'free': [slot.strftime('%H:%M') for slot in vet['free']]}
+                    for vet in day['vets']
+                ],
+            }
+            for day in days
+        ],
+    })
+
+
 @staff_member_required
 def receipt_view(request, appointment_id):
     appointment = get_object_or_404(Appointment, appointment_id=appointment_id)
     return render(request, 'receipt.html', {'appointment': appointment})
 
 
+@staff_member_required
+def reports_view(request):
+    """Revenue and utilisation from the daily rollups: ?start=YYYY-MM-DD&end=YYYY-MM-DD"""
+    end = _parse(parse_date, request.GET.get('end'))
+    start = _parse(parse_date, request.GET.get('start'))
+    if (request.GET.get('end') and not end) or (request.GET.get('start') and not start):
+        return HttpResponse('Date range must be 0-366 days', status=400)
+    end = end or date.today()
+    start = start or end - timedelta(days=29)
+    if end < start or (end - start).days > 366:
+        return HttpResponse('Date range must be 0-366 days', status=400)
+    return render(request, 'reports.html', {'report': report(start, end)})
+
+
 @login_required
 def doctor_dashboard(request):
 
@@ -325,32 +342,60 @@ def doctor_dashboard(request):
     
     doctor = request.user.vet
     today = date.today()
-    
-        
-    todays_appointments = Appointment.objects.filter(
-        assigned_doctor=doctor,
-        assigned_date=today,
-        status='confirmed'
-    ).order_by('assigned_time')
-    
-
-    upcoming_appointments = Appointment.objects.filter(
-        assigned_doctor=doctor,
-        assigned_date__gt=today,
-        assigned_date__lte=today + timedelta(days=7),
-        status='confirmed'
-    ).order_by('assigned_date', 'assigned_time')
+    todays_appointments, upcoming_appointments = doctor_schedule(doctor.pk, today)
     
     context = {
         'doctor': doctor,
         'today': today,
         'todays_appointments': todays_appointments,
         'upcoming_appointments': upcoming_appointments,
+        'catalogue_version': CATALOGUE_VERSION,
+        # the event stream only works under ASGI; under WSGI each one would hold a worker
+        'live_updates': isinstance(request, ASGIRequest),
     }
     
     return render(request, 'doctor_dashboard.html', context)
 
 
+@login_required
+async def doctor_events(request):
+    """
+    Server-sent events telling the logged-in vet's dashboard to refresh.
+
+    Needs the ASGI server. Under WSGI the stream would tie up a worker thread
+    per open dashboard, so it answers 204, which tells EventSource to stop
+    reconnecting.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    user = await request.auser()
+    vet = await Vet.objects.filter(user=user).afirst()
+    if vet is None:
+        return JsonResponse({'error': 'Access denied'}, status=403)
+
+    keepalive = getattr(settings, 'DASHBOARD_EVENTS_KEEPALIVE_SECONDS', 15)
+
+    async def stream():
+        queue = broker.subscribe(vet.pk)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    # keeps proxies from closing an idle connection
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(vet.pk, queue)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required
 @require_POST
 def save_prescription(request, appointment_id):
@@ -359,36 +404,27 @@ def save_prescription(request, appointment_id):
     
     appointment = get_object_or_404(Appointment, appointment_id=appointment_id)
     
-    if appointment.assigned_doctor != request.user.vet:
+    if appointment.assigned_doctor_id != request.user.vet.pk:
         return JsonResponse({'success': False, 'error': 'Not your appointment'})
     
-    chief_complaint = request.POST.get('chief_complaint', '').strip()
-    diagnosis = request.POST.get('diagnosis', '').strip()
-    medications = request.POST.get('medications', '').strip()
-    instructions = request.POST.get('instructions', '').strip()
-    follow_up = request.POST.get('follow_up', '').strip()
     mark_complete = request.POST.get('mark_complete') == 'true'  # Fix this line
-    
-    prescription_parts = []
-    
-    if chief_complaint:
-        prescription_parts.append(f"CHIEF COMPLAINT:\n{chief_complaint}")
-    
-    if diagnosis:
-        prescription_parts.append(f"DIAGNOSIS:\n{diagnosis}")
-    
-    if medications:
-        prescription_parts.append(f"PRESCRIPTION (Rx):\n{medications}")
-    
-    if instructions:
-        prescription_parts.append(f"INSTRUCTIONS:\n{instructions}")
-    
-    if follow_up:
-        prescription_parts.append(f"FOLLOW-UP:\n{follow_up}")
-    
-    full_prescription = "\n\n".join(prescription_parts)
-    
-    appointment.prescription = full_prescription
+
+    diagnosis = request.POST.get('diagnosis', '').strip()
+    max_length = Appointment._meta.get_field('diagnosis').max_length
+    if len(diagnosis) > max_length:
+        return JsonResponse({
+            'success': False,
+            'error': f'The diagnosis is {len(diagnosis)} characters long; keep it to {max_length} and put '
+                     f'the details under chief complaint or instructions.',
+        }, status=400)
+
+    appointment.set_prescription(
+        chief_complaint=request.POST.get('chief_complaint', '').strip(),
+        diagnosis=diagnosis,
+        medications=request.POST.get('medications', '').strip(),
+        instructions=request.POST.get('instructions', '').strip(),
+        follow_up=request.POST.get('follow_up', '').strip(),
+    )
     
 
     if mark_complete:
@@ -396,180 +432,91 @@ def save_prescription(request, appointment_id):
     else:
         appointment.completion_status = 'incomplete'
     
-    appointment.save()
+    def save():
+        appointment.save()
+        appointment.sync_medication_lines()
+
+    try:
+        run_write(save)
+    except WriteQueueTimeout:
+        return JsonResponse({
+            'success': False,
+            'error': 'The server is busy and the prescription was not saved. Please try again.',
+        }, status=503)
+    pdf_cache.invalidate(appointment.appointment_id)
     
     return JsonResponse({'success': True, 'message': 'Prescription saved successfully'})
 
+def _catalogue_etag(request, *args, **kwargs):
+    return CATALOGUE_VERSION
+
+
 @login_required
-def get_prescription_data(request, appointment_id):
+@condition(etag_func=_catalogue_etag)
+def get_prescription_data(request, appointment_id=None):
     """Get prescription templates and drug database for the modal"""
     if not hasattr(request.user, 'vet'):
         return JsonResponse({'error': 'Unauthorized'}, status=403)
-    
 
-    templates = {
-        'antibiotics': {
-            'name': 'Bacterial Infection',
-            'diagnosis': 'Bacterial infection',
-            'medications': '''1. Amoxicillin 250mg
-   Sig: Give 1 capsule by mouth twice daily for 10 days
-   
-2. Probiotics
-   Sig: Give 1 capsule by mouth once daily during antibiotic treatment''',
-            'instructions': 'Give with food to reduce stomach upset. Complete full course even if symptoms improve.',
-            'follow_up': 'Return in 10-14 days for recheck if symptoms persist'
-        },
-        'pain_inflammation': {
-            'name': 'Pain & Inflammation',
-            'diagnosis': 'Pain and inflammation',
-            'medications': '''1. Carprofen 75mg
-   Sig: Give 1 tablet by mouth once daily with food for 5-7 days
-   
-2. Gabapentin 100mg (if severe pain)
-   Sig: Give 1 capsule by mouth twice daily as needed''',
-            'instructions': 'Monitor for appetite changes or vomiting. Discontinue if side effects occur.',
-            'follow_up': 'Return if no improvement in 3-5 days or if condition worsens'
-        },
-        'skin_condition': {
-            'name': 'Skin Condition',
-            'diagnosis': 'Dermatitis/skin irritation',
-            'medications': '''1. Medicated shampoo
-   Sig: Bathe twice weekly, leave on for 10 minutes before rinsing
-   
-2. Topical cream
-   Sig: Apply thin layer to affected areas twice daily''',
-            'instructions': 'Keep area clean and dry. Prevent licking with cone if necessary.',
-            'follow_up': 'Return in 7-10 days for progress evaluation'
-        },
-        'dental': {
-            'name': 'Dental Care',
-            'diagnosis': 'Dental disease/tartar buildup',
-            'medications': '''1. Dental chews (prescription)
-   Sig: Give 1 chew daily
-   
-2. Oral rinse
-   Sig: Add to water bowl as directed''',
-            'instructions': 'Begin regular tooth brushing routine. Avoid hard bones or toys.',
-            'follow_up': 'Schedule dental cleaning in 6 months'
-        },
-        'parasite': {
-            'name': 'Parasite Treatment',
-            'diagnosis': 'Intestinal parasites',
-            'medications': '''1. Deworming medication
-   Sig: Give as directed based on body weight
-   
-2. Fecal exam in 2-3 weeks''',
-            'instructions': 'Pick up stool immediately. Wash hands after handling pet.',
-            'follow_up': 'Bring fresh stool sample in 2-3 weeks for recheck'
-        },
-        'allergy': {
-            'name': 'Allergy Management',
-            'diagnosis': 'Environmental allergies',
-            'medications': '''1. Apoquel 5.4mg
-   Sig: Give 1 tablet by mouth twice daily for 7 days, then once daily
-   
-2. Antihistamine
-   Sig: Give 1 tablet by mouth once daily as needed for itching''',
-            'instructions': 'Reduce exposure to allergens. Bathe weekly with hypoallergenic shampoo.',
-            'follow_up': 'Return in 3-4 weeks for progress evaluation'
-        },
-        'ear_infection': {
-            'name': 'Ear Infection',
-            'diagnosis': 'Otitis externa',
-            'medications': '''1. Ear cleaner
-   Sig: Clean ears twice weekly
-   
-2. Antibiotic/steroid ear drops
-   Sig: Apply 5 drops in affected ear twice daily for 7 days''',
-            'instructions': 'Keep ears dry. Do not use cotton swabs in ear canal.',
-            'follow_up': 'Return in 7-10 days for recheck'
-        },
-        'anxiety': {
-            'name': 'Anxiety Treatment',
-            'diagnosis': 'Generalized anxiety',
-            'medications': '''1. Trazodone 100mg
-   Sig: Give 1/2 to 1 tablet by mouth as needed for anxiety
-   
-2. Adaptil diffuser
-   Sig: Use continuously in main living area''',
-            'instructions': 'Provide safe space. Use calming music during stressful events.',
-            'follow_up': 'Return in 4 weeks for behavior assessment'
-        }
-    }
-    
-    # Expanded medications database
-    medications_db = [
-        {'name': 'Acepromazine', 'strengths': ['10mg', '25mg'], 'type': 'Sedative'},
-    {'name': 'Amoxicillin', 'strengths': ['250mg', '500mg'], 'type': 'Antibiotic'},
-    {'name': 'Amitriptyline', 'strengths': ['10mg', '25mg'], 'type': 'Behavioral'},
-    {'name': 'Apoquel', 'strengths': ['3.6mg', '5.4mg', '16mg'], 'type': 'Anti-itch'},
-    {'name': 'Benazepril', 'strengths': ['2.5mg', '5mg', '10mg', '20mg'], 'type': 'Cardiac'},
-    {'name': 'Bravecto', 'strengths': ['112.5mg', '250mg', '500mg'], 'type': 'Flea/Tick Prevention'},
-    {'name': 'Buprenorphine', 'strengths': ['0.3mg/ml'], 'type': 'Pain Management'},
-    {'name': 'Butorphanol', 'strengths': ['5mg/ml', '10mg/ml'], 'type': 'Pain Management'},
-    {'name': 'Carprofen', 'strengths': ['25mg', '75mg', '100mg'], 'type': 'Anti-inflammatory'},
-    {'name': 'Cefpodoxime', 'strengths': ['100mg', '200mg'], 'type': 'Antibiotic'},
-    {'name': 'Cephalexin', 'strengths': ['250mg', '500mg'], 'type': 'Antibiotic'},
-    {'name': 'Cerenia', 'strengths': ['16mg', '24mg', '60mg'], 'type': 'Anti-nausea'},
-    {'name': 'Chloramphenicol', 'strengths': ['100mg', '250mg', '500mg'], 'type': 'Antibiotic'},
-    {'name': 'Clavamox', 'strengths': ['62.5mg', '125mg', '250mg'], 'type': 'Antibiotic'},
-    {'name': 'Clindamycin', 'strengths': ['25mg', '75mg', '150mg'], 'type': 'Antibiotic'},
-    {'name': 'Cyclosporine', 'strengths': ['10mg', '25mg', '50mg', '100mg'], 'type': 'Immunosuppressant'},
-    {'name': 'Denamarin', 'strengths': ['100mg', '225mg'], 'type': 'Liver Support'},
-    {'name': 'Diazepam', 'strengths': ['2mg', '5mg', '10mg'], 'type': 'Behavioral'},
-    {'name': 'Diphenhydramine', 'strengths': ['25mg'], 'type': 'Antihistamine'},
-    {'name': 'Doxycycline', 'strengths': ['50mg', '100mg'], 'type': 'Antibiotic'},
-    {'name': 'Enalapril', 'strengths': ['2.5mg', '5mg', '10mg', '20mg'], 'type': 'Cardiac'},
-    {'name': 'Enrofloxacin', 'strengths': ['22.7mg', '68mg'], 'type': 'Antibiotic'},
-    {'name': 'Famotidine', 'strengths': ['10mg'], 'type': 'Stomach Protection'},
-    {'name': 'Fluoxetine', 'strengths': ['10mg', '20mg'], 'type': 'Behavioral'},
-    {'name': 'Furosemide', 'strengths': ['12.5mg', '25mg', '50mg'], 'type': 'Diuretic'},
-    {'name': 'Gabapentin', 'strengths': ['100mg', '300mg'], 'type': 'Pain Management'},
-    {'name': 'Glipizide', 'strengths': ['5mg'], 'type': 'Diabetes'},
-    {'name': 'Hydrochlorothiazide', 'strengths': ['12.5mg', '25mg'], 'type': 'Diuretic'},
-    {'name': 'Hydroxyzine', 'strengths': ['10mg', '25mg'], 'type': 'Antihistamine'},
-    {'name': 'Insulin (Vetsulin)', 'strengths': ['40U/ml'], 'type': 'Diabetes'},
-    {'name': 'Itraconazole', 'strengths': ['100mg'], 'type': 'Antifungal'},
-    {'name': 'Ivermectin', 'strengths': ['68mcg', '136mcg'], 'type': 'Heartworm Prevention'},
-    {'name': 'Ketoconazole', 'strengths': ['200mg'], 'type': 'Antifungal'},
-    {'name': 'Levetiracetam', 'strengths': ['250mg', '500mg'], 'type': 'Seizure'},
-    {'name': 'Marbofloxacin', 'strengths': ['25mg', '50mg', '100mg'], 'type': 'Antibiotic'},
-    {'name': 'Maropitant', 'strengths': ['16mg', '24mg', '60mg'], 'type': 'Anti-nausea'},
-    {'name': 'Meloxicam', 'strengths': ['1.5mg/ml'], 'type': 'Anti-inflammatory'},
-    {'name': 'Metronidazole', 'strengths': ['250mg', '500mg'], 'type': 'Antibiotic/Anti-diarrheal'},
-    {'name': 'Methimazole', 'strengths': ['2.5mg', '5mg'], 'type': 'Thyroid'},
-    {'name': 'Milbemycin', 'strengths': ['2.3mg', '5.75mg', '11.5mg'], 'type': 'Heartworm Prevention'},
-    {'name': 'Mirtazapine', 'strengths': ['7.5mg', '15mg'], 'type': 'Appetite Stimulant'},
-    {'name': 'Omeprazole', 'strengths': ['10mg', '20mg'], 'type': 'Stomach Protection'},
-    {'name': 'Ondansetron', 'strengths': ['4mg', '8mg'], 'type': 'Anti-nausea'},
-    {'name': 'Orbifloxacin', 'strengths': ['5.7mg', '22.7mg', '68mg'], 'type': 'Antibiotic'},
-    {'name': 'Phenobarbital', 'strengths': ['16.2mg', '32.4mg', '64.8mg'], 'type': 'Seizure'},
-    {'name': 'Pimobendan', 'strengths': ['1.25mg', '2.5mg', '5mg'], 'type': 'Cardiac'},
-    {'name': 'Praziquantel', 'strengths': ['34mg', '136mg'], 'type': 'Dewormer'},
-    {'name': 'Prednisone', 'strengths': ['5mg', '10mg', '20mg'], 'type': 'Steroid'},
-    {'name': 'Pyrantel', 'strengths': ['50mg/ml'], 'type': 'Dewormer'},
-    {'name': 'Revolution', 'strengths': ['15mg', '30mg', '45mg'], 'type': 'Parasite Prevention'},
-    {'name': 'Rimadyl', 'strengths': ['25mg', '75mg', '100mg'], 'type': 'Anti-inflammatory'},
-    {'name': 'Samylin', 'strengths': ['100mg', '200mg'], 'type': 'Liver Support'},
-    {'name': 'Sildenafil', 'strengths': ['20mg', '25mg', '50mg', '100mg'], 'type': 'Cardiac'},
-    {'name': 'Simparica', 'strengths': ['5mg', '10mg', '20mg'], 'type': 'Flea/Tick Prevention'},
-    {'name': 'Spironolactone', 'strengths': ['25mg', '50mg', '100mg'], 'type': 'Diuretic'},
-    {'name': 'Sucralfate', 'strengths': ['1g'], 'type': 'Stomach Protection'},
-    {'name': 'Terbinafine', 'strengths': ['250mg'], 'type': 'Antifungal'},
-    {'name': 'Tramadol', 'strengths': ['50mg'], 'type': 'Pain Management'},
-    {'name': 'Trazodone', 'strengths': ['50mg', '100mg'], 'type': 'Behavioral'},
-    {'name': 'Thyroxine', 'strengths': ['0.1mg', '0.2mg', '0.3mg', '0.4mg', '0.5mg', '0.6mg', '0.7mg', '0.8mg'], 'type': 'Thyroid'},
-    {'name': 'Yunnan Baiyao', 'strengths': ['250mg'], 'type': 'Hemostatic'}
-    ]
-    
-    return JsonResponse({
-        'templates': templates,
-        'medications': medications_db,
-        'success': True
-    })
+    # the catalogue is only ever replaced on deploy, so a request for the
+    # current version can be cached for good; anything else revalidates
+    if request.GET.get('v') == CATALOGUE_VERSION:
+        cache_control = 'private, max-age=31536000, immutable'
+    else:
+        cache_control = 'private, no-cache'
+
+    response = HttpResponse(CATALOGUE_JSON, content_type='application/json')
+    response['Cache-Control'] = cache_control
+    return response
+
+
+@login_required
+def search_medications(request):
+    """Medication autocomplete: ?q=name [strength]&type=&strength=&limit="""
+    if not hasattr(request.user, 'vet'):
+        return JsonResponse({'error': 'Unauthorized'}, status=403)
+
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 10)), 50))
+    except ValueError:
+        limit = 10
+
+    results = medication_index.search(
+        request.GET.get('q', ''),
+        drug_type=request.GET.get('type'),
+        strength=request.GET.get('strength'),
+        limit=limit,
+    )
+    return JsonResponse({'results': results})
+
+
+def _basic_auth_user(request):
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme.lower() != 'basic':
+        return None
+    try:
+        username, _, password = base64.b64decode(credentials).decode('utf-8').partition(':')
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    return authenticate(request, username=username, password=password)
+
+
+def metrics_view(request):
+    """
+    Prometheus metrics for every worker on this host, for staff only.
+    Scrapers, which cannot log in, send a staff user's credentials with
+    HTTP Basic auth.
+    """
+    user = request.user if request.user.is_staff else _basic_auth_user(request)
+    if user is None or not user.is_staff:
+        response = HttpResponse('Staff credentials required.\n', status=401, content_type='text/plain')
+        response['WWW-Authenticate'] = 'Basic realm="metrics"'
+        return response
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 #EMAIL
+@metrics.records_email('cancellation')
 def send_cancellation_email(appointment):
     subject = "Your Appointment Has Been Cancelled"
 
@@ -585,14 +532,9 @@ The Crescent Veterinary Clinic Team
 """
 
     recipient_list = [appointment.email]
-    send_mail(
-        subject,
-        message,
-        None,
-        recipient_list,
-        fail_silently=True
-    )
+    return queue_email(subject, message, recipient_list)
 
+@metrics.records_email('completed')
 def send_completed_email(appointment):
     subject = "Your Appointment is Completed!"
 
@@ -611,14 +553,9 @@ The Crescent Veterinary Clinic Team
 """
 
     recipient_list = [appointment.email]
-    send_mail(
-        subject,
-        message,
-        None,  
-        recipient_list,
-        fail_silently=True
-    )
+    return queue_email(subject, message, recipient_list)
 
+@metrics.records_email('confirmation')
 def send_confirmation_email(appointment):
     subject = "Your Appointment is Confirmed"
     
@@ -643,13 +580,7 @@ The Crescent Veterinary Clinic Team
 """
 
     recipient_list = [appointment.email]
-    send_mail(
-        subject,
-        message,
-        None,  
-        recipient_list,
-        fail_silently=True
-    )
+    return queue_email(subject, message, recipient_list)
     
     
 @login_required
@@ -659,37 +590,16 @@ def get_existing_prescription(request, appointment_id):
         return JsonResponse({'error': 'Unauthorized'}, status=403)
     
     appointment = get_object_or_404(Appointment, appointment_id=appointment_id)
-    if appointment.assigned_doctor != request.user.vet:
+    if appointment.assigned_doctor_id != request.user.vet.pk:
         return JsonResponse({'error': 'Not your appointment'}, status=403)
     
 
-    prescription_text = appointment.prescription
-    chief_complaint = ""
-    diagnosis = ""
-    medications = ""
-    instructions = ""
-    follow_up = ""
-    
-    if prescription_text:
-        parts = prescription_text.split('\n\n')
-        for part in parts:
-            if part.startswith('CHIEF COMPLAINT:'):
-                chief_complaint = part.replace('CHIEF COMPLAINT:\n', '')
-            elif part.startswith('DIAGNOSIS:'):
-                diagnosis = part.replace('DIAGNOSIS:\n', '')
-            elif part.startswith('PRESCRIPTION (Rx):'):
-                medications = part.replace('PRESCRIPTION (Rx):\n', '')
-            elif part.startswith('INSTRUCTIONS:'):
-                instructions = part.replace('INSTRUCTIONS:\n', '')
-            elif part.startswith('FOLLOW-UP:'):
-                follow_up = part.replace('FOLLOW-UP:\n', '')
-    
     return JsonResponse({
         'prescription': appointment.prescription,
-        'chief_complaint': chief_complaint,
-        'diagnosis': diagnosis,
-        'medications': medications,
-        'instructions': instructions,
-        'follow_up': follow_up,
+        'chief_complaint': appointment.chief_complaint,
+        'diagnosis': appointment.diagnosis,
+        'medications': appointment.medications,
+        'instructions': appointment.instructions,
+        'follow_up': appointment.follow_up,
         'completion_status': appointment.completion_status
     })
\ No newline at end of file
@@ -0,0 +1,175 @@
+"""
+Optional group commit for the busiest SQLite writes.
+
+SQLite lets one connection write at a time. When many request threads
+each open a write transaction, they queue on the database lock. Each
+waiter sleeps and retries, each pays for its own commit, and past the
+busy timeout they fail with "database is locked".
+
+With WRITE_QUEUE_ENABLED, run_write() hands the work to one writer thread
+per process and waits for the result. The writer runs everything queued
+so far (up to WRITE_QUEUE_MAX_BATCH jobs) in a single transaction, with a
+savepoint around each job so that one failing job doesn't undo the
+others. It commits once, then returns each job's result, or raises its
+exception, in the request that submitted it. While one batch commits,
+the next batch builds up.
+
+The bookings in appointment_view, save_prescription, the admin status
+actions and the Profile save on User updates go through run_write().
+A job runs on the writer's own connection. It must not depend on the
+caller's transaction, and its on_commit callbacks run on the writer
+thread. When the caller is already inside a transaction, run_write()
+runs the job inline instead; the queue would deadlock waiting for the
+lock the caller holds. With the queue disabled (the default), run_write()
+is just core.sqlite.write_transaction() around the call.
+
+If a job is still waiting in the queue after WRITE_QUEUE_TIMEOUT
+seconds, it is cancelled and run_write() raises WriteQueueTimeout. Nothing
+was saved, so the caller can answer 503 and the client can safely retry.
+A job the writer has already started is waited for until it finishes:
+giving up then would report a failure for a write that may still commit.
+
+Each worker process has its own writer, so several processes still
+contend on the lock, but each with one connection instead of one per
+request.
+"""
+import os
+import queue
+import threading
+from concurrent import futures
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .sqlite import write_transaction
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class WriteQueueTimeout(Exception):
+    """The job waited longer than WRITE_QUEUE_TIMEOUT and was cancelled unrun."""
+
+
+class _Job:
+    __slots__ = ('function', 'args', 'kwargs', 'future', 'result', 'error')
+
+    def __init__(self, function, args, kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.future = futures.Future()
+        self.result = self.error = None
+
+
+class WriteQueue:
+    def __init__(self):
+        self._jobs = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, function, *args, **kwargs):
+        """Queue `function(*args, **kwargs)` for the writer; returns a Future for its result."""
+        job = _Job(function, args, kwargs)
+        self._ensure_writer()
+        self._jobs.put(job)
+        return job.future
+
+    def stop(self, timeout=None):
+        """
+        Commit what is queued, close the writer's connection and end the
+        thread. The next submit() starts a new writer.
+        """
+        with self._lock:
+            thread = self._thread
+            if thread is None or not thread.is_alive():
+                return
+            self._jobs.put(None)
+        thread.join(timeout)
+
+    def is_writer_thread(self):
+        return threading.current_thread() is self._thread
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # a forked worker inherits the parent's queue but not its thread
+                self._jobs = queue.SimpleQueue()
+                self._pid = os.getpid()
+                self._thread = None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        jobs = self._jobs
+        stopping = False
+        while not stopping:
+            batch = [jobs.get()]
+            max_batch = _setting('WRITE_QUEUE_MAX_BATCH', 64)
+            while len(batch) < max_batch and batch[-1] is not None:
+                try:
+                    batch.append(jobs.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                stopping = True
+            if batch:
+                self._commit(batch)
+        connection.close()
+
+    def _commit(self, batch):
+        # jobs whose caller gave up waiting are dropped; the rest can no longer be cancelled
+        batch = [job for job in batch if job.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            with write_transaction():
+                for job in batch:
+                    try:
+                        with transaction.atomic():
+                            job.result = job.function(*job.args, **job.kwargs)
+                    except Exception as exc:
+                        job.error = exc
+        except Exception as exc:
+            # the commit itself failed, so nothing in the batch was saved
+            for job in batch:
+                job.error = job.error or exc
+            connection.close()
+
+        for job in batch:
+            if job.error is not None:
+                job.future.set_exception(job.error)
+            else:
+                job.future.set_result(job.result)
+
+
+write_queue = WriteQueue()
+
+
+def run_write(function, *args, **kwargs):
+    """
+    Run `function(*args, **kwargs)` in a transaction and return its result,
+    through the write queue when it is enabled.
+
+    Raises WriteQueueTimeout, with nothing saved, when the queue did not
+    start the job within WRITE_QUEUE_TIMEOUT seconds.
+    """
+    if (
+        not _setting('WRITE_QUEUE_ENABLED', False)
+        or connection.in_atomic_block
+        or write_queue.is_writer_thread()
+    ):
+        with write_transaction():
+            return function(*args, **kwargs)
+    future = write_queue.submit(function, *args, **kwargs)
+    try:
+        return future.result(timeout=_setting('WRITE_QUEUE_TIMEOUT', 30))
+    except futures.TimeoutError:
+        if future.cancel():
+            raise WriteQueueTimeout(f'{function!r} was not started in time') from None
+    # already running: its transaction may still commit, so report how it ends
+    return future.result()